@@ -109,6 +109,48 @@ USE_TZ = True
 THUMBNAIL_SIZE_VIDEO = (410, 230)
 THUMBNAIL_SIZE_SUBSCRIPTION = (250, 250)
 
+# Thumbnails are rendered in several sizes (relative to the sizes above), so browsers can pick the one they need
+THUMBNAIL_SCALES = (0.5, 0.75, 1.0)
+THUMBNAIL_QUALITY = 80
+
+# How many thumbnails are fetched in parallel during a synchronization, and how many processes render them
+THUMBNAIL_FETCH_CONCURRENCY = 8
+THUMBNAIL_RENDER_PROCESSES = max(1, (os.cpu_count() or 1) // 2)
+
+# Failed downloads are retried after DOWNLOAD_RETRY_DELAY seconds, doubled after every attempt, up to
+# DOWNLOAD_RETRY_MAX_DELAY. A random part of the delay is taken off, so failures at the same time don't retry together.
+DOWNLOAD_RETRY_DELAY = 60
+DOWNLOAD_RETRY_MAX_DELAY = 6 * 60 * 60
+
+# youtube-dl runs in separate processes, which are replaced after this many downloads (youtube-dl leaks memory)
+DOWNLOAD_PROCESS_MAX_TASKS = 10
+
+# Minimum interval between two progress updates of a download job, in seconds
+DOWNLOAD_PROGRESS_INTERVAL = 5
+
+# When a download size limit is set, youtube-dl is asked for the size of the videos whose size isn't known yet, when their
+# download starts. Each synchronization enqueues at most this many of them; the ones after them wait for the next one.
+DOWNLOAD_SIZE_ESTIMATES_PER_SYNC = 20
+
+# When several server processes share the database, the one holding the scheduler lease runs the scheduler. The lease
+# lasts SCHEDULER_LEASE_DURATION seconds and is renewed every SCHEDULER_LEASE_RENEW_INTERVAL; the other processes
+# hand their jobs over through the database, which is checked every JOB_REQUEST_POLL_INTERVAL.
+SCHEDULER_LEASE_DURATION = 30
+SCHEDULER_LEASE_RENEW_INTERVAL = 10
+JOB_REQUEST_POLL_INTERVAL = 1
+
+# YouTube Data API base URL; None means Google's servers. Useful for testing against a local stand-in server.
+YOUTUBE_API_ENDPOINT = None
+
+# YouTube API response cache (max size in bytes)
+YOUTUBE_API_CACHE_SIZE = 64 * 1024 * 1024
+
+# The YouTube API requests are counted in memory, and written to the database every QUOTA_FLUSH_INTERVAL seconds
+QUOTA_FLUSH_INTERVAL = 60
+
+# Channel and playlist Atom feeds
+YOUTUBE_FEED_URL = 'https://www.youtube.com/feeds/videos.xml'
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
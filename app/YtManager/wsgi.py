@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "YtManager.settings")
 
 application = get_wsgi_application()
+
+from YtManagerApp.appmain import start_server  # noqa: E402 (needs the apps to be loaded)
+
+start_server()
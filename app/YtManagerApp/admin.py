@@ -1,6 +1,20 @@
 from django.contrib import admin
-from .models import SubscriptionFolder, Subscription, Video
+from .models import SubscriptionFolder, Subscription, Video, VideoFile, QuotaUsage
 
 admin.site.register(SubscriptionFolder)
 admin.site.register(Subscription)
 admin.site.register(Video)
+
+
+@admin.register(VideoFile)
+class VideoFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'role', 'size', 'mtime')
+    list_filter = ('role',)
+    search_fields = ('path',)
+
+
+@admin.register(QuotaUsage)
+class QuotaUsageAdmin(admin.ModelAdmin):
+    list_display = ('date', 'endpoint', 'calls', 'units')
+    list_filter = ('endpoint',)
+    date_hierarchy = 'date'
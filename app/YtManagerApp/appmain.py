@@ -6,7 +6,12 @@ import sys
 from django.conf import settings as dj_settings
 
 from .management.appconfig import appconfig
+from .management.download_queue import download_queue
+from .management.jobs.download_video import DownloadVideoJob
 from .management.jobs.synchronize import SynchronizeJob
+from .management.leader import leader_election
+from .management.quota import quota_ledger
+from .management.watcher import download_watcher
 from .scheduler import scheduler
 from django.db.utils import OperationalError
 
@@ -32,16 +37,48 @@ def __initialize_logger():
         logging.root.addHandler(console_handler)
 
 
+def __start_leader():
+    scheduler.initialize()
+    download_queue.start()
+    DownloadVideoJob.schedule_retries()
+    SynchronizeJob.schedule_global_job()
+    download_watcher.update()
+
+
+def __stop_leader():
+    # Called from the election thread, so nothing here may wait for the running jobs or downloads to finish
+    scheduler.pause()
+    download_watcher.stop()
+    download_queue.stop()
+
+
+def start_scheduler():
+    """
+    Starts the scheduler, the download queue and the download watcher, if this process wins the election; with several
+    server processes (e.g. gunicorn workers), only one of them runs them.
+    """
+    leader_election.start(__start_leader, __stop_leader)
+
+
 def main():
     __initialize_logger()
+    logging.info('Initialization complete.')
+
+
+def start_server():
+    """
+    Starts the background services of a server process. Management commands (migrate, shell, test...) don't call
+    this, so a short lived process never takes over the scheduler from the running server.
+    """
+    # Every server process makes API requests (e.g. adding subscriptions), so every one writes down the quota it used
+    quota_ledger.start()
 
     try:
         if appconfig.initialized:
-            scheduler.initialize()
-            SynchronizeJob.schedule_global_job()
+            start_scheduler()
     except OperationalError:
-        # Settings table is not created when running migrate or makemigrations;
+        # Settings table is not created until migrate runs;
         # Just don't do anything in this case.
         pass
 
-    logging.info('Initialization complete.')
+    logging.info('Server started.')
@@ -1,3 +1,5 @@
+import sys
+
 from django.apps import AppConfig
 
 
@@ -5,6 +7,11 @@ class YtManagerAppConfig(AppConfig):
     name = 'YtManagerApp'
 
     def ready(self):
-        # Run server using --noreload to avoid having the scheduler run on 2 different processes
-        from .appmain import main
+        from .appmain import main, start_server
         main()
+
+        # The WSGI server (gunicorn) starts the background services from wsgi.py; the development server is the only
+        # management command which does.
+        # Run server using --noreload to avoid having the scheduler run on 2 different processes
+        if sys.argv[1:2] == ['runserver']:
+            start_server()
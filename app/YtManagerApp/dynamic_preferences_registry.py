@@ -31,6 +31,14 @@ class YouTubeAPIKey(StringPreference):
     required = True
 
 
+@global_preferences_registry.register
+class YouTubeAPIDailyQuota(IntegerPreference):
+    section = general
+    name = 'youtube_api_daily_quota'
+    default = 10000
+    required = True
+
+
 @global_preferences_registry.register
 class AllowRegistrations(BooleanPreference):
     section = general
@@ -47,6 +55,46 @@ class SyncSchedule(StringPreference):
     required = True
 
 
+@global_preferences_registry.register
+class DeepSyncSchedule(StringPreference):
+    section = scheduler
+    name = 'deep_synchronization_schedule'
+    default = '35 3 * * 0'  # weekly
+    required = True
+
+
+@global_preferences_registry.register
+class IncrementalSyncStopCount(IntegerPreference):
+    section = scheduler
+    name = 'incremental_sync_stop_count'
+    default = 10
+    required = True
+
+
+@global_preferences_registry.register
+class SyncFeedPrecheck(BooleanPreference):
+    section = scheduler
+    name = 'synchronization_feed_precheck'
+    default = True
+    required = True
+
+
+@global_preferences_registry.register
+class SyncAdaptive(BooleanPreference):
+    section = scheduler
+    name = 'synchronization_adaptive'
+    default = True
+    required = True
+
+
+@global_preferences_registry.register
+class WatchDownloads(BooleanPreference):
+    section = scheduler
+    name = 'watch_downloads'
+    default = False
+    required = True
+
+
 @global_preferences_registry.register
 class SchedulerConcurrency(IntegerPreference):
     section = scheduler
@@ -55,6 +103,38 @@ class SchedulerConcurrency(IntegerPreference):
     required = True
 
 
+@global_preferences_registry.register
+class SyncConcurrency(IntegerPreference):
+    section = scheduler
+    name = 'synchronization_concurrency'
+    default = 4
+    required = True
+
+
+@global_preferences_registry.register
+class DownloadConcurrency(IntegerPreference):
+    section = scheduler
+    name = 'download_concurrency'
+    default = 2
+    required = True
+
+
+@global_preferences_registry.register
+class DownloadRateLimit(IntegerPreference):
+    section = scheduler
+    name = 'download_rate_limit'
+    default = 0
+    required = True
+
+
+@global_preferences_registry.register
+class DownloadWindows(StringPreference):
+    section = scheduler
+    name = 'download_windows'
+    default = ''
+    required = False
+
+
 # User settings
 @user_preferences_registry.register
 class MarkDeletedAsWatched(BooleanPreference):
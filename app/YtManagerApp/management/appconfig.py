@@ -1,5 +1,8 @@
 from dynamic_preferences.registries import global_preferences_registry
-from YtManagerApp.dynamic_preferences_registry import Initialized, YouTubeAPIKey, AllowRegistrations, SyncSchedule, SchedulerConcurrency
+from YtManagerApp.dynamic_preferences_registry import Initialized, YouTubeAPIKey, YouTubeAPIDailyQuota, AllowRegistrations, SyncSchedule, SchedulerConcurrency, \
+    DeepSyncSchedule, IncrementalSyncStopCount, SyncConcurrency, \
+    SyncFeedPrecheck, SyncAdaptive, WatchDownloads, DownloadConcurrency, \
+    DownloadRateLimit, DownloadWindows
 
 
 class AppConfig(object):
@@ -7,9 +10,19 @@ class AppConfig(object):
     props = {
         'initialized': Initialized,
         'youtube_api_key': YouTubeAPIKey,
+        'youtube_api_daily_quota': YouTubeAPIDailyQuota,
         'allow_registrations': AllowRegistrations,
         'sync_schedule': SyncSchedule,
-        'concurrency': SchedulerConcurrency
+        'deep_sync_schedule': DeepSyncSchedule,
+        'incremental_sync_stop_count': IncrementalSyncStopCount,
+        'sync_feed_precheck': SyncFeedPrecheck,
+        'sync_adaptive': SyncAdaptive,
+        'watch_downloads': WatchDownloads,
+        'concurrency': SchedulerConcurrency,
+        'sync_concurrency': SyncConcurrency,
+        'download_concurrency': DownloadConcurrency,
+        'download_rate_limit': DownloadRateLimit,
+        'download_windows': DownloadWindows,
     }
 
     # Init
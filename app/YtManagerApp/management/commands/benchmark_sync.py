@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.management.jobs.synchronize import SynchronizeJob
+from YtManagerApp.models import Subscription, Video, VideoFile, JobExecution
+from YtManagerApp.utils.fake_youtube import FakeYoutubeData, FakeYoutubeServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss() -> int:
+    """
+    Gets the peak resident set size of the whole process since it started, in bytes (0 if not available on this
+    platform).
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ListingCounter(object):
+    """
+    Counts the directory listings (os.scandir and os.listdir calls) made while active.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.__scandir = None
+        self.__listdir = None
+
+    def __counted(self, func):
+        def wrapper(*args, **kwargs):
+            self.count += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self.__scandir, self.__listdir = os.scandir, os.listdir
+        os.scandir = self.__counted(self.__scandir)
+        os.listdir = self.__counted(self.__listdir)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        os.scandir, os.listdir = self.__scandir, self.__listdir
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the synchronization against a local stand-in for the YouTube API, using a test database. ' \
+           'Runs a full synchronization, uploads a few new videos, then runs an incremental synchronization.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channels', type=int, default=20, help='Number of subscribed channels')
+        parser.add_argument('--videos', type=int, default=200, help='Number of videos in each channel')
+        parser.add_argument('--videos-max', type=int, default=None,
+                            help='If given, each channel gets a random number of videos between --videos and this')
+        parser.add_argument('--new-videos', type=int, default=2,
+                            help='Number of videos uploaded to each active channel before the incremental sync')
+        parser.add_argument('--active-channels', type=float, default=0.2,
+                            help='Fraction of the channels which upload new videos before the incremental sync')
+        parser.add_argument('--latency', type=float, default=0.02, help='Latency of every API request, in seconds')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of subscriptions fetched in parallel')
+        parser.add_argument('--downloaded', type=int, default=20,
+                            help='Number of downloaded videos in each channel during the incremental sync')
+        parser.add_argument('--no-feed-precheck', action='store_true', help='Disable the channel feed checks')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--data-dir', default=None,
+                            help='Folder for the benchmark database, API response cache and downloaded files; by '
+                                 'default, a temporary folder which is deleted afterwards')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['videos_max'] is not None:
+            videos_per_channel = (options['videos'], options['videos_max'])
+        else:
+            videos_per_channel = options['videos']
+
+        data = FakeYoutubeData.generate(options['channels'], videos_per_channel, seed=options['seed'])
+        if options['data_dir'] is not None:
+            work_dir = options['data_dir']
+            os.makedirs(work_dir, exist_ok=True)
+        else:
+            work_dir = tempfile.mkdtemp(prefix='ytsm_benchmark_')
+
+        # Use a file for SQLite databases, an in-memory database would not be representative
+        db_settings = connection.settings_dict
+        if db_settings['ENGINE'].endswith('sqlite3'):
+            db_settings.setdefault('TEST', {})['NAME'] = os.path.join(work_dir, 'benchmark.db')
+
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with FakeYoutubeServer(data, latency=options['latency']) as server, \
+                    override_settings(YOUTUBE_API_ENDPOINT=server.api_endpoint,
+                                      YOUTUBE_FEED_URL=server.feed_url,
+                                      DATA_DIR=work_dir,
+                                      MEDIA_ROOT=os.path.join(work_dir, 'media')):
+                results = self.run_benchmark(data, server, work_dir, options)
+        finally:
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            if options['data_dir'] is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_results(results)
+
+    def run_benchmark(self, data: FakeYoutubeData, server: FakeYoutubeServer, work_dir: str, options):
+        # Preferences may still be cached from the real database
+        cache.clear()
+        appconfig.initialized = True
+        appconfig.youtube_api_key = 'benchmark'
+        appconfig.youtube_api_daily_quota = 0
+        appconfig.sync_concurrency = options['concurrency']
+        appconfig.sync_feed_precheck = not options['no_feed_precheck']
+
+        user = User.objects.create_user('benchmark')
+        user.preferences['auto_download'] = False
+
+        Subscription.objects.bulk_create(
+            Subscription(name=channel.title, playlist_id=channel.uploads_playlist_id, description='',
+                         channel_id=channel.id, channel_name=channel.title,
+                         thumbnail=f'{server.base_url}/thumbnails/{channel.id}.jpg',
+                         user=user, rewrite_playlist_indices=True)
+            for channel in data.channels.values())
+
+        results = {
+            'channels': len(data.channels),
+            'videos': len(data.videos),
+            'latency': options['latency'],
+            'concurrency': options['concurrency'],
+            'runs': [],
+        }
+
+        results['runs'].append(self.measure('full', SynchronizeJob, server, deep=True))
+
+        channels = list(data.channels.values())
+        active_count = round(len(channels) * options['active_channels'])
+        for channel in data.random.sample(channels, active_count):
+            data.add_videos(channel, options['new_videos'])
+        data.update_views()
+        self.create_downloads(os.path.join(work_dir, 'downloads'), options['downloaded'])
+
+        results['runs'].append(self.measure('incremental', SynchronizeJob, server, deep=False))
+        results['videos_in_database'] = Video.objects.count()
+        # Only the peak of the whole process is known, so it isn't reported for each run
+        results['peak_rss'] = get_peak_rss()
+        return results
+
+    def create_downloads(self, download_dir: str, count: int):
+        """
+        Creates fake downloaded files (video, thumbnail and subtitles) for the newest videos of each subscription,
+        one directory per subscription, and catalogs them.
+        """
+        for sub in Subscription.objects.all():
+            directory = os.path.join(download_dir, sub.channel_id)
+            os.makedirs(directory, exist_ok=True)
+
+            videos = list(Video.objects.filter(subscription=sub).order_by('-publish_date')[:count])
+            for video in videos:
+                for extension in ('.mp4', '.jpg', '.en.vtt'):
+                    open(os.path.join(directory, video.video_id + extension), 'wb').close()
+                video.downloaded_path = os.path.join(directory, video.video_id)
+
+            Video.objects.bulk_update(videos, ['downloaded_path'])
+            VideoFile.objects.bulk_create(file for video in videos for file in video.scan_files())
+
+    def measure(self, name: str, job_class, server: FakeYoutubeServer, **job_kwargs) -> dict:
+        server.reset_counts()
+        job = job_class(JobExecution.objects.create(description=f'Benchmark: {name} synchronization'), **job_kwargs)
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries), ListingCounter() as listings:
+            start = time.perf_counter()
+            job.run()
+            wall_time = time.perf_counter() - start
+
+        calls = server.reset_counts()
+        return {
+            'name': name,
+            'wall_time': wall_time,
+            'api_calls': {endpoint: count for endpoint, count in calls.items()
+                          if endpoint not in ('thumbnails', 'feeds')},
+            'feed_requests': calls.get('feeds', 0),
+            'thumbnail_requests': calls.get('thumbnails', 0),
+            'db_queries': queries.count,
+            'directory_listings': listings.count,
+        }
+
+    def print_results(self, results: dict):
+        self.stdout.write(f"{results['channels']} channels, {results['videos']} videos, "
+                          f"latency {results['latency'] * 1000:.0f} ms, concurrency {results['concurrency']}")
+        self.stdout.write('')
+        self.stdout.write(f"{'Run':<12} {'Wall time':>10} {'API calls':>10} {'Feeds':>7} {'Thumbs':>7} "
+                          f"{'DB queries':>11} {'Listings':>9}")
+        for run in results['runs']:
+            self.stdout.write(f"{run['name']:<12} {run['wall_time']:>9.2f}s {sum(run['api_calls'].values()):>10} "
+                              f"{run['feed_requests']:>7} {run['thumbnail_requests']:>7} {run['db_queries']:>11} "
+                              f"{run['directory_listings']:>9}")
+
+        self.stdout.write('')
+        for run in results['runs']:
+            calls = ', '.join(f'{endpoint}: {count}' for endpoint, count in sorted(run['api_calls'].items()))
+            self.stdout.write(f"{run['name']} API calls: {calls or 'none'}")
+
+        self.stdout.write('')
+        self.stdout.write(f"Peak RSS of the process (all runs): {results['peak_rss'] / 1024 / 1024:.1f}MB")
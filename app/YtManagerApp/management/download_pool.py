@@ -0,0 +1,194 @@
+import itertools
+import logging
+import multiprocessing
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import connection
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.utils import download_process
+
+# How long to wait for the last messages of a task, after it returned
+TASK_MESSAGES_TIMEOUT = 5
+
+# ProcessPoolExecutor only replaces its workers by itself (max_tasks_per_child) starting with Python 3.11; before that,
+# the whole pool is replaced after DOWNLOAD_PROCESS_MAX_TASKS tasks per worker
+POOL_REPLACES_WORKERS = sys.version_info >= (3, 11)
+
+
+class DownloadPool(object):
+    """
+    Pool of processes running youtube-dl (see utils.download_process). Workers are replaced after
+    DOWNLOAD_PROCESS_MAX_TASKS tasks, so the memory youtube-dl leaks is given back; a worker which crashes only fails
+    the task it was running.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__executor = None  # type: Optional[ProcessPoolExecutor]
+        self.__messages = None
+        # Tasks submitted to the current executor, when the pool is replaced by hand (see POOL_REPLACES_WORKERS)
+        self.__submitted = 0
+        self.__max_workers = 0
+        # task ID -> (logger, progress callback, event set after the last message)
+        self.__tasks = {}  # type: Dict[int, tuple]
+        self.__task_ids = itertools.count(1)
+        self.log = logging.getLogger('download_pool')
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__executor is None:
+                # Forking a process with running threads is unsafe
+                context = multiprocessing.get_context('spawn')
+                # A replaced executor keeps the message queue, since its last tasks may still be running
+                if self.__messages is None:
+                    self.__messages = context.Queue()
+                    threading.Thread(target=self.__dispatch_messages, args=(self.__messages,),
+                                     name='DownloadPool-messages', daemon=True).start()
+
+                self.__max_workers = appconfig.download_concurrency + 1
+                options = {}
+                if POOL_REPLACES_WORKERS:
+                    options['max_tasks_per_child'] = settings.DOWNLOAD_PROCESS_MAX_TASKS
+                # One more worker than the download queue uses, so size estimates don't wait for downloads to finish
+                self.__executor = ProcessPoolExecutor(max_workers=self.__max_workers,
+                                                      mp_context=context,
+                                                      initializer=download_process.init_worker,
+                                                      initargs=(self.__messages,),
+                                                      **options)
+                self.__submitted = 0
+            return self.__executor
+
+    def __dispatch_messages(self, messages):
+        while True:
+            batch = [messages.get()]
+            # Take whatever else is waiting too, so the connection is closed once per batch
+            try:
+                while batch[-1] is not None:
+                    batch.append(messages.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                for message in batch:
+                    if message is None:
+                        return
+                    self.__dispatch(*message)
+            finally:
+                # The progress callbacks write to the database; this thread lives as long as the pool, so it must not
+                # hold on to a connection
+                connection.close()
+
+    def __dispatch(self, task_id: int, kind: str, payload):
+        task = self.__tasks.get(task_id)
+        if task is None:
+            return
+        logger, on_progress, finished = task
+
+        if kind == download_process.MESSAGE_LOG:
+            level, text = payload
+            logger.log(level, '%s', text)
+        elif kind == download_process.MESSAGE_PROGRESS and on_progress is not None:
+            try:
+                on_progress(payload)
+            except Exception:
+                self.log.exception('Progress callback of task %d failed.', task_id)
+        elif kind == download_process.MESSAGE_FINISHED:
+            finished.set()
+
+    def __reset(self, executor: ProcessPoolExecutor):
+        with self.__lock:
+            if self.__executor is executor:
+                self.__executor = None
+                # Stops the message dispatcher; a new queue comes with the next executor
+                self.__messages.put(None)
+                self.__messages = None
+        executor.shutdown(wait=False)
+
+    def __count_submitted(self, executor: ProcessPoolExecutor):
+        """
+        Replaces the executor after DOWNLOAD_PROCESS_MAX_TASKS tasks per worker, on the Python versions where it
+        can't replace its workers by itself. The tasks already submitted finish in the old worker processes.
+        """
+        if POOL_REPLACES_WORKERS:
+            return
+
+        with self.__lock:
+            if self.__executor is not executor:
+                return
+            self.__submitted += 1
+            if self.__submitted < settings.DOWNLOAD_PROCESS_MAX_TASKS * self.__max_workers:
+                return
+            self.__executor = None
+
+        executor.shutdown(wait=False)
+
+    def __run(self, function, url: str, params: dict, logger: logging.Logger,
+              on_progress: Optional[Callable[[dict], None]] = None) -> Optional[dict]:
+        task_id = next(self.__task_ids)
+        finished = threading.Event()
+        self.__tasks[task_id] = (logger, on_progress, finished)
+        executor = self.__get_executor()
+        try:
+            try:
+                future = executor.submit(function, task_id, url, params)
+            except RuntimeError as e:
+                # The executor was shut down in the meantime (see __reset and shutdown); same as a broken pool
+                raise BrokenProcessPool(str(e)) from e
+            self.__count_submitted(executor)
+            result = future.result()
+            finished.wait(TASK_MESSAGES_TIMEOUT)
+            return result
+        except BrokenProcessPool as e:
+            self.log.error('A youtube-dl process stopped unexpectedly. Error: %s', e)
+            self.__reset(executor)
+            return None
+        finally:
+            del self.__tasks[task_id]
+
+    def download(self, url: str, params: dict, logger: logging.Logger,
+                 on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Downloads a video in a worker process, and waits for it to finish.
+        :param url: Video URL
+        :param params: youtube-dl parameters; they must be picklable, so they can't contain a logger or progress hooks
+        :param logger: Logger for the youtube-dl messages
+        :param on_progress: Called with the youtube-dl progress (see download_process._ProgressReporter)
+        :return: Dictionary containing the youtube-dl return code ('code') and an error message ('error')
+        """
+        result = self.__run(download_process.download, url, params, logger, on_progress)
+        if result is None:
+            return {'code': -1, 'error': 'The download process stopped unexpectedly'}
+        return result
+
+    def estimate_size(self, url: str, params: dict, logger: logging.Logger) -> dict:
+        """
+        Asks youtube-dl, in a worker process, how large the download of a video will be.
+        :return: Dictionary containing the size in bytes ('size', None if unknown) and an error message ('error')
+        """
+        result = self.__run(download_process.estimate_size, url, params, logger)
+        if result is None:
+            return {'size': None, 'error': 'The download process stopped unexpectedly'}
+        return result
+
+    def shutdown(self):
+        """
+        Stops the worker processes, after they finish their current tasks.
+        """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+            if self.__messages is not None:
+                self.__messages.put(None)
+                self.__messages = None
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+download_pool = DownloadPool()
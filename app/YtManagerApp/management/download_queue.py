@@ -0,0 +1,332 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple, Type
+
+from django.db import connection
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.models import Video, VideoFile, VIDEO_DOWNLOAD_STATES_IN_FLIGHT, VIDEO_DOWNLOAD_STATE_NONE, \
+    VIDEO_DOWNLOAD_STATE_QUEUED, VIDEO_DOWNLOAD_STATE_RETRY, VIDEO_DOWNLOAD_STATE_RUNNING
+from YtManagerApp.scheduler import Job, scheduler
+
+# Lower values are downloaded first
+DOWNLOAD_PRIORITY_INTERACTIVE = 0
+DOWNLOAD_PRIORITY_AUTO = 10
+
+DOWNLOAD_PRIORITY_NAMES = {
+    DOWNLOAD_PRIORITY_INTERACTIVE: 'Requested by user',
+    DOWNLOAD_PRIORITY_AUTO: 'Automatic',
+}
+
+# Finished downloads are kept for this long, for the throughput statistics
+DOWNLOAD_STATS_PERIOD = datetime.timedelta(hours=1)
+
+# How often idle workers check if a download window has opened
+DOWNLOAD_WINDOW_CHECK_INTERVAL = 60
+
+
+def parse_download_windows(text: str) -> List[Tuple[datetime.time, datetime.time]]:
+    """
+    Parses a list of time of day windows, in the format 'HH:MM-HH:MM, HH:MM-HH:MM...'. A window may go past midnight
+    (e.g. 23:00-06:00). The times are in the server time zone (settings.TIME_ZONE).
+    :param text: Windows, as text
+    :return: List of (start, end) tuples. An empty list means downloads are allowed at any time.
+    :raises ValueError: if the text is not valid
+    """
+    windows = []
+    for window in text.split(','):
+        window = window.strip()
+        if len(window) == 0:
+            continue
+        start, sep, end = window.partition('-')
+        if not sep:
+            raise ValueError(f"Invalid download window '{window}', expected 'HH:MM-HH:MM'.")
+        windows.append((datetime.datetime.strptime(start.strip(), '%H:%M').time(),
+                        datetime.datetime.strptime(end.strip(), '%H:%M').time()))
+    return windows
+
+
+def in_download_window(windows: List[Tuple[datetime.time, datetime.time]], now: datetime.time) -> bool:
+    if len(windows) == 0:
+        return True
+
+    for start, end in windows:
+        if start <= end:
+            if start <= now < end:
+                return True
+        elif now >= start or now < end:
+            return True
+
+    return False
+
+
+class QueuedDownload(object):
+    def __init__(self, job_class: Type[Job], video: Video, attempt: int, priority: int,
+                 not_before: Optional[datetime.datetime] = None):
+        self.job_class = job_class
+        self.video = video
+        self.attempt = attempt
+        self.priority = priority
+        self.not_before = not_before
+        self.user = video.subscription.user
+        self.enqueued_at = timezone.now()
+        self.started_at = None
+        # Set when the video is enqueued again with a higher priority
+        self.cancelled = False
+
+    @property
+    def priority_name(self) -> str:
+        return DOWNLOAD_PRIORITY_NAMES.get(self.priority, str(self.priority))
+
+    def __repr__(self):
+        return f'<QueuedDownload video={self.video.id} attempt={self.attempt} priority={self.priority}>'
+
+
+class DownloadQueue(object):
+    """
+    Queue of the videos waiting to be downloaded, processed by a fixed number of workers (download_concurrency).
+
+    Videos requested by users go before the automatic downloads. Within the same priority, the users take turns,
+    so a user with a long list of automatic downloads doesn't hold up everybody else. Automatic downloads only start
+    inside the configured download windows. Retries wait on the side until they are due, without taking a worker.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        # priority -> user ID -> queued downloads
+        self.__queues = {}  # type: Dict[int, OrderedDict]
+        self.__queued = {}  # type: Dict[int, QueuedDownload]
+        # Heap of (not_before, sequence, entry), for the downloads which can't start yet
+        self.__delayed = []
+        self.__sequence = itertools.count()
+        self.__active = {}  # type: Dict[int, QueuedDownload]
+        self.__finished = deque()  # (finished_at, bytes, seconds)
+        self.__workers = []
+        # Incremented when the workers are stopped; the workers of previous generations exit after their download
+        self.__generation = 0
+        self.log = logging.getLogger('download_queue')
+
+    def enqueue(self, job_class: Type[Job], video: Video, attempt: int = 1, priority: int = DOWNLOAD_PRIORITY_AUTO,
+                not_before: Optional[datetime.datetime] = None):
+        """
+        Adds a video to the queue. If the video is already queued, it is moved up if the new priority is higher.
+        :param not_before: If set, the download doesn't start before this time (used for retries). The video keeps
+        the 'retry' state until then, and is marked as queued when it is due.
+        """
+        with self.__condition:
+            queued = self.__queued.get(video.id)
+            if queued is not None:
+                if queued.priority <= priority:
+                    return
+                queued.cancelled = True
+
+            entry = QueuedDownload(job_class, video, attempt, priority, not_before)
+            if not_before is not None and not_before > timezone.now():
+                heapq.heappush(self.__delayed, (not_before, next(self.__sequence), entry))
+            else:
+                if not_before is not None:
+                    self.__mark_queued(entry)
+                self.__append(entry)
+            self.__queued[video.id] = entry
+            self.__condition.notify()
+
+    def __append(self, entry: QueuedDownload):
+        users = self.__queues.setdefault(entry.priority, OrderedDict())
+        users.setdefault(entry.user.id, deque()).append(entry)
+
+    @staticmethod
+    def __mark_queued(entry: QueuedDownload):
+        """
+        Marks a retry which is due as queued, in the database. Nothing happens if the video isn't waiting for a retry
+        anymore; the download job finds out when it starts.
+        """
+        Video.objects.filter(id=entry.video.id, download_state=VIDEO_DOWNLOAD_STATE_RETRY)\
+            .update(download_state=VIDEO_DOWNLOAD_STATE_QUEUED)
+        entry.video.download_state = VIDEO_DOWNLOAD_STATE_QUEUED
+
+    def __release_delayed(self) -> Optional[float]:
+        """
+        Moves the delayed downloads which are due into the queue.
+        :return: Seconds until the next delayed download is due, or None if there are none left
+        """
+        now = timezone.now()
+        while len(self.__delayed) > 0:
+            not_before, _, entry = self.__delayed[0]
+            if not_before > now:
+                return (not_before - now).total_seconds()
+            heapq.heappop(self.__delayed)
+            if not entry.cancelled:
+                self.__mark_queued(entry)
+                self.__append(entry)
+        return None
+
+    def pop(self) -> Optional[QueuedDownload]:
+        """
+        Takes the next download out of the queue.
+        :return: Next download, or None if there is nothing which can start now
+        """
+        with self.__condition:
+            return self.__pop()
+
+    def __pop(self) -> Optional[QueuedDownload]:
+        self.__release_delayed()
+
+        try:
+            windows = parse_download_windows(appconfig.download_windows)
+        except ValueError as e:
+            self.log.error('Invalid download windows, ignoring them. Error: %s', e)
+            windows = []
+        in_window = in_download_window(windows, timezone.localtime().time())
+
+        for priority in sorted(self.__queues.keys()):
+            if priority != DOWNLOAD_PRIORITY_INTERACTIVE and not in_window:
+                continue
+
+            users = self.__queues[priority]
+            while len(users) > 0:
+                # Take turns: the user served now goes to the back of the line
+                user_id, entries = next(iter(users.items()))
+                entry = entries.popleft()
+                if len(entries) > 0:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+
+                if not entry.cancelled:
+                    del self.__queued[entry.video.id]
+                    return entry
+
+        return None
+
+    def start(self):
+        """
+        Starts the workers. Videos enqueued before are kept, and downloaded once the workers start.
+        """
+        with self.__condition:
+            if len(self.__workers) > 0:
+                return
+
+            # The queue doesn't survive restarts; the downloads left in flight are enqueued by the next synchronization,
+            # while the retries keep their schedule (see DownloadVideoJob.schedule_retries). Downloads still running in
+            # a live process (e.g. a previous leader finishing its downloads) are left alone.
+            if len(self.__queued) == 0:
+                running_elsewhere = Q(download_state=VIDEO_DOWNLOAD_STATE_RUNNING,
+                                      download_owner__in=leader_election.live_processes())
+                left_over = Video.objects.filter(download_state__in=VIDEO_DOWNLOAD_STATES_IN_FLIGHT)\
+                    .exclude(running_elsewhere)
+                left_over.filter(download_retry_at__isnull=False).update(download_state=VIDEO_DOWNLOAD_STATE_RETRY)
+                left_over.update(download_state=VIDEO_DOWNLOAD_STATE_NONE)
+
+            for i in range(appconfig.download_concurrency):
+                worker = threading.Thread(target=self.__work, args=(self.__generation,), name=f'DownloadQueue-{i}',
+                                          daemon=True)
+                worker.start()
+                self.__workers.append(worker)
+
+    def stop(self):
+        """
+        Stops the workers, after they finish their current downloads. Doesn't wait for them, since a download can take
+        a long time.
+        """
+        with self.__condition:
+            self.__generation += 1
+            self.__workers = []
+            self.__condition.notify_all()
+
+    def __work(self, generation: int):
+        while True:
+            with self.__condition:
+                entry = None
+                while generation == self.__generation:
+                    entry = self.__pop()
+                    if entry is not None:
+                        break
+                    next_due = self.__release_delayed()
+                    timeout = DOWNLOAD_WINDOW_CHECK_INTERVAL
+                    if next_due is not None:
+                        timeout = min(timeout, next_due)
+                    self.__condition.wait(timeout)
+
+                if entry is None:
+                    return
+
+                entry.started_at = timezone.now()
+                self.__active[entry.video.id] = entry
+
+            start = time.monotonic()
+            try:
+                scheduler.run_job(entry.job_class, entry.user, [entry.video, entry.attempt, entry.priority])
+                downloaded_bytes = 0
+                if entry.video.downloaded_path:
+                    downloaded_bytes = VideoFile.objects.filter(video=entry.video) \
+                        .aggregate(total=Sum('size'))['total'] or 0
+            except Exception:
+                self.log.exception('Download of video %d failed.', entry.video.id)
+                downloaded_bytes = 0
+            finally:
+                connection.close()
+
+            with self.__condition:
+                del self.__active[entry.video.id]
+                self.__finished.append((timezone.now(), downloaded_bytes, time.monotonic() - start))
+
+    def get_rate_limit(self) -> Optional[int]:
+        """
+        Gets the download rate limit for a download which is starting, in bytes per second (None if unlimited). The
+        global limit is split between the downloads running at this moment, so a download running alone gets all of
+        it. The limit of a download doesn't change after it starts.
+        """
+        rate_limit = appconfig.download_rate_limit
+        if rate_limit <= 0:
+            return None
+        with self.__condition:
+            # The download which is starting is already counted as active
+            active = len(self.__active)
+        return max(1, rate_limit * 1024 // max(1, active))
+
+    def stats(self) -> dict:
+        """
+        Gets statistics about the queue: queued downloads by priority and user, active downloads, and the downloads
+        finished in the last hour.
+        """
+        now = timezone.now()
+        with self.__condition:
+            while len(self.__finished) > 0 and self.__finished[0][0] < now - DOWNLOAD_STATS_PERIOD:
+                self.__finished.popleft()
+
+            queued = list(self.__queued.values())
+            delayed = sum(1 for _, _, entry in self.__delayed if not entry.cancelled)
+            active = list(self.__active.values())
+            finished = list(self.__finished)
+
+        by_priority = OrderedDict()
+        for priority in sorted({entry.priority for entry in queued}):
+            by_user = OrderedDict()
+            for entry in queued:
+                if entry.priority == priority:
+                    by_user[entry.user.username] = by_user.get(entry.user.username, 0) + 1
+            by_priority[DOWNLOAD_PRIORITY_NAMES.get(priority, str(priority))] = by_user
+
+        finished_bytes = sum(item[1] for item in finished)
+        finished_seconds = sum(item[2] for item in finished)
+        return {
+            'queued': len(queued),
+            'queued_by_priority': by_priority,
+            'delayed': delayed,
+            'active': active,
+            'workers': len(self.__workers),
+            'finished': len(finished),
+            'finished_bytes': finished_bytes,
+            'throughput': finished_bytes / finished_seconds if finished_seconds > 0 else 0,
+        }
+
+
+download_queue = DownloadQueue()
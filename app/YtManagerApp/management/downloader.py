@@ -1,14 +1,23 @@
 from YtManagerApp.management.jobs.download_video import DownloadVideoJob
-from YtManagerApp.models import Video, Subscription, VIDEO_ORDER_MAPPING
-from YtManagerApp.utils import first_non_null
+from YtManagerApp.models import Video, VideoFile, Subscription, VIDEO_ORDER_MAPPING, VIDEO_DOWNLOAD_STATES_PENDING, \
+    VIDEO_DOWNLOAD_STATE_FAILED
+from YtManagerApp.utils import first_non_null, thumbnails
 from django.conf import settings as srv_settings
+from django.db.models import Q
 import logging
+import multiprocessing
 import requests
-import mimetypes
 import os
+import threading
 import PIL.Image
-import PIL.ImageOps
+from collections import defaultdict
+from concurrent import futures
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import urljoin
+from urllib3.util.retry import Retry
 
 log = logging.getLogger('downloader')
 
@@ -18,94 +27,314 @@ def __get_subscription_config(sub: Subscription):
 
     enabled = first_non_null(sub.auto_download, user.preferences['auto_download'])
     global_limit = user.preferences['download_global_limit']
+    size_limit = user.preferences['download_global_size_limit']
     limit = first_non_null(sub.download_limit, user.preferences['download_subscription_limit'])
     order = first_non_null(sub.download_order, user.preferences['download_order'])
     order = VIDEO_ORDER_MAPPING[order]
 
-    return enabled, global_limit, limit, order
+    return enabled, global_limit, size_limit, limit, order
 
 
-def downloader_process_subscription(sub: Subscription):
+def __admit_by_size(user, candidates: List[Video], size_limit: int, estimates: int) -> Tuple[List[Video], int]:
+    """
+    Picks the download candidates which fit in the space the user has left. The space used comes from the file catalog,
+    and the pending downloads count with the size youtube-dl estimated for them, so nothing on disk has to be scanned.
+    Candidates whose size wasn't estimated yet are let through; their download job asks youtube-dl for the size, and
+    leaves them for a later synchronization if they don't fit (see DownloadVideoJob), so the synchronization never
+    waits for youtube-dl.
+    :param candidates: Candidates, in download order
+    :param size_limit: Space the user is allowed to use, in bytes
+    :param estimates: How many candidates of unknown size may still be let through
+    :return: Tuple of (admitted candidates, remaining estimates); the candidates after the first which doesn't fit (or
+    whose size is unknown, once there are no estimates left) are deferred to a later synchronization
+    """
+    available = size_limit - VideoFile.get_user_downloaded_size(user) - Video.get_user_pending_size(user)
+
+    admitted = []
+    for video in candidates:
+        if available <= 0:
+            break
+
+        # Every estimate runs a youtube-dl extraction, so there is a limit on how many are made per synchronization
+        if video.download_size_estimate is None:
+            if estimates <= 0:
+                log.info('No more size estimates allowed, deferring video %d [%s %s].', video.id, video.video_id,
+                         video.name)
+                break
+            estimates -= 1
+
+        # Unknown sizes are let through; they are accounted for once estimated or downloaded
+        size = max(video.download_size_estimate or 0, 0)
+        if size > available:
+            log.info('Video %d [%s %s] needs %d bytes, only %d are left; deferring it.', video.id, video.video_id,
+                     video.name, size, available)
+            break
+
+        available -= size
+        admitted.append(video)
+
+    log.info('Size limit is set, %d bytes are left after the admitted downloads.', available)
+    return admitted, estimates
+
+
+def downloader_process_subscription(sub: Subscription, estimates: Optional[int] = None) -> int:
+    """
+    Enqueues the downloads of a subscription, according to the download settings.
+    :param sub: Subscription
+    :param estimates: How many videos of unknown size may be enqueued (default: DOWNLOAD_SIZE_ESTIMATES_PER_SYNC)
+    :return: How many videos of unknown size may still be enqueued, by the next subscriptions
+    """
     log.info('Processing subscription %d [%s %s]', sub.id, sub.playlist_id, sub.id)
 
-    enabled, global_limit, limit, order = __get_subscription_config(sub)
-    log.info('Determined settings enabled=%s global_limit=%d limit=%d order="%s"', enabled, global_limit, limit, order)
+    if estimates is None:
+        estimates = srv_settings.DOWNLOAD_SIZE_ESTIMATES_PER_SYNC
+
+    enabled, global_limit, size_limit, limit, order = __get_subscription_config(sub)
+    log.info('Determined settings enabled=%s global_limit=%d size_limit=%d limit=%d order="%s"', enabled, global_limit,
+             size_limit, limit, order)
 
     if enabled:
+        # Videos already queued, being downloaded or waiting to be retried are not enqueued again, and the ones which
+        # failed for good are only downloaded again if the user asks for it
         videos_to_download = Video.objects\
             .filter(subscription=sub, downloaded_path__isnull=True, watched=False)\
+            .exclude(download_state__in=VIDEO_DOWNLOAD_STATES_PENDING + [VIDEO_DOWNLOAD_STATE_FAILED])\
             .order_by(order)
 
         log.info('%d download candidates.', len(videos_to_download))
 
+        # Pending downloads count towards the limits
+        downloaded_or_pending = Q(downloaded_path__isnull=False) | Q(download_state__in=VIDEO_DOWNLOAD_STATES_PENDING)
+
         if global_limit > 0:
-            global_downloaded = Video.objects.filter(subscription__user=sub.user, downloaded_path__isnull=False).count()
+            global_downloaded = Video.objects.filter(subscription__user=sub.user).filter(downloaded_or_pending).count()
             allowed_count = max(global_limit - global_downloaded, 0)
             videos_to_download = videos_to_download[0:allowed_count]
             log.info('Global limit is set, can only download up to %d videos.', allowed_count)
 
         if limit > 0:
-            sub_downloaded = Video.objects.filter(subscription=sub, downloaded_path__isnull=False).count()
+            sub_downloaded = Video.objects.filter(subscription=sub).filter(downloaded_or_pending).count()
             allowed_count = max(limit - sub_downloaded, 0)
             videos_to_download = videos_to_download[0:allowed_count]
             log.info('Limit is set, can only download up to %d videos.', allowed_count)
 
+        # The size limit is in MB
+        if size_limit > 0:
+            videos_to_download, estimates = __admit_by_size(sub.user, list(videos_to_download),
+                                                            size_limit * 1024 * 1024, estimates)
+
         # enqueue download
         for video in videos_to_download:
             log.info('Enqueuing video %d [%s %s] index=%d', video.id, video.video_id, video.name, video.playlist_index)
             DownloadVideoJob.schedule(video)
 
     log.info('Finished processing subscription %d [%s %s]', sub.id, sub.playlist_id, sub.id)
+    return estimates
 
 
 def downloader_process_all():
+    estimates = None
     for subscription in Subscription.objects.all():
-        downloader_process_subscription(subscription)
+        estimates = downloader_process_subscription(subscription, estimates)
 
 
-def fetch_thumbnail(url, object_type, identifier, thumb_size):
+# (connect, read) timeouts, in seconds
+THUMBNAIL_TIMEOUT = (5, 30)
+THUMBNAIL_RETRIES = 3
+
+
+def __build_thumbnail_session() -> requests.Session:
+    session = requests.Session()
+    retries = Retry(total=THUMBNAIL_RETRIES, connect=1, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(max_retries=retries, pool_maxsize=srv_settings.THUMBNAIL_FETCH_CONCURRENCY)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
+
+# Sessions keep connections alive between requests; they can be shared between threads for simple GET requests.
+_thumbnail_session = __build_thumbnail_session()
+
+
+_render_pool = None  # type: Optional[ProcessPoolExecutor]
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Gets the process pool which renders the thumbnails (image decoding and resizing is CPU bound).
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # The workers only import the thumbnails module; forking a process with running threads is unsafe
+            _render_pool = ProcessPoolExecutor(max_workers=srv_settings.THUMBNAIL_RENDER_PROCESSES,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _render_pool
+
+
+def __render(data: bytes, sizes, directory: str, digest: str):
+    global _render_pool
+    args = (data, sizes, directory, digest, srv_settings.THUMBNAIL_QUALITY)
+    try:
+        get_render_pool().submit(thumbnails.render_thumbnails, *args).result()
+    except BrokenProcessPool as e:
+        log.warning('Thumbnail render processes stopped unexpectedly, rendering in this process. Error: %s', e)
+        with _render_pool_lock:
+            _render_pool = None
+        thumbnails.render_thumbnails(*args)
+
+
+def fetch_thumbnail(url, object_type, identifier, thumb_size):
+    """
+    Downloads a thumbnail, and stores it in the media folder in several sizes. Can be called from any thread.
+    Identical images are stored only once (see utils.thumbnails).
+    :return: URL of the largest size of the stored thumbnail, or the original URL if it could not be fetched
+    """
     log.info('Fetching thumbnail url=%s object_type=%s identifier=%s', url, object_type, identifier)
 
-    # Make request to obtain mime type
     try:
-        response = requests.get(url, stream=True)
+        response = _thumbnail_session.get(url, timeout=THUMBNAIL_TIMEOUT)
+        response.raise_for_status()
     except requests.exceptions.RequestException as e:
         log.error('Failed to fetch thumbnail %s. Error: %s', url, e)
         return url
 
-    ext = mimetypes.guess_extension(response.headers['Content-Type'])
+    digest = thumbnails.content_digest(response.content)
+    _, ext = thumbnails.thumbnail_format()
+    sizes = thumbnails.scaled_sizes(thumb_size, srv_settings.THUMBNAIL_SCALES)
+    directory = os.path.join(srv_settings.MEDIA_ROOT, "thumbs")
+    paths = [thumbnails.thumbnail_path(digest, size, ext) for size in sizes]
+
+    if not all(os.path.exists(os.path.join(directory, path)) for path in paths):
+        try:
+            __render(response.content, sizes, directory, digest)
+        except (OSError, ValueError, PIL.Image.DecompressionBombError) as e:
+            log.error('Error while rendering thumbnail %s. Error: %s', url, e)
+            return url
 
-    # Build file path
-    file_name = f"{identifier}{ext}"
-    abs_path_dir = os.path.join(srv_settings.MEDIA_ROOT, "thumbs", object_type)
-    abs_path = os.path.join(abs_path_dir, file_name)
-    abs_path_tmp = file_name + '.tmp'
+    # Return
+    media_url = urljoin(srv_settings.MEDIA_URL, f"thumbs/{paths[-1]}")
+    return media_url
+
+
+_fetches_in_progress = {}  # type: Dict[str, Future]
+_fetches_in_progress_lock = threading.Lock()
+
+
+def fetch_thumbnail_once(url, object_type, identifier, thumb_size):
+    """
+    Same as fetch_thumbnail, but concurrent calls for the same URL share a single fetch.
+    """
+    with _fetches_in_progress_lock:
+        future = _fetches_in_progress.get(url)
+        if future is not None:
+            owner = False
+        else:
+            owner = True
+            future = _fetches_in_progress[url] = Future()
+
+    if not owner:
+        return future.result()
 
-    # Store image
     try:
-        os.makedirs(abs_path_dir, exist_ok=True)
-        with open(abs_path_tmp, "wb") as f:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        future.set_result(fetch_thumbnail(url, object_type, identifier, thumb_size))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _fetches_in_progress_lock:
+            del _fetches_in_progress[url]
 
-        # Resize and crop to thumbnail size
-        image = PIL.Image.open(abs_path_tmp)
-        image = PIL.ImageOps.fit(image, thumb_size)
-        image.save(abs_path)
-        image.close()
+    return future.result()
 
-        # Delete temp file
-        os.unlink(abs_path_tmp)
 
-    except requests.exceptions.RequestException as e:
-        log.error('Error while downloading stream for thumbnail %s. Error: %s', url, e)
-        return url
-    except OSError as e:
-        log.error('Error while writing to file %s for thumbnail %s. Error: %s', abs_path, url, e)
+def fetch_video_thumbnail(video: Video) -> str:
+    """
+    Fetches the thumbnail of a video if it wasn't fetched yet, and stores it.
+    :return: URL of the thumbnail; it is the remote URL if the thumbnail could not be fetched
+    """
+    url = video.thumbnail
+    if not url.startswith("http"):
         return url
 
-    # Return
-    media_url = urljoin(srv_settings.MEDIA_URL, f"thumbs/{object_type}/{file_name}")
-    return media_url
+    thumbnail = fetch_thumbnail_once(url, 'video', video.video_id, srv_settings.THUMBNAIL_SIZE_VIDEO)
+    if thumbnail != url:
+        # Another request may have stored it already
+        Video.objects.filter(id=video.id, thumbnail=url).update(thumbnail=thumbnail)
+        video.thumbnail = thumbnail
+
+    return thumbnail
+
+
+class ThumbnailFetcher(object):
+    """
+    Fetches the missing thumbnails of subscriptions and videos on a thread pool, so whoever submits them doesn't have
+    to wait for the downloads. The workers don't touch the database; the thumbnails are stored by save(), which
+    must be called from the thread that submitted them.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers or srv_settings.THUMBNAIL_FETCH_CONCURRENCY,
+                                         thread_name_prefix='ThumbnailFetcher')
+        self.__pending = {}  # type: Dict[Future, Union[Subscription, Video]]
+        self.__submitted = set()
+
+    def submit(self, obj: Union[Subscription, Video]) -> bool:
+        """
+        Starts fetching the thumbnail of a subscription or video, if it wasn't fetched yet.
+        :return: True if the thumbnail will be fetched
+        """
+        if not obj.thumbnail.startswith("http"):
+            return False
+
+        key = (type(obj), obj.pk)
+        if key in self.__submitted:
+            return False
+        self.__submitted.add(key)
+
+        if isinstance(obj, Subscription):
+            args = (obj.thumbnail, 'sub', obj.playlist_id, srv_settings.THUMBNAIL_SIZE_SUBSCRIPTION)
+        else:
+            args = (obj.thumbnail, 'video', obj.video_id, srv_settings.THUMBNAIL_SIZE_VIDEO)
+
+        self.__pending[self.__pool.submit(fetch_thumbnail, *args)] = obj
+        return True
+
+    def save(self, wait: bool = False) -> int:
+        """
+        Stores the fetched thumbnails in the database, with one query per model.
+        :param wait: Wait for all the submitted thumbnails, instead of only storing the ones already fetched
+        :return: Number of updated objects
+        """
+        if wait:
+            done = list(self.__pending.keys())
+            futures.wait(done)
+        else:
+            done = [future for future in self.__pending.keys() if future.done()]
+
+        changed = defaultdict(list)
+        for future in done:
+            obj = self.__pending.pop(future)
+            try:
+                thumbnail = future.result()
+            except Exception as e:
+                log.error('Failed to fetch thumbnail %s. Error: %s', obj.thumbnail, e)
+                continue
+
+            if thumbnail != obj.thumbnail:
+                obj.thumbnail = thumbnail
+                changed[type(obj)].append(obj)
+
+        for model, objects in changed.items():
+            model.objects.bulk_update(objects, ['thumbnail'])
+
+        return sum(len(objects) for objects in changed.values())
+
+    def shutdown(self):
+        """
+        Stops the workers. Thumbnails which were not fetched yet are abandoned.
+        """
+        for future in self.__pending.keys():
+            future.cancel()
+        self.__pool.shutdown(wait=True)
+        self.__pending.clear()
@@ -1,6 +1,7 @@
 import os
 
-from YtManagerApp.models import Video
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.models import Video, VideoFile, VIDEO_DOWNLOAD_STATE_NONE
 from YtManagerApp.scheduler import Job, scheduler
 
 
@@ -18,11 +19,23 @@ class DeleteVideoJob(Job):
         count = 0
 
         try:
-            for file in self._video.get_files():
+            files = [file.path for file in self._video.files.all()]
+            if len(files) == 0:
+                # Downloaded before the file catalog existed
+                files = list(self._video.get_files())
+
+            shared = VideoFile.get_shared_paths(self._video, files)
+            for file in files:
+                if file in shared:
+                    self.log.info("File %s is still used by other videos, keeping it", file)
+                    continue
+
                 self.log.info("Deleting file %s", file)
                 count += 1
                 try:
                     os.unlink(file)
+                except FileNotFoundError:
+                    pass
                 except OSError as e:
                     self.log.error("Failed to delete file %s: Error: %s", file, e)
 
@@ -30,8 +43,10 @@ class DeleteVideoJob(Job):
             self.log.error("Failed to delete video %d [%s %s]. Error: %s", self._video.id,
                            self._video.video_id, self._video.name, e)
 
+        VideoFile.objects.filter(video=self._video).delete()
         self._video.downloaded_path = None
-        self._video.save()
+        self._video.download_state = VIDEO_DOWNLOAD_STATE_NONE
+        self._video.save(update_fields=['downloaded_path', 'download_state'])
 
         self.log.info('Deleted video %d successfully! (%d files) [%s %s]', self._video.id, count,
                       self._video.video_id, self._video.name)
@@ -43,4 +58,6 @@ class DeleteVideoJob(Job):
         :param video:
         :return:
         """
+        if leader_election.forward(DeleteVideoJob.schedule, video):
+            return
         scheduler.add_job(DeleteVideoJob, args=[video])
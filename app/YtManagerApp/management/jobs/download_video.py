@@ -1,24 +1,88 @@
+import datetime
+import logging
 import os
+import random
 import re
+import time
 from string import Template
-from threading import Lock
+from typing import Optional
 
-import youtube_dl
+from django.conf import settings
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
 
-from YtManagerApp.models import Video
-from YtManagerApp.scheduler import Job, scheduler
+from YtManagerApp.management.download_pool import download_pool
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.management.download_queue import download_queue, DOWNLOAD_PRIORITY_AUTO, \
+    DOWNLOAD_PRIORITY_INTERACTIVE
+from YtManagerApp.models import Video, VideoFile, VIDEO_DOWNLOAD_STATE_DONE, VIDEO_DOWNLOAD_STATE_FAILED, \
+    VIDEO_DOWNLOAD_STATE_NONE, VIDEO_DOWNLOAD_STATE_RETRY, VIDEO_FILE_ROLE_VIDEO, VIDEO_SIZE_ESTIMATE_UNKNOWN
+from YtManagerApp.scheduler import Job
+from YtManagerApp.utils.files import link_or_copy
+
+# youtube-dl errors which won't go away by trying again
+_PERMANENT_DOWNLOAD_ERRORS = re.compile('|'.join([
+    r'video unavailable',
+    r'this video is (private|unavailable)',
+    r'private video',
+    r'video has been removed',
+    r'copyright',
+    r'account associated with this video has been terminated',
+    r'not available in your country',
+    r'members-only',
+    r'join this channel',
+    r'sign in to confirm your age',
+    r'unsupported url',
+    r'http error 404',
+    r'http error 410',
+]), re.IGNORECASE)
+
+
+def make_output_directory(output_path: str):
+    """
+    Creates the folder of an output file. youtube-dl creates missing folders by itself, but fails with 'Cannot create
+    folder - file already exists' when several downloads create the same folder at the same time.
+    :param output_path: Output file path
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+
+def is_permanent_download_error(error: str) -> bool:
+    """
+    Checks if a download error is permanent (e.g. the video was removed), so the download isn't attempted again.
+    Anything not recognized (network errors, throttling...) is assumed to be transient.
+    """
+    return _PERMANENT_DOWNLOAD_ERRORS.search(error) is not None
+
+
+def get_retry_delay(attempt: int) -> float:
+    """
+    Computes how long to wait before retrying a failed download: exponential backoff, with jitter.
+    :param attempt: Number of the failed attempt (starting from 1)
+    :return: Delay, in seconds
+    """
+    delay = min(settings.DOWNLOAD_RETRY_MAX_DELAY, settings.DOWNLOAD_RETRY_DELAY * 2 ** min(attempt - 1, 32))
+    return random.uniform(delay / 2, delay)
 
 
 class DownloadVideoJob(Job):
     name = "DownloadVideoJob"
-    __lock = Lock()
 
-    def __init__(self, job_execution, video: Video, attempt: int = 1):
+    def __init__(self, job_execution, video: Video, attempt: int = 1, priority: int = DOWNLOAD_PRIORITY_AUTO):
         super().__init__(job_execution)
         self.__video = video
         self.__attempt = attempt
+        self.__priority = priority
         self.__log_youtube_dl = self.log.getChild('youtube_dl')
 
+        # Download progress; youtube-dl downloads the video and audio as separate files, one after the other
+        self.__finished_bytes = 0
+        self.__current_bytes = 0
+        self.__current_total = 0
+        self.__transfer_time = 0.0
+        self.__reported_bytes = 0
+        self.__last_progress_update = 0.0
+
     def get_description(self):
         ret = "Downloading video " + self.__video.name
         if self.__attempt > 1:
@@ -26,38 +90,202 @@ class DownloadVideoJob(Job):
         return ret
 
     def run(self):
-        # Issue: if multiple videos are downloaded at the same time, a race condition appears in the mkdirs() call that
-        # youtube-dl makes, which causes it to fail with the error 'Cannot create folder - file already exists'.
-        # For now, allow a single download instance.
-        self.__lock.acquire()
+        # Only one worker gets to download the video, even if it was enqueued several times
+        if not self.__video.claim_download_running(leader_election.identity):
+            self.log.info('Video %d [%s %s] is already being downloaded.', self.__video.id, self.__video.video_id,
+                          self.__video.name)
+            return
 
+        self.__attempt = self.__video.download_attempts
         try:
-            user = self.__video.subscription.user
-            max_attempts = user.preferences['max_download_attempts']
+            retry = self.__download()
+        except Exception as e:
+            self.__set_state(VIDEO_DOWNLOAD_STATE_FAILED, str(e))
+            raise
 
-            youtube_dl_params, output_path = self.__build_youtube_dl_params(self.__video)
-            with youtube_dl.YoutubeDL(youtube_dl_params) as yt:
-                ret = yt.download(["https://www.youtube.com/watch?v=" + self.__video.video_id])
+        # Only enqueue again once this download is over, otherwise another worker might pick it up right away
+        if retry:
+            DownloadVideoJob.schedule(self.__video, self.__attempt + 1, self.__priority)
 
-            self.log.info('Download finished with code %d', ret)
+    def __set_state(self, state: str, error: str = '', retry_at: datetime.datetime = None):
+        self.__video.download_state = state
+        self.__video.download_error = error
+        self.__video.download_retry_at = retry_at
+        self.__video.save(update_fields=['download_state', 'download_error', 'download_retry_at', 'downloaded_path',
+                                         'downloaded_format'])
 
-            if ret == 0:
-                self.__video.downloaded_path = output_path
-                self.__video.save()
-                self.log.info('Video %d [%s %s] downloaded successfully!', self.__video.id, self.__video.video_id, self.__video.name)
+    def __download(self) -> bool:
+        """
+        Downloads the video.
+        :return: True if the download failed, and should be attempted again
+        """
+        # The video may have been downloaded since it was enqueued
+        if self.__video.downloaded_path:
+            self.log.info('Video %d [%s %s] was already downloaded.', self.__video.id, self.__video.video_id,
+                          self.__video.name)
+            self.__set_state(VIDEO_DOWNLOAD_STATE_DONE)
+            return False
 
-            elif self.__attempt <= max_attempts:
-                self.log.warning('Re-enqueueing video (attempt %d/%d)', self.__attempt, max_attempts)
-                DownloadVideoJob.schedule(self.__video, self.__attempt + 1)
+        user = self.__video.subscription.user
+        max_attempts = user.preferences['max_download_attempts']
 
-            else:
-                self.log.error('Multiple attempts to download video %d [%s %s] failed!', self.__video.id, self.__video.video_id,
-                          self.__video.name)
-                self.__video.downloaded_path = ''
-                self.__video.save()
+        if not self.__fits_size_limit(user):
+            # Picked up again by a later synchronization, once there is room for it
+            self.__set_state(VIDEO_DOWNLOAD_STATE_NONE)
+            return False
+
+        youtube_dl_params, output_path = self.__build_youtube_dl_params(self.__video)
+        make_output_directory(output_path)
+
+        # The same video may have been downloaded already, for another subscription or user
+        if self.__reuse_existing_copy(output_path, youtube_dl_params['format']):
+            self.__video.downloaded_path = output_path
+            self.__video.downloaded_format = youtube_dl_params['format']
+            self.__set_state(VIDEO_DOWNLOAD_STATE_DONE)
+            self.__video.catalog_files()
+            return False
 
-        finally:
-            self.__lock.release()
+        start = time.monotonic()
+        result = download_pool.download("https://www.youtube.com/watch?v=" + self.__video.video_id, youtube_dl_params,
+                                        self.__log_youtube_dl, self.__on_progress)
+        ret, error = result['code'], result['error']
+        self.__record_throughput(time.monotonic() - start)
+
+        self.log.info('Download finished with code %d', ret)
+
+        if ret == 0:
+            self.__video.downloaded_path = output_path
+            self.__video.downloaded_format = youtube_dl_params['format']
+            self.__set_state(VIDEO_DOWNLOAD_STATE_DONE)
+            files = self.__video.catalog_files()
+            self.log.info('Cataloged %d files (%d bytes)', len(files), sum(file.size for file in files))
+            self.log.info('Video %d [%s %s] downloaded successfully!', self.__video.id, self.__video.video_id, self.__video.name)
+
+        elif is_permanent_download_error(error):
+            self.log.error('Video %d [%s %s] can\'t be downloaded: %s', self.__video.id, self.__video.video_id,
+                           self.__video.name, error)
+            self.__set_state(VIDEO_DOWNLOAD_STATE_FAILED, error)
+
+        elif self.__attempt <= max_attempts:
+            retry_at = timezone.now() + datetime.timedelta(seconds=get_retry_delay(self.__attempt))
+            self.log.warning('Download failed, retrying at %s (attempt %d/%d)', retry_at, self.__attempt, max_attempts)
+            self.__set_state(VIDEO_DOWNLOAD_STATE_RETRY, error, retry_at)
+            return True
+
+        else:
+            self.log.error('Multiple attempts to download video %d [%s %s] failed!', self.__video.id, self.__video.video_id,
+                      self.__video.name)
+            self.__set_state(VIDEO_DOWNLOAD_STATE_FAILED, error)
+
+        return False
+
+    def __fits_size_limit(self, user) -> bool:
+        """
+        Checks that an automatic download fits in the space the user has left. The synchronization lets the videos
+        whose size it doesn't know through (asking youtube-dl would hold it up), so their size is asked for here.
+        :return: False if the download must be deferred
+        """
+        size_limit = user.preferences['download_global_size_limit']
+        if size_limit <= 0 or self.__priority != DOWNLOAD_PRIORITY_AUTO \
+                or self.__video.download_size_estimate is not None:
+            return True
+
+        size = DownloadVideoJob.estimate_size(self.__video) or 0
+        available = size_limit * 1024 * 1024 - VideoFile.get_user_downloaded_size(user) \
+            - Video.get_user_pending_size(user, exclude=self.__video)
+        if size > available:
+            self.log.info('Video %d [%s %s] needs %d bytes, only %d are left; deferring it.', self.__video.id,
+                          self.__video.video_id, self.__video.name, size, available)
+            return False
+
+        return True
+
+    def __reuse_existing_copy(self, output_path: str, download_format: str) -> bool:
+        """
+        Looks for another copy of the video, downloaded in the same format, and links (or copies) its files to the output
+        path.
+        :return: True if the files of another copy were reused
+        """
+        source = Video.objects\
+            .filter(video_id=self.__video.video_id, downloaded_format=download_format,
+                    files__role=VIDEO_FILE_ROLE_VIDEO)\
+            .exclude(id=self.__video.id)\
+            .exclude(downloaded_path__isnull=True)\
+            .exclude(downloaded_path='')\
+            .first()
+        if source is None:
+            return False
+
+        linked = copied = 0
+        try:
+            for file in source.files.all():
+                if not file.path.startswith(source.downloaded_path):
+                    continue
+                # Same naming as the original, e.g. 'path.mp4', 'path.en.vtt'
+                destination = output_path + file.path[len(source.downloaded_path):]
+                if destination == file.path:
+                    linked += 1
+                elif link_or_copy(file.path, destination):
+                    linked += 1
+                else:
+                    copied += 1
+
+        except OSError as e:
+            self.log.warning('Failed to reuse the files of video %d [%s %s], downloading it. Error: %s', source.id,
+                             source.video_id, source.name, e)
+            return False
+
+        self.log.info('Video %d [%s %s] reused the files of video %d (%d linked, %d copied).', self.__video.id,
+                      self.__video.video_id, self.__video.name, source.id, linked, copied)
+        return True
+
+    def __on_progress(self, progress: dict):
+        """
+        Called with the youtube-dl progress. The progress shown to the user is only updated every
+        DOWNLOAD_PROGRESS_INTERVAL seconds, since every update is a database write.
+        """
+        downloaded = progress['downloaded_bytes'] or 0
+
+        if progress['status'] == 'finished':
+            size = progress['total_bytes'] or downloaded
+            self.log.info('Downloaded file %s (%d bytes)', progress['filename'], size)
+            self.__finished_bytes += size
+            self.__current_bytes = self.__current_total = 0
+            self.__transfer_time += progress['elapsed'] or 0
+            return
+
+        if progress['status'] != 'downloading':
+            return
+
+        self.__current_bytes = downloaded
+        self.__current_total = progress['total_bytes'] or progress['total_bytes_estimate'] or downloaded
+
+        now = time.monotonic()
+        if now - self.__last_progress_update < settings.DOWNLOAD_PROGRESS_INTERVAL:
+            return
+        self.__last_progress_update = now
+
+        done = self.__finished_bytes + self.__current_bytes
+        total = max(self.__video.download_size_estimate or 0, self.__finished_bytes + self.__current_total, done, 1)
+        message = f'Downloading {self.__video.name}: {filesizeformat(done)} of {filesizeformat(total)}'
+        if progress['speed']:
+            message += f' ({filesizeformat(progress["speed"])}/s)'
+
+        self.set_total_steps(total)
+        self.progress_advance(done - self.__reported_bytes, message)
+        self.__reported_bytes = done
+
+    def __record_throughput(self, elapsed: float):
+        """
+        Records the amount of data transferred and the transfer rate on the job execution (saved when the job ends).
+        :param elapsed: Duration of the download, used if youtube-dl didn't report the transfer times
+        """
+        transfer_time = self.__transfer_time or elapsed
+        self.job_execution.downloaded_bytes = self.__finished_bytes
+        self.job_execution.throughput = self.__finished_bytes / transfer_time if transfer_time > 0 else None
+        if self.job_execution.throughput is not None:
+            self.log.info('Transferred %d bytes in %.1f seconds (%d bytes/s)', self.__finished_bytes, transfer_time,
+                          self.job_execution.throughput)
 
     def __build_youtube_dl_params(self, video: Video):
 
@@ -74,7 +302,6 @@ class DownloadVideoJob(Job):
         output_path = os.path.normpath(output_path)
 
         youtube_dl_params = {
-            'logger': self.__log_youtube_dl,
             'format': user.preferences['download_format'],
             'outtmpl': output_path,
             'writethumbnail': True,
@@ -83,6 +310,7 @@ class DownloadVideoJob(Job):
             'writeautomaticsub': user.preferences['download_autogenerated_subtitles'],
             'allsubtitles': user.preferences['download_subtitles_all'],
             'merge_output_format': 'mp4',
+            'ratelimit': download_queue.get_rate_limit(),
             'postprocessors': [
                 {
                     'key': 'FFmpegMetadata'
@@ -124,11 +352,56 @@ class DownloadVideoJob(Job):
         return value
 
     @staticmethod
-    def schedule(video: Video, attempt: int = 1):
+    def schedule(video: Video, attempt: int = 1, priority: int = DOWNLOAD_PRIORITY_AUTO):
         """
-        Schedules to download video immediately
+        Adds a video to the download queue
         :param video:
         :param attempt:
+        :param priority: Download priority (videos requested by the user go before the automatic downloads)
         :return:
         """
-        scheduler.add_job(DownloadVideoJob, args=[video, attempt])
+        if leader_election.forward(DownloadVideoJob.schedule, video, attempt, priority):
+            return
+
+        # Retries wait until they are due, in the 'retry' state; the queue marks them as queued then
+        not_before = video.download_retry_at if attempt > 1 else None
+        if not_before is not None and not_before > timezone.now():
+            download_queue.enqueue(DownloadVideoJob, video, attempt, priority, not_before)
+            return
+
+        # Videos already in flight are not enqueued again; the ones requested by the user may move up the queue
+        if video.claim_download_queued(first_attempt=attempt == 1) or priority == DOWNLOAD_PRIORITY_INTERACTIVE:
+            download_queue.enqueue(DownloadVideoJob, video, attempt, priority, not_before)
+
+    @staticmethod
+    def estimate_size(video: Video) -> Optional[int]:
+        """
+        Asks youtube-dl how large the download of a video will be, without downloading it. The estimate is stored on the
+        video, so it's only asked for once, even if youtube-dl couldn't tell.
+        :return: Size in bytes, or None if unknown
+        """
+        if video.download_size_estimate is not None:
+            return video.download_size_estimate if video.download_size_estimate >= 0 else None
+
+        log = logging.getLogger(DownloadVideoJob.name)
+        youtube_dl_params = {
+            'format': video.subscription.user.preferences['download_format'],
+        }
+        result = download_pool.estimate_size("https://www.youtube.com/watch?v=" + video.video_id, youtube_dl_params,
+                                             log.getChild('youtube_dl'))
+        if result['error'] is not None:
+            log.warning('Failed to estimate the size of video %d [%s %s]: %s', video.id, video.video_id, video.name,
+                        result['error'])
+
+        estimate = result['size']
+        video.download_size_estimate = estimate if estimate is not None else VIDEO_SIZE_ESTIMATE_UNKNOWN
+        video.save(update_fields=['download_size_estimate'])
+        return estimate
+
+    @staticmethod
+    def schedule_retries():
+        """
+        Enqueues the retries left over from a previous run, keeping their schedule.
+        """
+        for video in Video.objects.filter(download_state=VIDEO_DOWNLOAD_STATE_RETRY).select_related('subscription__user'):
+            DownloadVideoJob.schedule(video, video.download_attempts + 1)
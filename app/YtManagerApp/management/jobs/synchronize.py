@@ -1,18 +1,28 @@
 import errno
 import itertools
 import datetime
+import queue
+import xml.etree.ElementTree as ElementTree
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+from typing import Set, Tuple, List, Dict
 
+import requests
 from apscheduler.triggers.cron import CronTrigger
-from django.db.models import Max, F
-from django.conf import settings
+from django.db.models import F, Q, Count
+from django.utils import timezone
 
 
 from YtManagerApp.management.appconfig import appconfig
-from YtManagerApp.management.downloader import fetch_thumbnail, downloader_process_subscription
+from YtManagerApp.management.downloader import ThumbnailFetcher, downloader_process_subscription
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.management.quota import quota_ledger
+from YtManagerApp.management.watcher import download_watcher
 from YtManagerApp.models import *
 from YtManagerApp.scheduler import scheduler, Job
-from YtManagerApp.utils import youtube
+from YtManagerApp.utils import youtube, feeds
+from YtManagerApp.utils.files import DirectorySnapshot
 from external.pytaw.pytaw.utils import iterate_chunks
 
 _ENABLE_UPDATE_STATS = True
@@ -23,16 +33,30 @@ class SynchronizeJob(Job):
     __lock = Lock()
     running = False
     __global_sync_job = None
+    __global_deep_sync_job = None
 
-    def __init__(self, job_execution, subscription: Optional[Subscription] = None):
+    def __init__(self, job_execution, subscription: Optional[Subscription] = None, deep: bool = False,
+                 due_only: bool = False):
         super().__init__(job_execution)
         self.__subscription = subscription
+        self.__deep = deep
+        self.__due_only = due_only
         self.__api = youtube.YoutubeAPI.build_public()
         self.__new_vids = []
+        # Download directories are listed once per synchronization, instead of once per video
+        self.__snapshot = DirectorySnapshot()
+        self.__check_files = True
+        # Subscription thumbnails are fetched in the background, while the synchronization goes on
+        self.__thumbnails = ThumbnailFetcher()
+        # The next synchronizations are scheduled from the time this one started, not from when it got to each
+        # subscription, so they don't drift behind the schedule
+        self.__started_at = timezone.now()
 
     def get_description(self):
         if self.__subscription is not None:
             return "Running synchronization for subscription " + self.__subscription.name
+        if self.__deep:
+            return "Running deep synchronization..."
         return "Running synchronization..."
 
     def get_subscription_list(self):
@@ -40,154 +64,491 @@ class SynchronizeJob(Job):
             return [self.__subscription]
         return Subscription.objects.all().order_by(F('last_synchronised').desc(nulls_first=True))
 
+    def get_due_subscriptions(self, subs):
+        """
+        Filters the subscriptions which are due for a synchronization, if adaptive synchronization is enabled.
+        Deep and manually started synchronizations process all the subscriptions.
+        """
+        if self.__subscription is not None or self.__deep or not self.__due_only or not appconfig.sync_adaptive:
+            return subs
+        return subs.filter(Subscription.sync_due_filter(self.__started_at))
+
     def get_videos_list(self, subs):
-        return Video.objects.filter(subscription__in=subs)
+        return Video.objects.filter(subscription__in=subs).select_related('subscription__user')
 
     def run(self):
         self.__lock.acquire(blocking=True)
         SynchronizeJob.running = True
+        self.__started_at = timezone.now()
         try:
             self.log.info(self.get_description())
 
-            # Build list of work items
-            work_subs = self.get_subscription_list()
-            work_vids = self.get_videos_list(work_subs)
+            # When the download folders are watched, deleted files are noticed as soon as they are deleted, so the
+            # downloaded files are only checked by deep synchronizations
+            self.__check_files = self.__deep or not download_watcher.running
 
-            self.set_total_steps(len(work_subs) + len(work_vids))
+            # Build list of work items. Looking for new videos comes first, so if the remaining API quota is not
+            # enough for everything, the subscriptions which weren't synchronized for the longest time are picked.
+            all_subs = self.get_subscription_list()
+            due_subs = self.get_due_subscriptions(all_subs)
+            work_subs, skipped_subs = self.plan_subscriptions(due_subs, quota_ledger.remaining())
+            if len(skipped_subs) > 0:
+                self.log.warning('Not enough API quota left, skipping %d subscriptions.', len(skipped_subs))
+                self.usr_log(f"Not enough YouTube API quota left today, skipped {len(skipped_subs)} subscriptions.")
 
             # Remove the 'new' flag
-            work_vids.update(new=False)
+            self.get_videos_list(work_subs).update(new=False)
+
+            # Only process the videos which need some work: due for a statistics refresh (only for the subscriptions
+            # being synchronized) or downloaded (check if they still exist). Video thumbnails are fetched when they
+            # are first shown (see views.video.video_thumbnail_view).
+            work_filter = Q(subscription__in=work_subs) & Video.stats_refresh_due_filter(timezone.now())
+            if self.__check_files:
+                work_filter |= Q(downloaded_path__isnull=False) & ~Q(downloaded_path='')
+            work_vids = self.get_videos_list(all_subs).filter(work_filter)
+
+            self.set_total_steps(len(work_subs) + len(work_vids))
 
             # Process subscriptions
-            for sub in work_subs:
-                self.progress_advance(1, "Synchronizing subscription " + sub.name)
-                self.check_new_videos(sub)
-                self.fetch_missing_thumbnails(sub)
+            self.check_all_new_videos(work_subs)
 
             # Add new videos to progress calculation
             self.set_total_steps(len(work_subs) + len(work_vids) + len(self.__new_vids))
 
-            # Process videos
-            all_videos = itertools.chain(work_vids, self.__new_vids)
+            # Process videos; statistics are refreshed last, with whatever quota is left (one unit per batch).
+            # The new videos go first, since they don't have any statistics yet.
+            budget = quota_ledger.remaining()
+            postponed = 0
+            all_videos = itertools.chain(self.__new_vids, work_vids)
             for batch in iterate_chunks(all_videos, 50):
-                video_stats = {}
+                refresh_stats = budget is None or budget > 0
+                if self.update_video_batch(batch, refresh_stats) and budget is not None:
+                    budget -= 1
+                if not refresh_stats:
+                    postponed += len(batch)
+                self.__thumbnails.save()
 
-                if _ENABLE_UPDATE_STATS:
-                    batch_ids = [video.video_id for video in batch]
-                    video_stats = {v.id: v for v in self.__api.videos(batch_ids, part='id,statistics,contentDetails')}
-                else:
-                    batch_ids = [video.video_id for video in filter(lambda video: video.duration == 0, batch)]
-                    video_stats = {v.id: v for v in self.__api.videos(batch_ids, part='id,statistics,contentDetails')}
+            if postponed > 0:
+                self.log.warning('Not enough API quota left, postponed the statistics update of %d videos.', postponed)
 
-                for video in batch:
-                    self.progress_advance(1, "Updating video " + video.name)
-                    self.check_video_deleted(video)
-                    self.fetch_missing_thumbnails(video)
+            self.log.info('Listed %d download directories.', self.__snapshot.listing_count)
 
-                    if video.video_id in video_stats:
-                        self.update_video_stats(video, video_stats[video.video_id])
+            # Start downloading videos; the download size estimates are shared by all the subscriptions
+            estimates = None
+            for sub in all_subs:
+                estimates = downloader_process_subscription(sub, estimates)
 
+            # Store the remaining thumbnails
+            self.__thumbnails.save(wait=True)
 
-            # Start downloading videos
-            for sub in work_subs:
-                downloader_process_subscription(sub)
+            if self.__api.cache is not None:
+                self.log.info('API response cache statistics: %s', self.__api.cache.stats())
 
         finally:
+            self.__thumbnails.shutdown()
+            quota_ledger.flush()
             SynchronizeJob.running = False
             self.__lock.release()
 
-    def check_new_videos(self, sub: Subscription):
-        playlist_items = self.__api.playlist_items(sub.playlist_id)
-        if sub.rewrite_playlist_indices:
-            playlist_items = sorted(playlist_items, key=lambda x: x.published_at)
+    def estimate_sync_cost(self, sub: Subscription, video_count: int) -> int:
+        """
+        Estimates how many API quota units looking for new videos in a subscription costs.
+        Incremental synchronizations usually need a single page of results; otherwise, the entire playlist is read,
+        50 videos per page.
+        """
+        if self.get_incremental_stop_count(sub) > 0:
+            return 1
+        return 1 + video_count // 50
+
+    def plan_subscriptions(self, subs, budget: Optional[int]) -> Tuple[List[Subscription], List[Subscription]]:
+        """
+        Picks the subscriptions which can be synchronized with the given API quota budget, starting with the ones
+        which weren't synchronized for the longest time.
+        :param subs: Subscriptions to synchronize
+        :param budget: Remaining API quota units, or None if unlimited
+        :return: Tuple of (subscriptions to synchronize, skipped subscriptions)
+        """
+        subs = list(subs)
+        if budget is None:
+            return subs, []
+
+        video_counts = dict(Video.objects.filter(subscription__in=subs).order_by()
+                            .values_list('subscription_id').annotate(Count('id')))
+
+        never_synchronised = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        subs.sort(key=lambda s: s.last_synchronised or never_synchronised)
+
+        planned = []
+        skipped = []
+        for sub in subs:
+            cost = self.estimate_sync_cost(sub, video_counts.get(sub.id, 0))
+            if cost <= budget:
+                planned.append(sub)
+                budget -= cost
+            else:
+                skipped.append(sub)
+
+        return planned, skipped
+
+    def update_video_batch(self, batch, refresh_stats: bool = True) -> bool:
+        """
+        Updates the statistics of a batch of videos, and checks if the downloaded files still exist.
+        All the changes are written back with a single query.
+        :param batch: Videos to update
+        :param refresh_stats: If false, the statistics are not updated (and no API request is made)
+        :return: True if the statistics were requested from the API
+        """
+        now = timezone.now()
+
+        if not refresh_stats:
+            batch_ids = []
+        elif _ENABLE_UPDATE_STATS:
+            batch_ids = [video.video_id for video in batch if video.is_stats_refresh_due(now)]
         else:
-            playlist_items = sorted(playlist_items, key=lambda x: x.position)
+            batch_ids = [video.video_id for video in filter(lambda video: video.duration == 0, batch)]
+
+        video_stats = {v.id: v for v in self.__api.videos(batch_ids, part='id,statistics,contentDetails')}
+        refreshed_ids = set(batch_ids)
+        catalogs = self.load_file_catalogs(batch) if self.__check_files else {}
+
+        # Keep track of what changed, and write everything back with a single query per batch
+        dirty_videos = []
+        dirty_fields = set()
+
+        for video in batch:
+            self.progress_advance(1, "Updating video " + video.name)
+            changed_fields = self.check_video_deleted(video, catalogs.get(video.id))
+
+            if video.video_id in refreshed_ids:
+                # Even if the video is missing from the response, don't ask for it again until the next refresh
+                video.stats_updated_at = now
+                changed_fields.add('stats_updated_at')
+
+                if video.video_id in video_stats:
+                    changed_fields |= self.update_video_stats(video, video_stats[video.video_id])
+
+            if len(changed_fields) > 0:
+                dirty_videos.append(video)
+                dirty_fields |= changed_fields
+
+        if len(dirty_videos) > 0:
+            Video.objects.bulk_update(dirty_videos, sorted(dirty_fields))
+
+        return len(batch_ids) > 0
+
+    def load_file_catalogs(self, batch) -> Dict[int, Optional[List[VideoFile]]]:
+        """
+        Loads the file catalogs of the downloaded videos in a batch, with a single query.
+        Videos which were never cataloged (downloaded before the catalog existed) are cataloged now. During deep
+        synchronizations, every catalog is compared with what is on disk, and repaired if they differ.
+        :return: Dictionary of video ID -> list of files; the list is None if the files could not be accessed
+        """
+        downloaded = [video for video in batch if video.downloaded_path]
+        if len(downloaded) == 0:
+            return {}
+
+        catalogs = defaultdict(list)
+        for file in VideoFile.objects.filter(video__in=downloaded):
+            catalogs[file.video_id].append(file)
+
+        stale_ids = []
+        new_files = []
+        for video in downloaded:
+            catalog = catalogs[video.id]
+            if len(catalog) > 0 and not self.__deep:
+                continue
+
+            try:
+                files = video.scan_files(self.__snapshot)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    self.log.error("Could not access path %s. Error: %s", video.downloaded_path, e)
+                    self.usr_err(f"Could not access path {video.downloaded_path}: {e}", suppress_notification=True)
+                    catalogs[video.id] = None
+                    continue
+                files = []
+
+            if not self.catalog_matches(catalog, files):
+                self.log.info("Updating file catalog of video %d [%s %s]", video.id, video.video_id, video.name)
+                stale_ids.extend(file.id for file in catalog)
+                new_files.extend(files)
+                catalogs[video.id] = files
+
+        if len(stale_ids) > 0:
+            VideoFile.objects.filter(id__in=stale_ids).delete()
+        if len(new_files) > 0:
+            VideoFile.objects.bulk_create(new_files)
+
+        return catalogs
+
+    @staticmethod
+    def catalog_matches(catalog: List[VideoFile], files: List[VideoFile]) -> bool:
+        by_path = {file.path: file for file in catalog}
+        return len(files) == len(by_path) \
+            and all(file.path in by_path and file.same_as(by_path[file.path]) for file in files)
+
+    def get_incremental_stop_count(self, sub: Subscription) -> int:
+        """
+        Determines after how many already known videos in a row the playlist scan can stop (0 = scan everything).
+        Incremental synchronization is only possible for playlists where new videos are added at the top
+        (e.g. the 'Uploads' playlist of a channel), and which were synchronized at least once before.
+        """
+        if self.__deep or not sub.rewrite_playlist_indices or sub.last_synchronised is None:
+            return 0
+        return appconfig.incremental_sync_stop_count
+
+    def iterate_until_known(self, sub: Subscription, playlist_items, known_ids: Set[str], stop_count: int):
+        """
+        Iterates the playlist items (newest first), stopping once a run of already known videos is found.
+        Since the API results are paged lazily, the remaining pages (containing only old videos) are never requested.
+        """
+        known_run = 0
+
+        for item in playlist_items:
+            if item.resource_video_id in known_ids:
+                known_run += 1
+                if known_run >= stop_count:
+                    self.log.info('Found %d known videos in a row for subscription %s, stopping.', known_run, sub)
+                    return
+            else:
+                known_run = 0
+
+            yield item
+
+    def load_known_videos(self, sub: Subscription) -> Tuple[Set[str], Set[int], List[datetime.datetime]]:
+        """
+        Loads the IDs, playlist indices and publish dates of the videos we already know for a subscription,
+        in a single query.
+        """
+        known_ids = set()
+        used_indices = set()
+        publish_dates = []
+        for video_id, playlist_index, publish_date in Video.objects.filter(subscription=sub)\
+                .values_list('video_id', 'playlist_index', 'publish_date'):
+            known_ids.add(video_id)
+            used_indices.add(playlist_index)
+            publish_dates.append(publish_date)
+
+        return known_ids, used_indices, publish_dates
+
+    def fetch_playlist_items(self, api: youtube.YoutubeAPI, sub: Subscription, known_ids: Set[str], stop_count: int):
+        """
+        Fetches the playlist items of a subscription, sorted in the order in which they should be added.
+        This method only talks to the YouTube API (it doesn't touch the database), so it is safe to call from
+        worker threads, as long as each thread uses its own API instance.
+        """
+        playlist_items = api.playlist_items(sub.playlist_id, maxResults=50)
+        if stop_count > 0:
+            playlist_items = self.iterate_until_known(sub, playlist_items, known_ids, stop_count)
+
+        if sub.rewrite_playlist_indices:
+            return sorted(playlist_items, key=lambda x: x.published_at)
+        return sorted(playlist_items, key=lambda x: x.position)
+
+    def store_new_videos(self, sub: Subscription, playlist_items, known_ids: Set[str], used_indices: Set[int],
+                         publish_dates: List[datetime.datetime]):
+        next_index = 1 + max(used_indices, default=-1)
 
+        new_videos = []
         for item in playlist_items:
-            results = Video.objects.filter(video_id=item.resource_video_id, subscription=sub)
+            if item.resource_video_id in known_ids:
+                continue
+
+            self.log.info('New video for subscription %s: %s %s"', sub, item.resource_video_id, item.title)
 
-            if not results.exists():
-                self.log.info('New video for subscription %s: %s %s"', sub, item.resource_video_id, item.title)
+            # fix playlist index if necessary
+            if sub.rewrite_playlist_indices or item.position in used_indices:
+                item.position = next_index
 
-                # fix playlist index if necessary
-                if sub.rewrite_playlist_indices or Video.objects.filter(subscription=sub, playlist_index=item.position).exists():
-                    highest = Video.objects.filter(subscription=sub).aggregate(Max('playlist_index'))['playlist_index__max']
-                    item.position = 1 + (highest or -1)
+            known_ids.add(item.resource_video_id)
+            used_indices.add(item.position)
+            publish_dates.append(item.published_at)
+            next_index = max(next_index, item.position + 1)
+            new_videos.append(Video.create(item, sub, save=False))
 
-                self.__new_vids.append(Video.create(item, sub))
-        sub.last_synchronised = datetime.datetime.now()
+        if len(new_videos) > 0:
+            Video.objects.bulk_create(new_videos)
+
+            # Not all database backends set the primary keys of objects created with bulk_create, so reload them
+            for chunk in iterate_chunks((video.video_id for video in new_videos), 500):
+                self.__new_vids.extend(Video.objects.filter(subscription=sub, video_id__in=chunk))
+
+        sub.last_synchronised = timezone.now()
+        sub.next_synchronisation = self.__started_at + Subscription.get_sync_interval(publish_dates,
+                                                                                      sub.last_synchronised)
         sub.save()
 
-    def fetch_missing_thumbnails(self, obj: Union[Subscription, Video]):
-        if obj.thumbnail.startswith("http"):
-            if isinstance(obj, Subscription):
-                obj.thumbnail = fetch_thumbnail(obj.thumbnail, 'sub', obj.playlist_id, settings.THUMBNAIL_SIZE_SUBSCRIPTION)
-            elif isinstance(obj, Video):
-                obj.thumbnail = fetch_thumbnail(obj.thumbnail, 'video', obj.video_id, settings.THUMBNAIL_SIZE_VIDEO)
-            obj.save()
-
-    def check_video_deleted(self, video: Video):
-        if video.downloaded_path is not None:
-            files = []
+    def check_new_videos(self, sub: Subscription):
+        known_ids, used_indices, publish_dates = self.load_known_videos(sub)
+        playlist_items = self.fetch_playlist_items(self.__api, sub, known_ids, self.get_incremental_stop_count(sub))
+        self.store_new_videos(sub, playlist_items, known_ids, used_indices, publish_dates)
+
+    def check_feed(self, sub: Subscription) -> Optional[feeds.FeedResult]:
+        """
+        Fetches the Atom feed of a subscription, which doesn't cost any API quota.
+        Like fetch_playlist_items, this doesn't touch the database, so it is safe to call from worker threads.
+        :return: Feed result, or None if the feed could not be fetched.
+        """
+        if sub.rewrite_playlist_indices:
+            url = feeds.build_feed_url(channel_id=sub.channel_id)
+        else:
+            url = feeds.build_feed_url(playlist_id=sub.playlist_id)
+
+        try:
+            return feeds.fetch_feed(url, sub.feed_etag, sub.feed_last_modified)
+        except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
+            self.log.warning('Could not check feed %s for subscription %s. Error: %s', url, sub, e)
+            return None
+
+    def check_all_new_videos(self, subs):
+        """
+        Looks for new videos in all the given subscriptions. The playlists are fetched from the API in parallel,
+        on a bounded pool of worker threads; all the database work is done on the calling thread, so there is a
+        single writer at all times.
+        """
+        concurrency = max(appconfig.sync_concurrency, 1)
+
+        # The API client is not thread safe, so each worker borrows its own instance
+        apis = queue.Queue()
+        apis.put(self.__api)
+        for _ in range(1, concurrency):
+            apis.put(youtube.YoutubeAPI.build_public())
+
+        feed_precheck = appconfig.sync_feed_precheck
+
+        def fetch(sub: Subscription, known_ids: Set[str], stop_count: int):
+            # Checking the feed first is only reliable for incremental synchronizations, where new videos appear
+            # at the top of the playlist
+            feed = None
+            if feed_precheck and stop_count > 0:
+                feed = self.check_feed(sub)
+                if feed is not None and all(video_id in known_ids for video_id in feed.video_ids):
+                    self.log.info('Nothing new in the feed of subscription %s, skipping.', sub)
+                    return [], feed
+
+            api = apis.get()
             try:
-                files = list(video.get_files())
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    self.log.error("Could not access path %s. Error: %s", video.downloaded_path, e)
-                    self.usr_err(f"Could not access path {video.downloaded_path}: {e}", suppress_notification=True)
-                    return
+                return self.fetch_playlist_items(api, sub, known_ids, stop_count), feed
+            finally:
+                apis.put(api)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='SynchronizeJob') as pool:
+            futures = {}
+            for sub in subs:
+                known_ids, used_indices, publish_dates = self.load_known_videos(sub)
+                future = pool.submit(fetch, sub, known_ids, self.get_incremental_stop_count(sub))
+                futures[future] = (sub, known_ids, used_indices, publish_dates)
+
+            for future in as_completed(futures):
+                sub, known_ids, used_indices, publish_dates = futures[future]
+                self.progress_advance(1, "Synchronizing subscription " + sub.name)
 
-            # Try to find a valid video file
-            found_video = False
-            for file in files:
-                mime, _ = mimetypes.guess_type(file)
-                if mime is not None and mime.startswith("video"):
+                try:
+                    playlist_items, feed = future.result()
+                except Exception as e:
+                    self.log.error("Failed to fetch playlist items for subscription %s. Error: %s", sub, e)
+                    self.usr_err(f"Could not synchronize subscription {sub}: {e}", suppress_notification=True)
+                    continue
+
+                if feed is not None:
+                    sub.feed_etag = feed.etag
+                    sub.feed_last_modified = feed.last_modified
+
+                self.store_new_videos(sub, playlist_items, known_ids, used_indices, publish_dates)
+                self.__thumbnails.submit(sub)
+
+    def check_video_deleted(self, video: Video, catalog: Optional[List[VideoFile]]) -> Set[str]:
+        """
+        Checks if the downloaded video file still exists (using the file catalog), and cleans up the remaining files
+        if the video file was deleted. The video is not saved.
+        :param video: Video
+        :param catalog: Cataloged files of the video, or None if they could not be accessed
+        :return: Set of changed fields
+        """
+        if not video.downloaded_path or catalog is None:
+            return set()
+
+        # Try to find a valid video file
+        found_video = False
+        for file in catalog:
+            if file.role == VIDEO_FILE_ROLE_VIDEO:
+                try:
+                    os.stat(file.path)
                     found_video = True
-
-            # Video not found, we can safely assume that the video was deleted.
-            if not found_video:
-                self.log.info("Video %d was deleted! [%s %s]", video.id, video.video_id, video.name)
-                # Clean up
-                for file in files:
-                    try:
-                        os.unlink(file)
-                    except OSError as e:
-                        self.log.error("Could not delete redundant file %s. Error: %s", file, e)
-                        self.usr_err(f"Could not delete redundant file {file}: {e}", suppress_notification=True)
-                video.downloaded_path = None
-
-                # Mark watched?
-                user = video.subscription.user
-                if user.preferences['mark_deleted_as_watched']:
-                    video.watched = True
-
-                video.save()
-
-    def update_video_stats(self, video: Video, yt_video):
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.log.error("Could not access path %s. Error: %s", file.path, e)
+                    self.usr_err(f"Could not access path {file.path}: {e}", suppress_notification=True)
+                    return set()
+
+        if found_video:
+            return set()
+
+        # Video not found, we can safely assume that the video was deleted.
+        self.log.info("Video %d was deleted! [%s %s]", video.id, video.video_id, video.name)
+        self.__snapshot.invalidate(os.path.dirname(video.downloaded_path))
+        return video.forget_deleted_files(catalog, self.__on_delete_error)
+
+    def __on_delete_error(self, path: str, error: OSError):
+        self.log.error("Could not delete redundant file %s. Error: %s", path, error)
+        self.usr_err(f"Could not delete redundant file {path}: {error}", suppress_notification=True)
+
+    def update_video_stats(self, video: Video, yt_video) -> Set[str]:
+        """
+        Updates the statistics of a video. The video is not saved.
+        :return: Set of changed fields
+        """
+        rating = video.rating
         if yt_video.n_likes is not None \
                 and yt_video.n_dislikes is not None \
                 and yt_video.n_likes + yt_video.n_dislikes > 0:
-            video.rating = yt_video.n_likes / (yt_video.n_likes + yt_video.n_dislikes)
+            rating = yt_video.n_likes / (yt_video.n_likes + yt_video.n_dislikes)
+
+        stats = {
+            'rating': rating,
+            'views': yt_video.n_views,
+            'duration': int(yt_video.duration.total_seconds()),
+        }
 
-        video.views = yt_video.n_views
-        video.duration = yt_video.duration.total_seconds()
-        video.save()
+        changed_fields = set()
+        for field, value in stats.items():
+            if getattr(video, field) != value:
+                setattr(video, field, value)
+                changed_fields.add(field)
+
+        return changed_fields
 
     @staticmethod
     def schedule_global_job():
+        if leader_election.forward(SynchronizeJob.schedule_global_job):
+            return
+
         trigger = CronTrigger.from_crontab(appconfig.sync_schedule)
+        deep_trigger = CronTrigger.from_crontab(appconfig.deep_sync_schedule)
 
         if SynchronizeJob.__global_sync_job is None:
-            trigger = CronTrigger.from_crontab(appconfig.sync_schedule)
-            SynchronizeJob.__global_sync_job = scheduler.add_job(SynchronizeJob, trigger, max_instances=1, coalesce=True)
+            SynchronizeJob.__global_sync_job = scheduler.add_job(SynchronizeJob, trigger, args=[None, False, True],
+                                                                 max_instances=1, coalesce=True)
 
         else:
             SynchronizeJob.__global_sync_job.reschedule(trigger, max_instances=1, coalesce=True)
 
+        if SynchronizeJob.__global_deep_sync_job is None:
+            SynchronizeJob.__global_deep_sync_job = scheduler.add_job(SynchronizeJob, deep_trigger, args=[None, True],
+                                                                      max_instances=1, coalesce=True)
+
+        else:
+            SynchronizeJob.__global_deep_sync_job.reschedule(deep_trigger, max_instances=1, coalesce=True)
+
     @staticmethod
     def schedule_now():
+        if leader_election.forward(SynchronizeJob.schedule_now):
+            return
         scheduler.add_job(SynchronizeJob, max_instances=1, coalesce=True)
 
     @staticmethod
     def schedule_now_for_subscription(subscription):
+        if leader_election.forward(SynchronizeJob.schedule_now_for_subscription, subscription):
+            return
         scheduler.add_job(SynchronizeJob, user=subscription.user, args=[subscription])
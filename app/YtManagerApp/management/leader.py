@@ -0,0 +1,218 @@
+import atexit
+import datetime
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Optional, Set
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from YtManagerApp.models import SchedulerLease, JobRequest
+
+SCHEDULER_LEASE_NAME = 'scheduler'
+# Every process taking part in the election also holds a lease of its own, so the others know it's alive
+PROCESS_LEASE_PREFIX = 'process:'
+
+
+def _encode_arg(value):
+    if isinstance(value, models.Model):
+        return {'__model__': value._meta.label, 'pk': value.pk}
+    return value
+
+
+def _decode_arg(value):
+    if isinstance(value, dict) and '__model__' in value:
+        return apps.get_model(value['__model__']).objects.get(pk=value['pk'])
+    return value
+
+
+def _function_path(function: Callable) -> str:
+    return f'{function.__module__}:{function.__qualname__}'
+
+
+def _resolve_function(path: str) -> Callable:
+    module_name, _, qualname = path.partition(':')
+    function = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        function = getattr(function, name)
+    return function
+
+
+class LeaderElection(object):
+    """
+    Makes sure only one server process runs the scheduler (and the download queue, and the download watcher), when
+    several processes share the database (e.g. gunicorn workers).
+
+    The leader holds a lease row in the database, which it renews periodically; if it stops renewing it (e.g. the
+    process died), another process takes over once the lease expires. Work requested in the other processes (e.g. a
+    user asking for a synchronization) is stored as a JobRequest, and carried out by the leader.
+    """
+
+    def __init__(self, identity: Optional[str] = None):
+        self.identity = identity or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.__process_lease_name = PROCESS_LEASE_PREFIX + uuid.uuid4().hex
+        self.is_leader = False
+        self.__participating = False
+        self.__on_elected = None  # type: Optional[Callable[[], None]]
+        self.__on_demoted = None  # type: Optional[Callable[[], None]]
+        self.__thread = None
+        self.log = logging.getLogger('leader')
+
+    @property
+    def participating(self) -> bool:
+        return self.__participating
+
+    def start(self, on_elected: Callable[[], None], on_demoted: Callable[[], None]):
+        """
+        Starts taking part in the election. The first attempt to get the lease is made right away.
+        :param on_elected: Called when this process becomes the leader
+        :param on_demoted: Called when this process loses the lease
+        """
+        if self.__thread is not None:
+            return
+
+        self.__on_elected = on_elected
+        self.__on_demoted = on_demoted
+        self.heartbeat()
+
+        self.__thread = threading.Thread(target=self.__run, name='LeaderElection', daemon=True)
+        self.__thread.start()
+        atexit.register(self.release)
+
+    def __run(self):
+        last_heartbeat = time.monotonic()
+        while True:
+            time.sleep(settings.JOB_REQUEST_POLL_INTERVAL)
+            try:
+                if time.monotonic() - last_heartbeat >= settings.SCHEDULER_LEASE_RENEW_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    self.heartbeat()
+                if self.is_leader:
+                    self.process_job_requests()
+            except Exception:
+                self.log.exception('Leader election failed.')
+            finally:
+                connection.close()
+
+    def __acquire(self) -> bool:
+        """
+        Takes the lease if it is free or expired, or renews it if this process holds it.
+        :return: True if this process holds the lease
+        """
+        now = timezone.now()
+        expires_at = now + datetime.timedelta(seconds=settings.SCHEDULER_LEASE_DURATION)
+
+        acquired = SchedulerLease.objects\
+            .filter(name=SCHEDULER_LEASE_NAME)\
+            .filter(Q(holder=self.identity) | Q(expires_at__lt=now))\
+            .update(holder=self.identity, expires_at=expires_at) > 0
+        if acquired:
+            return True
+
+        try:
+            with transaction.atomic():
+                SchedulerLease.objects.create(name=SCHEDULER_LEASE_NAME, holder=self.identity, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            return False
+
+    def __renew_process_lease(self):
+        now = timezone.now()
+        SchedulerLease.objects.update_or_create(
+            name=self.__process_lease_name,
+            defaults={'holder': self.identity,
+                      'expires_at': now + datetime.timedelta(seconds=settings.SCHEDULER_LEASE_DURATION)})
+
+        # Clean up after the processes which exited without releasing their lease
+        SchedulerLease.objects.filter(name__startswith=PROCESS_LEASE_PREFIX, expires_at__lt=now).delete()
+
+    def live_processes(self) -> Set[str]:
+        """
+        Gets the identities of the processes taking part in the election, which renewed their lease recently.
+        """
+        return set(SchedulerLease.objects
+                   .filter(name__startswith=PROCESS_LEASE_PREFIX, expires_at__gte=timezone.now())
+                   .values_list('holder', flat=True))
+
+    def heartbeat(self):
+        """
+        Renews the lease, or tries to take it over. Called periodically by the election thread.
+        """
+        self.__participating = True
+        try:
+            self.__renew_process_lease()
+            acquired = self.__acquire()
+        except Exception:
+            self.log.exception('Failed to renew the scheduler lease.')
+            acquired = False
+
+        if acquired and not self.is_leader:
+            self.log.info('Process %s now runs the scheduler.', self.identity)
+            self.is_leader = True
+            if self.__on_elected is not None:
+                self.__on_elected()
+
+        elif not acquired and self.is_leader:
+            self.log.error('Process %s lost the scheduler lease, stopping the scheduler.', self.identity)
+            self.is_leader = False
+            if self.__on_demoted is not None:
+                self.__on_demoted()
+
+    def release(self):
+        """
+        Gives up the lease (on shutdown), so another process can take over right away.
+        """
+        SchedulerLease.objects.filter(name=self.__process_lease_name).delete()
+        if self.is_leader:
+            self.is_leader = False
+            SchedulerLease.objects.filter(name=SCHEDULER_LEASE_NAME, holder=self.identity)\
+                .update(expires_at=timezone.now())
+
+    def forward(self, function: Callable, *args) -> bool:
+        """
+        Hands a call over to the leader, if this process is not the leader.
+        Usage: 'if leader_election.forward(function, arg1, arg2): return' at the start of the function.
+        :param function: Function or static method (it is looked up by name on the leader)
+        :param args: Arguments; model instances are passed by primary key
+        :return: True if the call was handed over, False if the caller should carry it out
+        """
+        if not self.__participating or self.is_leader:
+            return False
+
+        JobRequest.objects.create(function=_function_path(function),
+                                  args=json.dumps([_encode_arg(arg) for arg in args]))
+        return True
+
+    def process_job_requests(self):
+        """
+        Carries out the calls handed over by the other processes.
+        """
+        for request in JobRequest.objects.all():
+            # Claiming by deleting, in case two processes briefly both think they are the leader
+            if JobRequest.objects.filter(id=request.id).delete()[0] == 0:
+                continue
+
+            try:
+                function = _resolve_function(request.function)
+                args = [_decode_arg(arg) for arg in json.loads(request.args)]
+            except (ImportError, AttributeError, ValueError, ObjectDoesNotExist) as e:
+                self.log.warning('Dropping job request %s. Error: %s', request, e)
+                continue
+
+            try:
+                function(*args)
+            except Exception:
+                self.log.exception('Job request %s failed.', request)
+
+
+leader_election = LeaderElection()
@@ -0,0 +1,161 @@
+import atexit
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Optional, List, Dict
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.models import QuotaUsage
+
+# The YouTube API quota is reset at midnight, Pacific time
+QUOTA_TIMEZONE = pytz.timezone('America/Los_Angeles')
+
+
+def quota_date(now: Optional[datetime.datetime] = None) -> datetime.date:
+    """
+    Gets the quota day of a moment in time.
+    :param now: Moment in time (default: now)
+    :return: Date in YouTube's quota time zone
+    """
+    if now is None:
+        now = timezone.now()
+    return now.astimezone(QUOTA_TIMEZONE).date()
+
+
+class QuotaLedger(object):
+    """
+    Keeps track of the YouTube API quota consumed each day.
+
+    Every API request is recorded in memory first (requests are made from many threads); the records are written
+    to the database by flush(), which is called from the jobs that use the API, by the code reading the ledger, and
+    periodically in every server process (see start).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pending = defaultdict(lambda: [0, 0])  # (date, endpoint) -> [units, calls]
+        self.__thread = None
+        self.log = logging.getLogger('quota')
+
+    def start(self):
+        """
+        Starts writing the records to the database every QUOTA_FLUSH_INTERVAL seconds, and when the process exits.
+        """
+        if self.__thread is not None:
+            return
+
+        self.__thread = threading.Thread(target=self.__run, name='QuotaLedger', daemon=True)
+        self.__thread.start()
+        atexit.register(self.flush)
+
+    def __run(self):
+        while True:
+            time.sleep(settings.QUOTA_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                self.log.exception('Failed to write the API quota usage.')
+            finally:
+                connection.close()
+
+    def record(self, endpoint: str, units: int):
+        """
+        Records an API request. Can be called from any thread; it doesn't touch the database.
+        """
+        key = (quota_date(), endpoint)
+        with self.__lock:
+            pending = self.__pending[key]
+            pending[0] += units
+            pending[1] += 1
+
+    def flush(self):
+        """
+        Writes the recorded requests to the database.
+        """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = defaultdict(lambda: [0, 0])
+
+        if len(pending) == 0:
+            return
+
+        try:
+            with transaction.atomic():
+                for (date, endpoint), (units, calls) in pending.items():
+                    self.__add(date, endpoint, units, calls)
+        except Exception:
+            # Nothing was written; keep the records for the next time
+            with self.__lock:
+                for key, (units, calls) in pending.items():
+                    self.__pending[key][0] += units
+                    self.__pending[key][1] += calls
+            raise
+
+    @staticmethod
+    def __add(date: datetime.date, endpoint: str, units: int, calls: int):
+        # Several processes may write the same row at the same time
+        increment = {'units': F('units') + units, 'calls': F('calls') + calls}
+        if QuotaUsage.objects.filter(date=date, endpoint=endpoint).update(**increment) > 0:
+            return
+
+        try:
+            with transaction.atomic():
+                QuotaUsage.objects.create(date=date, endpoint=endpoint, units=units, calls=calls)
+        except IntegrityError:
+            # Created by another process in the meantime
+            QuotaUsage.objects.filter(date=date, endpoint=endpoint).update(**increment)
+
+    def used(self, date: Optional[datetime.date] = None) -> int:
+        """
+        Gets the number of quota units consumed in a day.
+        :param date: Quota day (default: today)
+        """
+        if date is None:
+            date = quota_date()
+
+        self.flush()
+        return QuotaUsage.objects.filter(date=date).aggregate(total=Sum('units'))['total'] or 0
+
+    def remaining(self) -> Optional[int]:
+        """
+        Gets the number of quota units still available today.
+        :return: Remaining units, or None if the daily quota is not limited.
+        """
+        daily_quota = appconfig.youtube_api_daily_quota
+        if daily_quota <= 0:
+            return None
+        return max(daily_quota - self.used(), 0)
+
+    def daily_totals(self, days: int = 7) -> List[Dict]:
+        """
+        Gets the quota consumed in each of the last few days.
+        :return: List of {date, units, calls}, newest first
+        """
+        self.flush()
+        since = quota_date() - datetime.timedelta(days=days - 1)
+        return list(QuotaUsage.objects.filter(date__gte=since)
+                    .values('date')
+                    .annotate(units=Sum('units'), calls=Sum('calls'))
+                    .order_by('-date'))
+
+    def endpoint_totals(self, date: Optional[datetime.date] = None) -> List[QuotaUsage]:
+        """
+        Gets the quota consumed by each API endpoint in a day.
+        :param date: Quota day (default: today)
+        """
+        if date is None:
+            date = quota_date()
+
+        self.flush()
+        return list(QuotaUsage.objects.filter(date=date).order_by('-units'))
+
+
+quota_ledger = QuotaLedger()
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+from typing import Iterable, List, Set
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.models import Video, VideoFile, VIDEO_FILE_ROLE_VIDEO
+from external.pytaw.pytaw.utils import iterate_chunks
+
+try:
+    from watchdog.events import EVENT_TYPE_DELETED, EVENT_TYPE_MOVED
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# Events are collected for a short while before being processed, so deleting a whole folder is handled at once
+WATCHER_DELAY = 2.0
+
+
+class DownloadWatcher(object):
+    """
+    Watches the download folders for deleted (or moved away) files, so videos deleted from disk outside of the
+    application are cleaned up right away, without waiting for a synchronization to notice.
+
+    Requires the optional 'watchdog' package. The watcher only sees the files deleted while it runs, so deep
+    synchronizations still check every downloaded file.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__observer = None
+        self.__timer = None
+        self.__deleted_files = set()  # type: Set[str]
+        self.__deleted_dirs = set()  # type: Set[str]
+        self.log = logging.getLogger('watcher')
+
+    @property
+    def running(self) -> bool:
+        return self.__observer is not None and self.__observer.is_alive()
+
+    @staticmethod
+    def get_download_folders() -> List[str]:
+        """
+        Gets the download folders of all the users, without the folders contained in other download folders.
+        """
+        folders = {os.path.abspath(user.preferences['download_path']) for user in User.objects.all()}
+        folders = sorted(folder for folder in folders if os.path.isdir(folder))
+
+        roots = []
+        for folder in folders:
+            if not any(folder.startswith(os.path.join(root, '')) for root in roots):
+                roots.append(folder)
+        return roots
+
+    def update(self):
+        """
+        Starts or stops watching, according to the settings. Also picks up changes of the download folders.
+        """
+        self.stop()
+        if appconfig.watch_downloads:
+            self.start()
+
+    def start(self):
+        if Observer is None:
+            self.log.warning('Cannot watch the download folders, the watchdog package is not installed.')
+            return
+
+        folders = self.get_download_folders()
+        observer = Observer()
+        observer.daemon = True
+        try:
+            for folder in folders:
+                observer.schedule(self, folder, recursive=True)
+            observer.start()
+        except OSError as e:
+            # e.g. the inotify watch limit was reached
+            self.log.error('Could not watch the download folders. Error: %s', e)
+            observer.stop()
+            return
+
+        self.__observer = observer
+        self.log.info('Watching download folders: %s', ', '.join(folders))
+
+    def stop(self):
+        observer, self.__observer = self.__observer, None
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+    def dispatch(self, event):
+        """
+        Called by the observer thread for every file system event.
+        """
+        if event.event_type not in (EVENT_TYPE_DELETED, EVENT_TYPE_MOVED):
+            return
+
+        with self.__lock:
+            if event.is_directory:
+                self.__deleted_dirs.add(os.fsdecode(event.src_path))
+            else:
+                self.__deleted_files.add(os.fsdecode(event.src_path))
+
+            if self.__timer is None:
+                self.__timer = threading.Timer(WATCHER_DELAY, self.__on_timer)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def __on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            self.log.exception('Failed to process deleted files.')
+        finally:
+            connection.close()
+
+    def flush(self):
+        """
+        Processes the events collected so far.
+        """
+        with self.__lock:
+            files, self.__deleted_files = self.__deleted_files, set()
+            dirs, self.__deleted_dirs = self.__deleted_dirs, set()
+            self.__timer = None
+
+        self.process_deleted(files, dirs)
+
+    def process_deleted(self, files: Iterable[str], dirs: Iterable[str] = ()):
+        """
+        Cleans up the videos whose video file is among the deleted files or folders.
+        :param files: Paths of the deleted files
+        :param dirs: Paths of the deleted folders
+        """
+        video_ids = set()
+        for chunk in iterate_chunks(sorted(files), 500):
+            video_ids.update(VideoFile.objects.filter(path__in=chunk, role=VIDEO_FILE_ROLE_VIDEO)
+                             .values_list('video_id', flat=True))
+        for directory in dirs:
+            video_ids.update(VideoFile.objects.filter(path__startswith=os.path.join(directory, ''),
+                                                      role=VIDEO_FILE_ROLE_VIDEO)
+                             .values_list('video_id', flat=True))
+
+        if len(video_ids) == 0:
+            return
+
+        videos = Video.objects.filter(id__in=video_ids, downloaded_path__isnull=False) \
+            .select_related('subscription__user').prefetch_related('files')
+
+        for video in videos:
+            catalog = list(video.files.all())
+
+            # There might be other video files left (e.g. another format)
+            if any(os.path.exists(file.path) for file in catalog if file.role == VIDEO_FILE_ROLE_VIDEO):
+                continue
+
+            self.log.info("Video %d was deleted! [%s %s]", video.id, video.video_id, video.name)
+            changed_fields = video.forget_deleted_files(catalog, self.__on_delete_error)
+            video.save(update_fields=changed_fields)
+
+    def __on_delete_error(self, path: str, error: OSError):
+        self.log.error("Could not delete redundant file %s. Error: %s", path, error)
+
+
+download_watcher = DownloadWatcher()
+
+
+def update_download_watcher(only_if_running: bool = False):
+    """
+    Updates the watcher after the settings changed. The watcher runs in the process which runs the scheduler, so the
+    update is handed over to it if needed.
+    :param only_if_running: Only update the watcher if it is running (used when only the download folders changed)
+    """
+    if leader_election.forward(update_download_watcher, only_if_running):
+        return
+
+    if download_watcher.running or not only_if_running:
+        download_watcher.update()
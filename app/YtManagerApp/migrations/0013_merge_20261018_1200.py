@@ -0,0 +1,14 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', 'subscription_last_synchronised'),
+        ('YtManagerApp', 'video_duration'),
+    ]
+
+    operations = [
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0013_merge_20261018_1200'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='stats_updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
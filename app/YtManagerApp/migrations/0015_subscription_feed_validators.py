@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0014_video_stats_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
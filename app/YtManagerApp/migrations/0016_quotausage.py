@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0015_subscription_feed_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('endpoint', models.CharField(max_length=64)),
+                ('units', models.IntegerField(default=0)),
+                ('calls', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date', 'endpoint'],
+                'unique_together': {('date', 'endpoint')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0016_quotausage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='next_synchronisation',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
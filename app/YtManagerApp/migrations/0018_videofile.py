@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0017_subscription_next_synchronisation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField()),
+                ('size', models.BigIntegerField(default=0)),
+                ('mtime', models.DateTimeField()),
+                ('mime', models.CharField(blank=True, max_length=128, null=True)),
+                ('role', models.CharField(choices=[('video', 'Video'), ('subtitle', 'Subtitle'), ('thumbnail', 'Thumbnail'), ('description', 'Description'), ('other', 'Other')], default='other', max_length=16)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='YtManagerApp.Video')),
+            ],
+        ),
+    ]
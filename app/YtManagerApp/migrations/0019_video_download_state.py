@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+def set_download_state(apps, schema_editor):
+    Video = apps.get_model('YtManagerApp', 'Video')
+    # Failed downloads were marked with an empty path
+    Video.objects.filter(downloaded_path='').update(download_state='failed', downloaded_path=None)
+    Video.objects.filter(downloaded_path__isnull=False).update(download_state='done')
+
+
+def unset_download_state(apps, schema_editor):
+    Video = apps.get_model('YtManagerApp', 'Video')
+    Video.objects.filter(download_state='failed').update(downloaded_path='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0018_videofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='download_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='download_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='download_state',
+            field=models.CharField(blank=True, choices=[('', 'Not downloaded'), ('queued', 'Queued'), ('running', 'Downloading'), ('failed', 'Failed'), ('done', 'Downloaded')], default='', max_length=16),
+        ),
+        migrations.RunPython(set_download_state, unset_download_state),
+    ]
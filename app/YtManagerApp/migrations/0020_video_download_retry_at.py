@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0019_video_download_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='download_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='download_state',
+            field=models.CharField(blank=True, choices=[('', 'Not downloaded'), ('queued', 'Queued'), ('running', 'Downloading'), ('retry', 'Waiting to retry'), ('failed', 'Failed'), ('done', 'Downloaded')], default='', max_length=16),
+        ),
+    ]
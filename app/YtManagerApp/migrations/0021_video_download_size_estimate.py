@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0020_video_download_retry_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='download_size_estimate',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
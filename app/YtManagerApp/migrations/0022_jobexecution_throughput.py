@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0021_video_download_size_estimate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobexecution',
+            name='downloaded_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobexecution',
+            name='throughput',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
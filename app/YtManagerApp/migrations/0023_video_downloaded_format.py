@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0022_jobexecution_throughput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='downloaded_format',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
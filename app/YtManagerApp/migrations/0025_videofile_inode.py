@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0024_scheduler_lease_job_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videofile',
+            name='inode',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
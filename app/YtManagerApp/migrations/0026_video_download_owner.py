@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('YtManagerApp', '0025_videofile_inode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='download_owner',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -1,13 +1,17 @@
+import datetime
+import heapq
 import logging
 import mimetypes
 import os
-from typing import Callable, Union, Any, Optional
+from typing import Callable, Union, Any, Optional, Iterable, List, Set
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
 from django.db.models.functions import Lower
 
 from YtManagerApp.utils import youtube
+from YtManagerApp.utils.files import DirectorySnapshot
 
 # help_text = user shown text
 # verbose_name = user shown name
@@ -30,6 +34,49 @@ VIDEO_ORDER_MAPPING = {
     'rating': '-rating'
 }
 
+# The statistics of recent videos change a lot, while for old videos they barely change, so they are refreshed
+# less often. Each tier is a tuple (maximum video age, refresh interval); the last tier matches all the other videos.
+VIDEO_STATS_REFRESH_TIERS = [
+    (datetime.timedelta(days=2), datetime.timedelta(hours=1)),
+    (datetime.timedelta(days=30), datetime.timedelta(days=1)),
+    (None, datetime.timedelta(weeks=1)),
+]
+
+# Subscriptions are synchronized a few times between two uploads, based on the last few upload dates. Channels which
+# didn't upload anything for longer than usual are checked less and less often.
+SUBSCRIPTION_SYNC_INTERVAL_MIN = datetime.timedelta(hours=1)
+SUBSCRIPTION_SYNC_INTERVAL_MAX = datetime.timedelta(days=7)
+SUBSCRIPTION_SYNC_CHECKS_PER_UPLOAD = 4
+SUBSCRIPTION_SYNC_CADENCE_SAMPLES = 20
+# The scheduled synchronizations also take the subscriptions which become due shortly after they start; otherwise, small
+# differences in the start times would make them wait for the next one.
+SUBSCRIPTION_SYNC_DUE_TOLERANCE = datetime.timedelta(minutes=5)
+
+# Download states of a video. Queued and running downloads are 'in flight', and must not be enqueued again.
+VIDEO_DOWNLOAD_STATE_NONE = ''
+VIDEO_DOWNLOAD_STATE_QUEUED = 'queued'
+VIDEO_DOWNLOAD_STATE_RUNNING = 'running'
+VIDEO_DOWNLOAD_STATE_RETRY = 'retry'
+VIDEO_DOWNLOAD_STATE_FAILED = 'failed'
+VIDEO_DOWNLOAD_STATE_DONE = 'done'
+
+VIDEO_DOWNLOAD_STATES = [
+    (VIDEO_DOWNLOAD_STATE_NONE, 'Not downloaded'),
+    (VIDEO_DOWNLOAD_STATE_QUEUED, 'Queued'),
+    (VIDEO_DOWNLOAD_STATE_RUNNING, 'Downloading'),
+    (VIDEO_DOWNLOAD_STATE_RETRY, 'Waiting to retry'),
+    (VIDEO_DOWNLOAD_STATE_FAILED, 'Failed'),
+    (VIDEO_DOWNLOAD_STATE_DONE, 'Downloaded'),
+]
+
+VIDEO_DOWNLOAD_STATES_IN_FLIGHT = [VIDEO_DOWNLOAD_STATE_QUEUED, VIDEO_DOWNLOAD_STATE_RUNNING]
+
+# Videos which will be downloaded without being picked up by the synchronization again
+VIDEO_DOWNLOAD_STATES_PENDING = VIDEO_DOWNLOAD_STATES_IN_FLIGHT + [VIDEO_DOWNLOAD_STATE_RETRY]
+
+# Stored as the size estimate when youtube-dl couldn't tell the size of a download, so it isn't asked again
+VIDEO_SIZE_ESTIMATE_UNKNOWN = -1
+
 
 class SubscriptionFolder(models.Model):
     name = models.CharField(null=False, max_length=250)
@@ -111,6 +158,10 @@ class Subscription(models.Model):
     # youtube adds videos to the 'Uploads' playlist at the top instead of the bottom
     rewrite_playlist_indices = models.BooleanField(null=False, default=False)
     last_synchronised = models.DateTimeField(null=True, blank=True)
+    next_synchronisation = models.DateTimeField(null=True, blank=True, db_index=True)
+    # validators of the last fetched Atom feed, used for conditional requests
+    feed_etag = models.CharField(max_length=256, null=True, blank=True)
+    feed_last_modified = models.CharField(max_length=64, null=True, blank=True)
 
     # overrides
     auto_download = models.BooleanField(null=True, blank=True)
@@ -160,6 +211,36 @@ class Subscription(models.Model):
 
             self.copy_from_channel(info_channel)
 
+    @staticmethod
+    def get_sync_interval(publish_dates: Iterable[datetime.datetime], now: datetime.datetime) -> datetime.timedelta:
+        """
+        Determines how often a subscription should be synchronized, based on how often it gets new videos.
+        :param publish_dates: Publish dates of the videos in the subscription, in any order
+        :param now: Current time
+        :return: Time until the next synchronization
+        """
+        recent = heapq.nlargest(SUBSCRIPTION_SYNC_CADENCE_SAMPLES, publish_dates)
+        if len(recent) < 2:
+            return SUBSCRIPTION_SYNC_INTERVAL_MIN
+
+        gaps = sorted(newer - older for newer, older in zip(recent, recent[1:]))
+        median_gap = gaps[len(gaps) // 2]
+        interval = median_gap / SUBSCRIPTION_SYNC_CHECKS_PER_UPLOAD
+
+        # Back off for channels which are quiet for longer than usual
+        silence = now - recent[0]
+        if silence > median_gap:
+            interval = max(interval, silence / SUBSCRIPTION_SYNC_CHECKS_PER_UPLOAD)
+
+        return min(max(interval, SUBSCRIPTION_SYNC_INTERVAL_MIN), SUBSCRIPTION_SYNC_INTERVAL_MAX)
+
+    @staticmethod
+    def sync_due_filter(now: datetime.datetime) -> Q:
+        """
+        Builds a filter matching the subscriptions which are due for a synchronization.
+        """
+        return Q(next_synchronisation__isnull=True) | Q(next_synchronisation__lte=now + SUBSCRIPTION_SYNC_DUE_TOLERANCE)
+
     def delete_subscription(self, keep_downloaded_videos: bool):
         self.delete()
 
@@ -167,6 +248,13 @@ class Subscription(models.Model):
         from YtManagerApp.management.jobs.synchronize import SynchronizeJob
         SynchronizeJob.schedule_now_for_subscription(self)
 
+    def get_downloaded_size(self) -> int:
+        """
+        Gets the total size of the downloaded files of this subscription, from the file catalog.
+        :return: Size in bytes
+        """
+        return VideoFile.objects.filter(video__subscription=self).aggregate(total=Sum('size'))['total'] or 0
+
 
 class Video(models.Model):
     video_id = models.CharField(null=False, max_length=12)
@@ -183,9 +271,21 @@ class Video(models.Model):
     views = models.IntegerField(null=False, default=0)
     rating = models.FloatField(null=False, default=0.5)
     duration = models.IntegerField(null=False, default=0)
+    stats_updated_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    download_state = models.CharField(max_length=16, null=False, blank=True, choices=VIDEO_DOWNLOAD_STATES,
+                                      default=VIDEO_DOWNLOAD_STATE_NONE)
+    download_attempts = models.IntegerField(null=False, default=0)
+    download_error = models.TextField(null=False, blank=True, default='')
+    download_retry_at = models.DateTimeField(null=True, blank=True)
+    # Size reported by youtube-dl before downloading, in bytes (VIDEO_SIZE_ESTIMATE_UNKNOWN if it couldn't tell)
+    download_size_estimate = models.BigIntegerField(null=True, blank=True)
+    # youtube-dl format the video was downloaded in, so other copies of the same video can reuse the files
+    downloaded_format = models.CharField(max_length=255, null=False, blank=True, default='')
+    # Identity of the process running the download (see LeaderElection)
+    download_owner = models.CharField(max_length=255, null=False, blank=True, default='')
 
     @staticmethod
-    def create(playlist_item: youtube.PlaylistItem, subscription: Subscription):
+    def create(playlist_item: youtube.PlaylistItem, subscription: Subscription, save: bool = True):
         video = Video()
         video.video_id = playlist_item.resource_video_id
         video.name = playlist_item.title
@@ -197,13 +297,48 @@ class Video(models.Model):
         video.playlist_index = playlist_item.position
         video.publish_date = playlist_item.published_at
         video.thumbnail = youtube.best_thumbnail(playlist_item).url
-        video.save()
+        if save:
+            video.save()
         return video
 
+    def get_stats_refresh_interval(self, now: datetime.datetime) -> datetime.timedelta:
+        """
+        Gets how often the statistics of this video should be refreshed, based on the age of the video.
+        """
+        age = now - self.publish_date
+        for max_age, interval in VIDEO_STATS_REFRESH_TIERS:
+            if max_age is None or age < max_age:
+                return interval
+
+    def is_stats_refresh_due(self, now: datetime.datetime) -> bool:
+        return self.stats_updated_at is None \
+            or self.stats_updated_at + self.get_stats_refresh_interval(now) <= now
+
+    @staticmethod
+    def stats_refresh_due_filter(now: datetime.datetime) -> Q:
+        """
+        Builds a filter which selects the videos whose statistics should be refreshed.
+        This is the database equivalent of is_stats_refresh_due.
+        """
+        due = Q(stats_updated_at__isnull=True)
+        previous_max_age = None
+
+        for max_age, interval in VIDEO_STATS_REFRESH_TIERS:
+            tier = Q(stats_updated_at__lte=now - interval)
+            if max_age is not None:
+                tier &= Q(publish_date__gt=now - max_age)
+            if previous_max_age is not None:
+                tier &= Q(publish_date__lte=now - previous_max_age)
+
+            due |= tier
+            previous_max_age = max_age
+
+        return due
+
     def mark_watched(self):
         self.watched = True
-        self.save()
-        if self.downloaded_path is not None:
+        self.save(update_fields=['watched'])
+        if self.downloaded_path:
             from YtManagerApp.management.appconfig import appconfig
             from YtManagerApp.management.jobs.delete_video import DeleteVideoJob
             from YtManagerApp.management.jobs.synchronize import SynchronizeJob
@@ -215,22 +350,66 @@ class Video(models.Model):
     def mark_unwatched(self):
         from YtManagerApp.management.jobs.synchronize import SynchronizeJob
         self.watched = False
-        self.save()
+        self.save(update_fields=['watched'])
         SynchronizeJob.schedule_now_for_subscription(self.subscription)
 
-    def get_files(self):
-        if self.downloaded_path is not None:
+    def get_files(self, snapshot: Optional[DirectorySnapshot] = None):
+        """
+        Finds the downloaded files of this video (video, subtitles, thumbnails etc).
+        :param snapshot: Directory snapshot used to avoid listing the same directory for every video. If not given,
+        the directory is listed again.
+        :return: Iterator of file paths
+        """
+        if self.downloaded_path:
             directory, file_pattern = os.path.split(self.downloaded_path)
+            if snapshot is not None:
+                yield from snapshot.find_prefixed(directory, file_pattern)
+                return
+
             for file in os.listdir(directory):
                 if file.startswith(file_pattern):
                     yield os.path.join(directory, file)
 
+    def scan_files(self, snapshot: Optional[DirectorySnapshot] = None) -> List['VideoFile']:
+        """
+        Looks for the downloaded files of this video on disk.
+        :param snapshot: Directory snapshot (see get_files)
+        :return: List of VideoFile objects (not saved)
+        """
+        files = []
+        for path in self.get_files(snapshot):
+            try:
+                files.append(VideoFile.from_stat(self, path, os.stat(path)))
+            except FileNotFoundError:
+                pass
+
+        return files
+
+    def catalog_files(self, snapshot: Optional[DirectorySnapshot] = None) -> List['VideoFile']:
+        """
+        Replaces the file catalog of this video with the files found on disk.
+        :param snapshot: Directory snapshot (see get_files)
+        :return: List of cataloged files
+        """
+        files = self.scan_files(snapshot)
+        with transaction.atomic():
+            VideoFile.objects.filter(video=self).delete()
+            VideoFile.objects.bulk_create(files)
+
+        return files
+
     def find_video(self):
         """
         Finds the video file from the downloaded files, and
         returns
         :return: Tuple containing file path and mime type
         """
+        catalog = list(self.files.all())
+        if len(catalog) > 0:
+            return next(((file.path, file.mime) for file in catalog if file.role == VIDEO_FILE_ROLE_VIDEO),
+                        (None, None))
+
+        # Videos downloaded before the file catalog existed are cataloged by the next synchronization
         for file in self.get_files():
             mime, _ = mimetypes.guess_type(file)
             if mime is not None and mime.startswith('video/'):
@@ -239,7 +418,7 @@ class Video(models.Model):
         return None, None
 
     def delete_files(self):
-        if self.downloaded_path is not None:
+        if self.downloaded_path:
             from YtManagerApp.management.jobs.delete_video import DeleteVideoJob
             from YtManagerApp.management.appconfig import appconfig
             from YtManagerApp.management.jobs.synchronize import SynchronizeJob
@@ -249,12 +428,80 @@ class Video(models.Model):
             # Mark watched?
             if self.subscription.user.preferences['mark_deleted_as_watched']:
                 self.watched = True
+                self.save(update_fields=['watched'])
                 SynchronizeJob.schedule_now_for_subscription(self.subscription)
 
+    def forget_deleted_files(self, catalog: List['VideoFile'],
+                             on_error: Optional[Callable[[str, OSError], None]] = None) -> Set[str]:
+        """
+        Cleans up after the video file was deleted from disk (outside of the application): deletes the remaining files
+        (subtitles, thumbnails etc) and the file catalog, and marks the video as watched if the user wants it.
+        The video is not saved.
+        :param catalog: Cataloged files of the video
+        :param on_error: Called with the path and the error for every file which could not be deleted
+        :return: Set of changed fields
+        """
+        shared = VideoFile.get_shared_paths(self, [file.path for file in catalog])
+        for file in catalog:
+            if file.path in shared:
+                continue
+            try:
+                os.unlink(file.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if on_error is not None:
+                    on_error(file.path, e)
+
+        VideoFile.objects.filter(video=self).delete()
+        self.downloaded_path = None
+        changed_fields = {'downloaded_path'}
+
+        # Mark watched?
+        if self.subscription.user.preferences['mark_deleted_as_watched'] and not self.watched:
+            self.watched = True
+            changed_fields.add('watched')
+
+        return changed_fields
+
+    def claim_download_queued(self, first_attempt: bool) -> bool:
+        """
+        Atomically marks the video as queued for download, unless a download is already in flight.
+        :param first_attempt: If true, the attempt count, the last error and the pending retry are reset
+        :return: True if the video was marked as queued
+        """
+        fields = {'download_state': VIDEO_DOWNLOAD_STATE_QUEUED}
+        if first_attempt:
+            fields.update(download_attempts=0, download_error='', download_retry_at=None)
+
+        claimed = Video.objects.filter(id=self.id).exclude(download_state__in=VIDEO_DOWNLOAD_STATES_IN_FLIGHT)\
+            .update(**fields) > 0
+        if claimed:
+            for field, value in fields.items():
+                setattr(self, field, value)
+        return claimed
+
+    def claim_download_running(self, owner: str = '') -> bool:
+        """
+        Atomically marks a queued video as being downloaded, so only one worker can download it.
+        :param owner: Identity of the process running the download
+        :return: True if the video was claimed
+        """
+        claimed = Video.objects.filter(id=self.id, download_state=VIDEO_DOWNLOAD_STATE_QUEUED)\
+            .update(download_state=VIDEO_DOWNLOAD_STATE_RUNNING, download_attempts=F('download_attempts') + 1,
+                    download_owner=owner) > 0
+        if claimed:
+            self.refresh_from_db(fields=['download_state', 'download_attempts', 'downloaded_path', 'download_owner'])
+        return claimed
+
     def download(self):
+        """
+        Downloads the video. Used when the user asks for it, so it goes before the automatic downloads.
+        """
         if not self.downloaded_path:
+            from YtManagerApp.management.download_queue import DOWNLOAD_PRIORITY_INTERACTIVE
             from YtManagerApp.management.jobs.download_video import DownloadVideoJob
-            DownloadVideoJob.schedule(self)
+            DownloadVideoJob.schedule(self, priority=DOWNLOAD_PRIORITY_INTERACTIVE)
 
     def __str__(self):
         return self.name
@@ -262,6 +509,104 @@ class Video(models.Model):
     def __repr__(self):
         return f'video {self.id}, video_id="{self.video_id}"'
 
+    @staticmethod
+    def get_user_pending_size(user: User, exclude: Optional['Video'] = None) -> int:
+        """
+        Gets how much space the pending downloads of an user will take, from the sizes youtube-dl estimated for them.
+        Downloads of unknown size are not counted.
+        :param exclude: Video left out of the total (e.g. the one being checked)
+        :return: Size in bytes
+        """
+        pending = Video.objects.filter(subscription__user=user, downloaded_path__isnull=True,
+                                       download_state__in=VIDEO_DOWNLOAD_STATES_PENDING, download_size_estimate__gt=0)
+        if exclude is not None:
+            pending = pending.exclude(id=exclude.id)
+        return pending.aggregate(total=Sum('download_size_estimate'))['total'] or 0
+
+
+VIDEO_FILE_ROLE_VIDEO = 'video'
+VIDEO_FILE_ROLE_SUBTITLE = 'subtitle'
+VIDEO_FILE_ROLE_THUMBNAIL = 'thumbnail'
+VIDEO_FILE_ROLE_DESCRIPTION = 'description'
+VIDEO_FILE_ROLE_OTHER = 'other'
+
+VIDEO_FILE_ROLES = [
+    (VIDEO_FILE_ROLE_VIDEO, 'Video'),
+    (VIDEO_FILE_ROLE_SUBTITLE, 'Subtitle'),
+    (VIDEO_FILE_ROLE_THUMBNAIL, 'Thumbnail'),
+    (VIDEO_FILE_ROLE_DESCRIPTION, 'Description'),
+    (VIDEO_FILE_ROLE_OTHER, 'Other'),
+]
+
+SUBTITLE_EXTENSIONS = {'.vtt', '.srt', '.ass', '.ssa', '.ttml', '.sbv', '.srv1', '.srv2', '.srv3', '.lrc'}
+
+
+class VideoFile(models.Model):
+    """
+    A downloaded file belonging to a video.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='files')
+    path = models.TextField(null=False)
+    size = models.BigIntegerField(null=False, default=0)
+    mtime = models.DateTimeField(null=False)
+    mime = models.CharField(max_length=128, null=True, blank=True)
+    role = models.CharField(max_length=16, null=False, choices=VIDEO_FILE_ROLES, default=VIDEO_FILE_ROLE_OTHER)
+    # 'device:inode', which is the same for the hard links of a file (see DownloadVideoJob reusing downloaded copies)
+    inode = models.CharField(max_length=64, null=True, blank=True)
+
+    def __str__(self):
+        return self.path
+
+    @staticmethod
+    def guess_role(path: str, mime: Optional[str]) -> str:
+        extension = os.path.splitext(path)[1].lower()
+        if extension in SUBTITLE_EXTENSIONS:
+            return VIDEO_FILE_ROLE_SUBTITLE
+        if extension == '.description':
+            return VIDEO_FILE_ROLE_DESCRIPTION
+        if mime is not None and mime.startswith('video/'):
+            return VIDEO_FILE_ROLE_VIDEO
+        if mime is not None and mime.startswith('image/'):
+            return VIDEO_FILE_ROLE_THUMBNAIL
+        return VIDEO_FILE_ROLE_OTHER
+
+    @staticmethod
+    def from_stat(video: Video, path: str, stat: os.stat_result) -> 'VideoFile':
+        mime, _ = mimetypes.guess_type(path)
+        return VideoFile(video=video,
+                         path=path,
+                         size=stat.st_size,
+                         mtime=datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+                         mime=mime,
+                         role=VideoFile.guess_role(path, mime),
+                         inode=f'{stat.st_dev}:{stat.st_ino}' if stat.st_ino else None)
+
+    def same_as(self, other: 'VideoFile') -> bool:
+        return (self.path, self.size, self.mtime) == (other.path, other.size, other.mtime)
+
+    @staticmethod
+    def get_shared_paths(video: Video, paths: Iterable[str]) -> Set[str]:
+        """
+        Finds which of the given files also belong to other videos (the same video downloaded for several
+        subscriptions, to the same path). The catalog counts the owners of a file, so a shared file is only deleted
+        with its last owner.
+        """
+        return set(VideoFile.objects.filter(path__in=list(paths)).exclude(video=video).values_list('path', flat=True))
+
+    @staticmethod
+    def get_user_downloaded_size(user: User) -> int:
+        """
+        Gets the total size of the files downloaded by an user, from the file catalog. Files shared by several videos
+        (the same path, or hard links of the same file) are only counted once.
+        :return: Size in bytes
+        """
+        sizes = {}
+        for path, inode, size in VideoFile.objects.filter(video__subscription__user=user)\
+                .values_list('path', 'inode', 'size'):
+            sizes[inode or path] = size
+
+        return sum(sizes.values())
+
 
 JOB_STATES = [
     ('running', 0),
@@ -295,6 +640,9 @@ class JobExecution(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     description = models.CharField(max_length=250, null=False, default="")
     status = models.IntegerField(choices=JOB_STATES, null=False, default=0)
+    # Set by the download jobs: bytes transferred, and the transfer rate in bytes per second
+    downloaded_bytes = models.BigIntegerField(null=True, blank=True)
+    throughput = models.FloatField(null=True, blank=True)
 
 
 class JobMessage(models.Model):
@@ -304,3 +652,49 @@ class JobMessage(models.Model):
     message = models.CharField(max_length=1024, null=False, default="")
     level = models.IntegerField(choices=JOB_MESSAGE_LEVELS, null=False, default=0)
     suppress_notification = models.BooleanField(null=False, default=False)
+
+
+class QuotaUsage(models.Model):
+    """
+    YouTube API quota consumed in one day (in YouTube's quota time zone), for one API endpoint.
+    """
+    date = models.DateField(null=False, db_index=True)
+    endpoint = models.CharField(max_length=64, null=False)
+    units = models.IntegerField(null=False, default=0)
+    calls = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        ordering = ['-date', 'endpoint']
+        unique_together = [['date', 'endpoint']]
+
+    def __str__(self):
+        return f'{self.date} {self.endpoint}: {self.units} units'
+
+
+class SchedulerLease(models.Model):
+    """
+    Lease held by the process which runs the scheduler, when several server processes share the database (e.g.
+    gunicorn workers). The holder renews it periodically; when it expires, another process takes over.
+    """
+    name = models.CharField(max_length=64, null=False, unique=True)
+    holder = models.CharField(max_length=255, null=False)
+    expires_at = models.DateTimeField(null=False)
+
+    def __str__(self):
+        return f'{self.name}: {self.holder} until {self.expires_at}'
+
+
+class JobRequest(models.Model):
+    """
+    Work requested by a server process which doesn't run the scheduler, waiting to be picked up by the one which does.
+    """
+    created_at = models.DateTimeField(auto_now_add=True, null=False)
+    # Dotted path of the function to call on the scheduler process, and its arguments (JSON)
+    function = models.CharField(max_length=255, null=False)
+    args = models.TextField(null=False, default='[]')
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.function}({self.args})'
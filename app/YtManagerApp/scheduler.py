@@ -210,6 +210,11 @@ class YtsmScheduler(object):
         self._apscheduler = BackgroundScheduler()
 
     def initialize(self):
+        if self._apscheduler.running:
+            # Paused after losing the scheduler lease (see management.leader); the jobs were kept
+            self._apscheduler.resume()
+            return
+
         # set state of existing jobs as "interrupted"
         JobExecution.objects\
             .filter(status=JOB_STATES_MAP['running'])\
@@ -218,6 +223,13 @@ class YtsmScheduler(object):
         self._configure_scheduler()
         self._apscheduler.start()
 
+    def pause(self):
+        """
+        Stops starting jobs (the running ones finish), until initialize is called again.
+        """
+        if self._apscheduler.running:
+            self._apscheduler.pause()
+
     def _configure_scheduler(self):
         logger = logging.getLogger('scheduler')
         executors = {
@@ -254,6 +266,12 @@ class YtsmScheduler(object):
             job_execution.end_date = datetime.datetime.now(tz=pytz.UTC)
             job_execution.save()
 
+    def run_job(self, job_class: Type[Job], user: Optional[User] = None, args: Union[tuple, list] = None):
+        """
+        Runs a job right away, on the calling thread (used by the download queue, which has its own workers).
+        """
+        self._run_job(job_class, user, args or [])
+
     def add_job(self, job_class: Type[Job], trigger: Union[str, BaseTrigger] = None,
                 args: Union[list, tuple] = None,
                 user: Optional[User] = None,
@@ -0,0 +1,27 @@
+from django import template
+from django.conf import settings
+from django.urls import reverse
+
+from YtManagerApp.utils.thumbnails import thumbnail_srcset
+
+register = template.Library()
+
+
+@register.filter(name='srcset')
+def srcset(url: str) -> str:
+    """
+    {{ video.thumbnail|srcset }}
+    Gives the srcset attribute of a thumbnail, or an empty string if it comes in a single size.
+    """
+    return thumbnail_srcset(url, settings.THUMBNAIL_SCALES) or ''
+
+
+@register.filter(name='thumbnail_url')
+def thumbnail_url(video) -> str:
+    """
+    {{ video|thumbnail_url }}
+    Gives the URL of a video's thumbnail. Thumbnails which were not fetched yet are fetched when first requested.
+    """
+    if video.thumbnail.startswith("http"):
+        return reverse('video-thumbnail', args=[video.id])
+    return video.thumbnail
@@ -1 +1,1077 @@
-# Create your tests here.
+import datetime
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pytz
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.management.downloader import downloader_process_subscription
+from YtManagerApp.management.download_pool import DownloadPool, download_pool
+from YtManagerApp.management.download_queue import DownloadQueue, download_queue, DOWNLOAD_PRIORITY_INTERACTIVE, \
+    parse_download_windows, in_download_window
+from YtManagerApp.management.jobs.delete_video import DeleteVideoJob
+from YtManagerApp.management.jobs.download_video import DownloadVideoJob, make_output_directory, \
+    is_permanent_download_error, get_retry_delay
+from YtManagerApp.management.jobs.synchronize import SynchronizeJob
+from YtManagerApp.management.leader import LeaderElection
+from YtManagerApp.management.quota import QuotaLedger, quota_date
+from YtManagerApp.scheduler import scheduler
+from YtManagerApp.management import downloader, watcher
+from YtManagerApp.management.downloader import fetch_thumbnail
+from YtManagerApp.models import Subscription, Video, VideoFile, JobExecution, JobMessage, JobRequest, QuotaUsage, \
+    SchedulerLease, VIDEO_DOWNLOAD_STATE_NONE, VIDEO_DOWNLOAD_STATE_QUEUED, VIDEO_DOWNLOAD_STATE_RUNNING, \
+    VIDEO_DOWNLOAD_STATE_RETRY, VIDEO_DOWNLOAD_STATE_DONE, VIDEO_DOWNLOAD_STATE_FAILED
+from YtManagerApp.utils import youtube, feeds
+from YtManagerApp.utils.fake_youtube import FakeYoutubeData, FakeYoutubeServer
+from YtManagerApp.utils.files import DirectorySnapshot
+from YtManagerApp.utils.download_process import get_info_size
+from YtManagerApp.utils.thumbnails import thumbnail_srcset
+
+
+def make_playlist_item(video_id: str, position: int, published_at: datetime.datetime):
+    return youtube.PlaylistItem(None, 'item_' + video_id, {
+        'kind': 'youtube#playlistItem',
+        'id': 'item_' + video_id,
+        'snippet': {
+            'title': 'Video ' + video_id,
+            'description': 'Description of ' + video_id,
+            'channelId': 'UC_test',
+            'channelTitle': 'Test channel',
+            'playlistId': 'UU_test',
+            'publishedAt': published_at.isoformat(),
+            'position': position,
+            'thumbnails': {
+                'default': {'url': f'http://localhost/{video_id}.jpg', 'width': 120, 'height': 90},
+            },
+            'resourceId': {'kind': 'youtube#video', 'videoId': video_id},
+        }
+    })
+
+
+def make_uploads(count: int, start: int = 0):
+    """
+    Builds a list of playlist items, the way they are returned for an 'Uploads' playlist (newest first).
+    """
+    base_date = datetime.datetime(2019, 1, 1, tzinfo=pytz.UTC)
+    items = [make_playlist_item(f'vid{i:05d}', 0, base_date + datetime.timedelta(days=i))
+             for i in range(start, start + count)]
+    items.reverse()
+    for position, item in enumerate(items):
+        item.position = position
+    return items
+
+
+def make_video_stats(video_id: str, views: int):
+    return youtube.Video(None, video_id, {
+        'kind': 'youtube#video',
+        'id': video_id,
+        'statistics': {'viewCount': views, 'likeCount': 9, 'dislikeCount': 1},
+        'contentDetails': {'duration': 'PT10M'},
+    })
+
+
+class FakeYoutubeAPI(object):
+    cache = None
+
+    def __init__(self, playlist_items, video_views=None):
+        self.playlist_items_list = playlist_items
+        self.video_views = video_views or {}
+        self.consumed_items = 0
+
+    def playlist_items(self, playlist_id, **kwargs):
+        for item in self.playlist_items_list:
+            self.consumed_items += 1
+            yield item
+
+    def videos(self, id_list, **kwargs):
+        return [make_video_stats(video_id, self.video_views[video_id])
+                for video_id in id_list if video_id in self.video_views]
+
+
+class OverlappingYoutubeAPI(FakeYoutubeAPI):
+    """
+    Fake API whose playlist requests only complete once at least two of them are in flight at the same time.
+    """
+
+    def __init__(self, playlist_items, tracker: dict):
+        super().__init__(playlist_items)
+        self.tracker = tracker
+
+    def playlist_items(self, playlist_id, **kwargs):
+        with self.tracker['lock']:
+            self.tracker['in_flight'] += 1
+            self.tracker['max_in_flight'] = max(self.tracker['max_in_flight'], self.tracker['in_flight'])
+            if self.tracker['in_flight'] >= 2:
+                self.tracker['overlap'].set()
+        try:
+            self.tracker['overlap'].wait(5)
+            yield from super().playlist_items(playlist_id, **kwargs)
+        finally:
+            with self.tracker['lock']:
+                self.tracker['in_flight'] -= 1
+
+
+class SynchronizeJobTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', password='test')
+        self.sub = Subscription.objects.create(name='Test channel', playlist_id='UU_test', description='',
+                                               channel_id='UC_test', channel_name='Test channel', thumbnail='',
+                                               user=self.user, rewrite_playlist_indices=True)
+
+    def build_job(self, api: FakeYoutubeAPI, deep: bool = False):
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=api):
+            return SynchronizeJob(JobExecution.objects.create(), self.sub, deep)
+
+    def test_check_new_videos_query_count(self):
+        # The number of queries should not depend on the number of videos in the playlist
+        for count in (1, 40):
+            Video.objects.all().delete()
+            job = self.build_job(FakeYoutubeAPI(make_uploads(count)))
+            with self.assertNumQueries(4):
+                job.check_new_videos(self.sub)
+            self.assertEqual(Video.objects.filter(subscription=self.sub).count(), count)
+
+    def test_check_new_videos_assigns_indices(self):
+        self.build_job(FakeYoutubeAPI(make_uploads(10))).check_new_videos(self.sub)
+        self.build_job(FakeYoutubeAPI(make_uploads(15))).check_new_videos(self.sub)
+
+        videos = Video.objects.filter(subscription=self.sub).order_by('publish_date')
+        self.assertEqual([v.playlist_index for v in videos], list(range(15)))
+
+    def test_incremental_sync_stops_at_known_videos(self):
+        self.build_job(FakeYoutubeAPI(make_uploads(100))).check_new_videos(self.sub)
+
+        api = FakeYoutubeAPI(make_uploads(105))
+        self.build_job(api).check_new_videos(self.sub)
+        self.assertEqual(Video.objects.filter(subscription=self.sub).count(), 105)
+        self.assertLess(api.consumed_items, 105)
+
+        api = FakeYoutubeAPI(make_uploads(105))
+        self.build_job(api, deep=True).check_new_videos(self.sub)
+        self.assertEqual(api.consumed_items, 105)
+
+    def test_check_all_new_videos_in_parallel(self):
+        subs = [self.sub]
+        for i in range(5):
+            subs.append(Subscription.objects.create(name=f'Channel {i}', playlist_id=f'UU_{i}', description='',
+                                                    channel_id=f'UC_{i}', channel_name=f'Channel {i}', thumbnail='',
+                                                    user=self.user, rewrite_playlist_indices=True))
+
+        tracker = {'lock': threading.Lock(), 'overlap': threading.Event(), 'in_flight': 0, 'max_in_flight': 0}
+        job = self.build_job(OverlappingYoutubeAPI(make_uploads(20), tracker))
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public',
+                               side_effect=lambda: OverlappingYoutubeAPI(make_uploads(20), tracker)):
+            job.check_all_new_videos(subs)
+
+        # The playlists were fetched concurrently, not one after the other
+        self.assertTrue(tracker['overlap'].is_set())
+        self.assertGreaterEqual(tracker['max_in_flight'], 2)
+        for sub in subs:
+            self.assertEqual(Video.objects.filter(subscription=sub).count(), 20)
+
+    def test_update_video_batch_single_query(self):
+        self.build_job(FakeYoutubeAPI(make_uploads(50))).check_new_videos(self.sub)
+        videos = list(Video.objects.filter(subscription=self.sub).order_by('id'))
+        Video.objects.update(thumbnail='/media/thumbs/video/test.jpg')
+        for video in videos:
+            video.thumbnail = '/media/thumbs/video/test.jpg'
+
+        # Only half of the videos have changed view counts
+        views = {video.video_id: (100 if i % 2 == 0 else 0) for i, video in enumerate(videos)}
+        job = self.build_job(FakeYoutubeAPI([], views))
+        with CaptureQueriesContext(connection) as queries:
+            job.update_video_batch(videos)
+
+        video_queries = [q for q in queries.captured_queries if 'YtManagerApp_video' in q['sql']]
+        self.assertEqual(len(video_queries), 1)
+
+        self.assertEqual(Video.objects.filter(views=100).count(), 25)
+        self.assertEqual(Video.objects.filter(duration=600, rating=0.9).count(), 50)
+
+
+class VideoStatsRefreshTests(TestCase):
+
+    def test_refresh_filter_matches_refresh_policy(self):
+        user = User.objects.create_user('test', password='test')
+        sub = Subscription.objects.create(name='Test channel', playlist_id='UU_test', description='',
+                                          channel_id='UC_test', channel_name='Test channel', thumbnail='', user=user)
+
+        now = datetime.datetime(2020, 6, 1, tzinfo=pytz.UTC)
+        ages = [datetime.timedelta(hours=5), datetime.timedelta(days=10), datetime.timedelta(days=400)]
+        last_updates = [None, datetime.timedelta(minutes=30), datetime.timedelta(hours=2),
+                        datetime.timedelta(days=2), datetime.timedelta(days=8)]
+
+        for i, age in enumerate(ages):
+            for j, last_update in enumerate(last_updates):
+                Video.objects.create(video_id=f'v{i}{j}', name='Video', description='', subscription=sub,
+                                     playlist_index=0, publish_date=now - age, thumbnail='', uploader_name='',
+                                     stats_updated_at=None if last_update is None else now - last_update)
+
+        due = set(Video.objects.filter(Video.stats_refresh_due_filter(now)).values_list('video_id', flat=True))
+        expected = {v.video_id for v in Video.objects.all() if v.is_stats_refresh_due(now)}
+
+        self.assertEqual(due, expected)
+        self.assertEqual(due, {'v00', 'v02', 'v03', 'v04', 'v10', 'v13', 'v14', 'v20', 'v24'})
+
+
+class FeedPrecheckTests(TestCase):
+
+    def setUp(self):
+        self.data = FakeYoutubeData()
+        self.channel = self.data.add_channel()
+        self.server = FakeYoutubeServer(self.data)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        settings_override = override_settings(YOUTUBE_FEED_URL=self.server.feed_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user('test', password='test')
+        self.sub = Subscription.objects.create(name='Test channel', playlist_id=self.channel.uploads_playlist_id,
+                                               description='', channel_id=self.channel.id,
+                                               channel_name='Test channel', thumbnail='', user=self.user,
+                                               rewrite_playlist_indices=True)
+
+    def set_uploads(self, count):
+        """
+        Uploads videos to the fake channel until it has 'count' videos, and returns its playlist items.
+        """
+        if count > len(self.channel.videos):
+            self.data.add_videos(self.channel, count - len(self.channel.videos))
+        return [make_playlist_item(video.id, position, video.published_at)
+                for position, video in enumerate(self.channel.videos)]
+
+    def synchronize(self, uploads):
+        api = FakeYoutubeAPI(uploads)
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public', side_effect=lambda: FakeYoutubeAPI(uploads)):
+            job = SynchronizeJob(JobExecution.objects.create(), self.sub)
+            job._SynchronizeJob__api = api
+            job.check_all_new_videos([self.sub])
+        return api
+
+    def test_fetch_feed_conditional_get(self):
+        self.set_uploads(20)
+        url = feeds.build_feed_url(channel_id=self.channel.id)
+
+        result = feeds.fetch_feed(url)
+        self.assertFalse(result.not_modified)
+        self.assertEqual(result.video_ids, [video.id for video in self.channel.videos[:15]])
+
+        result = feeds.fetch_feed(url, result.etag, result.last_modified)
+        self.assertTrue(result.not_modified)
+
+    def test_unchanged_feed_skips_api(self):
+        self.synchronize(self.set_uploads(20))
+        self.assertEqual(Video.objects.count(), 20)
+
+        # Feed not modified
+        api = self.synchronize(self.set_uploads(20))
+        self.assertEqual(api.consumed_items, 0)
+
+        # Feed modified, but without any new videos
+        self.sub.feed_etag = None
+        api = self.synchronize(self.set_uploads(20))
+        self.assertEqual(api.consumed_items, 0)
+
+        # New video in the feed
+        api = self.synchronize(self.set_uploads(21))
+        self.assertGreater(api.consumed_items, 0)
+        self.assertEqual(Video.objects.count(), 21)
+
+
+class QuotaTests(TestCase):
+
+    def test_ledger_daily_rollover(self):
+        ledger = QuotaLedger()
+        day1 = datetime.datetime(2019, 8, 20, 6, 59, tzinfo=pytz.UTC)  # 23:59 in California
+        day2 = datetime.datetime(2019, 8, 20, 7, 1, tzinfo=pytz.UTC)
+
+        with mock.patch('django.utils.timezone.now', return_value=day1):
+            threads = [threading.Thread(target=ledger.record, args=('videos', 1)) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            ledger.record('search', 100)
+            ledger.flush()
+            ledger.record('videos', 1)
+            self.assertEqual(ledger.used(), 111)
+
+        with mock.patch('django.utils.timezone.now', return_value=day2):
+            ledger.record('playlist_items', 1)
+            self.assertEqual(ledger.used(), 1)
+
+        usage = QuotaUsage.objects.get(date=quota_date(day1), endpoint='videos')
+        self.assertEqual((usage.calls, usage.units), (11, 11))
+
+    def test_ledger_flush_from_several_processes(self):
+        ledger = QuotaLedger()
+        ledger.record('videos', 1)
+
+        # Another process creates the row after this one found it missing
+        QuotaUsage.objects.create(date=quota_date(), endpoint='videos', units=5, calls=5)
+        query = QuotaUsage.objects.filter
+        missing = [QuotaUsage.objects.none()]
+        with mock.patch.object(QuotaUsage.objects, 'filter',
+                               side_effect=lambda **kwargs: missing.pop() if missing else query(**kwargs)):
+            ledger.flush()
+
+        usage = QuotaUsage.objects.get()
+        self.assertEqual((usage.calls, usage.units), (6, 6))
+
+        # Records which could not be written are kept for the next flush
+        ledger.record('videos', 1)
+        with mock.patch.object(QuotaUsage.objects, 'filter', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            ledger.flush()
+        ledger.flush()
+        usage.refresh_from_db()
+        self.assertEqual((usage.calls, usage.units), (7, 7))
+
+    def test_plan_subscriptions_within_budget(self):
+        user = User.objects.create_user('test', password='test')
+        now = datetime.datetime.now(tz=pytz.UTC)
+        subs = []
+        for i in range(5):
+            subs.append(Subscription.objects.create(name=f'Channel {i}', playlist_id=f'UU_{i}', description='',
+                                                    channel_id=f'UC_{i}', channel_name=f'Channel {i}', thumbnail='',
+                                                    user=user, rewrite_playlist_indices=True,
+                                                    last_synchronised=now - datetime.timedelta(hours=i)))
+
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=FakeYoutubeAPI([])):
+            job = SynchronizeJob(JobExecution.objects.create())
+
+        # Incremental synchronizations cost one unit each; the stalest subscriptions go first
+        planned, skipped = job.plan_subscriptions(subs, 3)
+        self.assertEqual(planned, [subs[4], subs[3], subs[2]])
+        self.assertEqual(skipped, [subs[1], subs[0]])
+
+        planned, skipped = job.plan_subscriptions(subs, None)
+        self.assertEqual(len(planned), 5)
+
+    def test_daily_quota_setting(self):
+        appconfig.youtube_api_daily_quota = 100
+        QuotaUsage.objects.create(date=quota_date(), endpoint='search', units=100, calls=1)
+        self.assertEqual(QuotaLedger().remaining(), 0)
+
+        appconfig.youtube_api_daily_quota = 0
+        self.assertIsNone(QuotaLedger().remaining())
+
+
+class AdaptiveSyncTests(TestCase):
+
+    def test_sync_interval(self):
+        now = datetime.datetime(2019, 8, 20, tzinfo=pytz.UTC)
+        daily = [now - datetime.timedelta(days=i) for i in range(10)]
+        quiet = [date - datetime.timedelta(days=10) for date in daily]
+        yearly = [now - datetime.timedelta(days=30 + 365 * i) for i in range(5)]
+
+        self.assertEqual(Subscription.get_sync_interval(daily, now), datetime.timedelta(hours=6))
+        self.assertEqual(Subscription.get_sync_interval(quiet, now), datetime.timedelta(days=2.5))
+        self.assertEqual(Subscription.get_sync_interval(yearly, now), datetime.timedelta(days=7))
+        self.assertEqual(Subscription.get_sync_interval([], now), datetime.timedelta(hours=1))
+
+    def test_only_due_subscriptions_are_synchronized(self):
+        user = User.objects.create_user('test', password='test')
+        now = datetime.datetime.now(tz=pytz.UTC)
+        due = Subscription.objects.create(name='Due', playlist_id='UU_due', description='', channel_id='UC_due',
+                                          channel_name='Due', thumbnail='', user=user, rewrite_playlist_indices=True,
+                                          next_synchronisation=now - datetime.timedelta(minutes=1))
+        Subscription.objects.create(name='Not due', playlist_id='UU_later', description='', channel_id='UC_later',
+                                    channel_name='Not due', thumbnail='', user=user, rewrite_playlist_indices=True,
+                                    next_synchronisation=now + datetime.timedelta(hours=1))
+
+        def build_job(*args):
+            with mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=FakeYoutubeAPI(make_uploads(10))):
+                return SynchronizeJob(JobExecution.objects.create(), *args)
+
+        job = build_job(None, False, True)
+        self.assertEqual(list(job.get_due_subscriptions(job.get_subscription_list())), [due])
+
+        job = build_job(None, True, True)
+        self.assertEqual(len(job.get_due_subscriptions(job.get_subscription_list())), 2)
+
+        # The uploads are years old, so the subscription is checked as rarely as possible
+        build_job(due).check_new_videos(due)
+        due.refresh_from_db()
+        self.assertAlmostEqual(due.next_synchronisation - due.last_synchronised, datetime.timedelta(days=7),
+                               delta=datetime.timedelta(seconds=1))
+
+    def test_consecutive_scheduled_synchronizations(self):
+        user = User.objects.create_user('test', password='test')
+        sub = Subscription.objects.create(name='Test playlist', playlist_id='PL_test', description='',
+                                          channel_id='UC_test', channel_name='Test channel', thumbnail='', user=user)
+        clock = [datetime.datetime(2019, 8, 20, 10, 5, tzinfo=pytz.UTC)]
+
+        class SlowYoutubeAPI(FakeYoutubeAPI):
+            def playlist_items(self, playlist_id, **kwargs):
+                # Fetching the playlist takes a while
+                clock[0] += datetime.timedelta(minutes=10)
+                return super().playlist_items(playlist_id, **kwargs)
+
+        # A subscription without uploads is synchronized every hour, so it is due at every hourly tick
+        api = SlowYoutubeAPI([])
+        with mock.patch('django.utils.timezone.now', side_effect=lambda: clock[0]), \
+                mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=api):
+            for tick in range(2):
+                clock[0] = datetime.datetime(2019, 8, 20, 10 + tick, 5, tzinfo=pytz.UTC)
+                SynchronizeJob(JobExecution.objects.create(), None, False, True).run()
+                sub.refresh_from_db()
+                self.assertEqual(sub.last_synchronised, clock[0])
+
+        self.assertEqual(sub.next_synchronisation, datetime.datetime(2019, 8, 20, 12, 5, tzinfo=pytz.UTC))
+
+
+class FakeYoutubeServerTests(TestCase):
+
+    def setUp(self):
+        self.data = FakeYoutubeData.generate(channels=2, videos_per_channel=60)
+        self.server = FakeYoutubeServer(self.data)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+
+        # The API response cache is stored in the data folder
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+
+        settings_override = override_settings(YOUTUBE_API_ENDPOINT=self.server.api_endpoint,
+                                              YOUTUBE_FEED_URL=self.server.feed_url,
+                                              MEDIA_ROOT=media_root.name,
+                                              DATA_DIR=data_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user('test', password='test')
+        user.preferences['auto_download'] = False
+        for channel in self.data.channels.values():
+            Subscription.objects.create(name=channel.title, playlist_id=channel.uploads_playlist_id, description='',
+                                        channel_id=channel.id, channel_name=channel.title, thumbnail='', user=user,
+                                        rewrite_playlist_indices=True)
+
+    def test_full_and_incremental_sync(self):
+        SynchronizeJob(JobExecution.objects.create(), None, True).run()
+
+        self.assertEqual(Video.objects.count(), 120)
+        video = Video.objects.get(video_id='fake0000001')
+        self.assertEqual(video.views, self.data.videos['fake0000001'].views)
+        calls = self.server.reset_counts()
+        self.assertEqual(calls['playlistItems'], 4)
+
+        # Only the playlist pages are cached; the video statistics change on every call
+        self.assertGreater(calls['videos'], 0)
+        self.assertEqual(youtube.get_response_cache().stats()['entries'], calls['playlistItems'])
+
+        # Video thumbnails are only fetched when they are shown
+        self.assertEqual(calls['thumbnails'], 0)
+
+        channel = next(iter(self.data.channels.values()))
+        self.data.add_videos(channel, 1)
+        SynchronizeJob(JobExecution.objects.create()).run()
+
+        self.assertEqual(Video.objects.count(), 121)
+        calls = self.server.reset_counts()
+        self.assertEqual(calls['feeds'], 2)
+        self.assertEqual(calls['playlistItems'], 1)
+
+    def test_new_videos_after_existing_ones(self):
+        channel = next(iter(self.data.channels.values()))
+        newest = channel.videos[0].published_at
+
+        # Far more videos than fit in a day at the default upload interval
+        new_videos = self.data.add_videos(channel, 200, now=newest + datetime.timedelta(days=1))
+        self.assertTrue(all(video.published_at > newest for video in new_videos))
+        dates = [video.published_at for video in channel.videos]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_lazy_thumbnails(self):
+        SynchronizeJob(JobExecution.objects.create(), None, True).run()
+        videos = list(Video.objects.order_by('id')[:3])
+
+        # Users only get the thumbnails of their own videos
+        self.server.reset_counts()
+        self.client.force_login(User.objects.create_user('other', password='test'))
+        response = self.client.get(reverse('video-thumbnail', args=[videos[0].id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.server.reset_counts()['thumbnails'], 0)
+
+        self.client.force_login(User.objects.get(username='test'))
+
+        for video in videos:
+            response = self.client.get(reverse('video-thumbnail', args=[video.id]))
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response['Location'].startswith(settings.MEDIA_URL))
+
+        # The stand-in server returns the same image for every video, so it is stored once, in every size
+        thumbnail_urls = set(Video.objects.filter(id__in=[video.id for video in videos])
+                             .values_list('thumbnail', flat=True))
+        self.assertEqual(len(thumbnail_urls), 1)
+        thumbnail_files = [file for _, _, files in os.walk(self.media_root) for file in files]
+        self.assertEqual(len(thumbnail_files), len(settings.THUMBNAIL_SCALES))
+        self.assertEqual(len(thumbnail_srcset(thumbnail_urls.pop(), settings.THUMBNAIL_SCALES).split(', ')),
+                         len(settings.THUMBNAIL_SCALES))
+
+        # Concurrent requests for the same thumbnail share a single fetch
+        def slow_fetch(*args):
+            time.sleep(0.2)
+            return fetch_thumbnail(*args)
+
+        url = Video.objects.filter(thumbnail__startswith='http').first().thumbnail
+        self.server.reset_counts()
+        with mock.patch.object(downloader, 'fetch_thumbnail', side_effect=slow_fetch) as fetch:
+            threads = [threading.Thread(target=downloader.fetch_thumbnail_once, args=(url, 'video', 'x', (16, 9)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(self.server.reset_counts()['thumbnails'], 1)
+
+
+class DirectorySnapshotTests(TestCase):
+
+    def setUp(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        self.directory = download_dir.name
+
+        self.videos = []
+        for i in range(20):
+            for extension in ('.mp4', '.jpg', '.en.vtt'):
+                open(os.path.join(self.directory, f'S01E{i:02d}{extension}'), 'w').close()
+            downloaded_path = os.path.join(self.directory, f'S01E{i:02d}')
+            self.videos.append(Video(video_id=f'vid{i:05d}', downloaded_path=downloaded_path))
+
+    def test_get_files_lists_directory_once(self):
+        with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+            files = [sorted(video.get_files()) for video in self.videos]
+        self.assertEqual(listdir.call_count, len(self.videos))
+
+        snapshot = DirectorySnapshot()
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            self.assertEqual([sorted(video.get_files(snapshot)) for video in self.videos], files)
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(snapshot.listing_count, 1)
+        self.assertEqual(len(files[3]), 3)
+
+    def test_missing_directory(self):
+        snapshot = DirectorySnapshot()
+        missing = os.path.join(self.directory, 'missing')
+        for _ in range(2):
+            with self.assertRaises(FileNotFoundError):
+                list(snapshot.find_prefixed(missing, 'S01E01'))
+        self.assertEqual(snapshot.listing_count, 1)
+
+
+class VideoFileCatalogTests(TestCase):
+
+    def setUp(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        self.directory = download_dir.name
+
+        for extension, content in (('.mp4', b'video'), ('.jpg', b'img'), ('.en.vtt', b'subs')):
+            with open(os.path.join(self.directory, 'S01E01' + extension), 'wb') as f:
+                f.write(content)
+
+        user = User.objects.create_user('test', password='test')
+        self.sub = Subscription.objects.create(name='Test channel', playlist_id='UU_test', description='',
+                                               channel_id='UC_test', channel_name='Test channel', thumbnail='',
+                                               user=user, rewrite_playlist_indices=True)
+        self.build_job(FakeYoutubeAPI(make_uploads(1))).check_new_videos(self.sub)
+        self.video = Video.objects.get()
+        self.video.downloaded_path = os.path.join(self.directory, 'S01E01')
+        self.video.thumbnail = ''
+        self.video.save()
+
+    def build_job(self, api: FakeYoutubeAPI, deep: bool = False):
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=api):
+            return SynchronizeJob(JobExecution.objects.create(), self.sub, deep)
+
+    def test_catalog(self):
+        self.video.catalog_files()
+        roles = {file.role: file.size for file in VideoFile.objects.filter(video=self.video)}
+        self.assertEqual(roles, {'video': 5, 'thumbnail': 3, 'subtitle': 4})
+        self.assertEqual(self.video.find_video(), (os.path.join(self.directory, 'S01E01.mp4'), 'video/mp4'))
+        self.assertEqual(self.sub.get_downloaded_size(), 12)
+
+    def test_sync_uses_catalog(self):
+        # Videos downloaded before the catalog existed are cataloged by the synchronization
+        self.build_job(FakeYoutubeAPI([])).update_video_batch([self.video], refresh_stats=False)
+        self.assertEqual(VideoFile.objects.filter(video=self.video).count(), 3)
+
+        # Afterwards, the directory is not listed any more
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            self.build_job(FakeYoutubeAPI([])).update_video_batch([self.video], refresh_stats=False)
+        self.assertEqual(scandir.call_count, 0)
+
+        # Deep synchronizations repair the catalog
+        open(os.path.join(self.directory, 'S01E01.de.vtt'), 'w').close()
+        self.build_job(FakeYoutubeAPI([]), deep=True).update_video_batch([self.video], refresh_stats=False)
+        self.assertEqual(VideoFile.objects.filter(video=self.video).count(), 4)
+
+        # Deleted video files are detected, and the remaining files cleaned up
+        os.unlink(os.path.join(self.directory, 'S01E01.mp4'))
+        self.build_job(FakeYoutubeAPI([])).update_video_batch([self.video], refresh_stats=False)
+        self.video.refresh_from_db()
+        self.assertIsNone(self.video.downloaded_path)
+        self.assertEqual(VideoFile.objects.count(), 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @unittest.skipIf(watcher.Observer is None, 'watchdog is not installed')
+    def test_watcher(self):
+        from watchdog.events import FileDeletedEvent, FileMovedEvent
+
+        self.video.catalog_files()
+        download_watcher = watcher.DownloadWatcher()
+
+        # Files unknown to the catalog are ignored
+        download_watcher.dispatch(FileMovedEvent(os.path.join(self.directory, 'S01E02.mp4.part'),
+                                                 os.path.join(self.directory, 'S01E02.mp4')))
+        download_watcher.flush()
+        self.video.refresh_from_db()
+        self.assertIsNotNone(self.video.downloaded_path)
+
+        os.unlink(os.path.join(self.directory, 'S01E01.mp4'))
+        download_watcher.dispatch(FileDeletedEvent(os.path.join(self.directory, 'S01E01.mp4')))
+        download_watcher.flush()
+        self.video.refresh_from_db()
+        self.assertIsNone(self.video.downloaded_path)
+        self.assertTrue(self.video.watched)
+        self.assertEqual(VideoFile.objects.count(), 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class DownloadVideoJobTests(TestCase):
+
+    def test_make_output_directory_concurrently(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        output_path = os.path.join(download_dir.name, 'Channel', 'Playlist', 'S01E001 - Title [id]')
+
+        errors = []
+
+        def make():
+            try:
+                make_output_directory(output_path)
+            except OSError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=make) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(os.path.isdir(os.path.dirname(output_path)))
+
+    def test_download_pool(self):
+        pool = DownloadPool()
+        self.addCleanup(pool.shutdown)
+
+        # youtube-dl refuses file:// URLs, so this fails right away, without going on the network
+        with self.assertLogs('test_download_pool', level='WARNING') as logs:
+            result = pool.estimate_size('file:///video.mp4', {}, logging.getLogger('test_download_pool'))
+        self.assertIsNone(result['size'])
+        self.assertIn('file:// scheme', result['error'])
+        self.assertTrue(any('file:// scheme' in line for line in logs.output))
+
+    @override_settings(DOWNLOAD_PROCESS_MAX_TASKS=1)
+    def test_download_pool_replaced_by_hand(self):
+        pool = DownloadPool()
+        self.addCleanup(pool.shutdown)
+        logger = logging.getLogger('test_download_pool')
+
+        executors = []
+
+        def make_executor(*args, **kwargs):
+            executor = mock.Mock()
+            executor.submit.return_value.result.return_value = {'size': 1, 'error': None}
+            executors.append((executor, kwargs))
+            return executor
+
+        with mock.patch('YtManagerApp.management.download_pool.ProcessPoolExecutor', side_effect=make_executor), \
+                mock.patch('YtManagerApp.management.download_pool.POOL_REPLACES_WORKERS', False), \
+                mock.patch('YtManagerApp.management.download_pool.TASK_MESSAGES_TIMEOUT', 0), \
+                mock.patch('YtManagerApp.management.download_pool.appconfig', mock.Mock(download_concurrency=1)):
+            for _ in range(3):
+                self.assertEqual(pool.estimate_size('http://video', {}, logger)['size'], 1)
+
+            # Two workers, one task each; the third task goes to a new executor
+            self.assertEqual(len(executors), 2)
+            self.assertNotIn('max_tasks_per_child', executors[0][1])
+            executors[0][0].shutdown.assert_called_once_with(wait=False)
+            executors[1][0].shutdown.assert_not_called()
+
+            # An executor shut down between getting it and submitting the task is handled like a broken pool
+            executors[1][0].submit.side_effect = RuntimeError('cannot schedule new futures after shutdown')
+            with self.assertLogs('download_pool', level='ERROR'):
+                result = pool.download('http://video', {}, logger)
+            self.assertEqual(result['code'], -1)
+            self.assertEqual(len(executors), 2)
+
+
+class DownloadQueueTests(TestCase):
+
+    def setUp(self):
+        self.videos = {}
+        for username in ('alice', 'bob'):
+            user = User.objects.create_user(username, password='test')
+            sub = Subscription.objects.create(name=username, playlist_id='UU_' + username, description='',
+                                              channel_id='UC_' + username, channel_name=username, thumbnail='',
+                                              user=user)
+            self.videos[username] = [
+                Video.objects.create(video_id=f'{username}{i}', name=f'{username} {i}', description='', watched=False,
+                                     new=True, uploader_name='', thumbnail='', publish_date=timezone.now(),
+                                     playlist_index=i, subscription=sub)
+                for i in range(3)]
+
+    def test_priority_and_fairness(self):
+        queue = DownloadQueue()
+        alice, bob = self.videos['alice'], self.videos['bob']
+        for video in alice + bob[:1]:
+            queue.enqueue(DownloadVideoJob, video)
+        # Requested by the user; goes first, and isn't downloaded twice
+        queue.enqueue(DownloadVideoJob, alice[2], priority=DOWNLOAD_PRIORITY_INTERACTIVE)
+
+        order = []
+        entry = queue.pop()
+        while entry is not None:
+            order.append(entry.video)
+            entry = queue.pop()
+
+        self.assertEqual(order, [alice[2], alice[0], bob[0], alice[1]])
+
+    def test_retry_promotion(self):
+        queue = DownloadQueue()
+        video = self.videos['alice'][0]
+        clock = [timezone.now()]
+        Video.objects.filter(id=video.id).update(download_state=VIDEO_DOWNLOAD_STATE_RETRY, download_attempts=1,
+                                                 download_retry_at=clock[0] + datetime.timedelta(minutes=5))
+        video.refresh_from_db()
+
+        with mock.patch('django.utils.timezone.now', side_effect=lambda: clock[0]), \
+                mock.patch('YtManagerApp.management.jobs.download_video.download_queue', queue):
+            DownloadVideoJob.schedule(video, 2)
+
+            # Waiting to retry, in the database as well as in the queue
+            self.assertIsNone(queue.pop())
+            self.assertEqual(queue.stats()['delayed'], 1)
+            self.assertEqual(Video.objects.get(id=video.id).download_state, VIDEO_DOWNLOAD_STATE_RETRY)
+
+            # Marked as queued once due, so a worker can claim it
+            clock[0] += datetime.timedelta(minutes=6)
+            entry = queue.pop()
+            self.assertEqual((entry.video, entry.attempt), (video, 2))
+            self.assertEqual(queue.stats()['delayed'], 0)
+            self.assertEqual(Video.objects.get(id=video.id).download_state, VIDEO_DOWNLOAD_STATE_QUEUED)
+            self.assertTrue(entry.video.claim_download_running())
+
+    def test_rate_limit_shared_by_active_downloads(self):
+        queue = DownloadQueue()
+        active = queue._DownloadQueue__active
+        config = mock.Mock(download_rate_limit=100, download_concurrency=4)
+        with mock.patch('YtManagerApp.management.download_queue.appconfig', config):
+            # A download running alone gets the whole limit, whatever the concurrency
+            active[1] = None
+            self.assertEqual(queue.get_rate_limit(), 100 * 1024)
+            active[2] = None
+            self.assertEqual(queue.get_rate_limit(), 50 * 1024)
+
+            config.download_rate_limit = 0
+            self.assertIsNone(queue.get_rate_limit())
+
+    def test_no_duplicate_enqueues(self):
+        alice = self.videos['alice']
+        with mock.patch.object(download_queue, 'enqueue') as enqueue:
+            downloader_process_subscription(alice[0].subscription)
+            downloader_process_subscription(alice[0].subscription)
+            alice[0].mark_watched()
+        self.assertEqual(enqueue.call_count, 3)
+
+        # Only one worker gets to download a video
+        video = Video.objects.get(id=alice[0].id)
+        self.assertEqual(video.download_state, VIDEO_DOWNLOAD_STATE_QUEUED)
+        self.assertTrue(video.claim_download_running())
+        self.assertFalse(Video.objects.get(id=video.id).claim_download_running())
+        self.assertEqual(video.download_attempts, 1)
+
+    @override_settings(DOWNLOAD_RETRY_DELAY=60, DOWNLOAD_RETRY_MAX_DELAY=3600)
+    def test_retries(self):
+        self.assertTrue(is_permanent_download_error('ERROR: Video unavailable'))
+        self.assertTrue(is_permanent_download_error('ERROR: Private video. Sign in if you\'ve been granted access'))
+        self.assertFalse(is_permanent_download_error('ERROR: Unable to download webpage: timed out'))
+        self.assertFalse(is_permanent_download_error('youtube-dl finished with code 1'))
+
+        for attempt, max_delay in ((1, 60), (2, 120), (3, 240), (10, 3600)):
+            delay = get_retry_delay(attempt)
+            self.assertGreaterEqual(delay, max_delay / 2)
+            self.assertLessEqual(delay, max_delay)
+
+        # Retries don't start (nor take a worker) before they are due
+        queue = DownloadQueue()
+        alice = self.videos['alice']
+        queue.enqueue(DownloadVideoJob, alice[0], 2, not_before=timezone.now() + datetime.timedelta(seconds=60))
+        queue.enqueue(DownloadVideoJob, alice[1], 2, not_before=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(queue.pop().video, alice[1])
+        self.assertIsNone(queue.pop())
+        self.assertEqual(queue.stats()['delayed'], 1)
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(seconds=61)):
+            self.assertEqual(queue.pop().video, alice[0])
+
+    def test_permanent_failure(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        video = self.videos['alice'][0]
+        user = video.subscription.user
+        user.preferences['download_path'] = download_dir.name
+        video.claim_download_queued(first_attempt=True)
+
+        with mock.patch.object(download_pool, 'download', return_value={'code': -1, 'error': 'ERROR: Video unavailable'}):
+            scheduler.run_job(DownloadVideoJob, user, [video])
+
+        # The next synchronization neither takes it for a deleted download, nor downloads it again
+        with mock.patch.object(youtube.YoutubeAPI, 'build_public', return_value=FakeYoutubeAPI([])), \
+                mock.patch.object(download_queue, 'enqueue') as enqueue:
+            SynchronizeJob(JobExecution.objects.create(), video.subscription).run()
+
+        self.assertEqual(enqueue.call_count, 2)
+        self.assertNotIn(video, [call[0][1] for call in enqueue.call_args_list])
+        video.refresh_from_db()
+        self.assertEqual(video.download_state, VIDEO_DOWNLOAD_STATE_FAILED)
+        self.assertEqual(video.download_attempts, 1)
+        self.assertIsNone(video.downloaded_path)
+
+    def test_size_limit(self):
+        self.assertEqual(get_info_size({'requested_formats': [{'filesize': 100}, {'filesize_approx': 20.5}]}), 120)
+        self.assertIsNone(get_info_size({'requested_formats': [{'filesize': 100}, {}]}))
+
+        alice = self.videos['alice']
+        user = alice[0].subscription.user
+        user.preferences['download_subscription_limit'] = -1
+        user.preferences['download_global_size_limit'] = 10
+        Video.objects.filter(id__in=[video.id for video in alice]).update(download_size_estimate=5 * 1024 * 1024)
+        VideoFile.objects.create(video=self.videos['bob'][0], path='/bob.mp4', size=8 * 1024 * 1024,
+                                 mtime=timezone.now())
+        VideoFile.objects.create(video=alice[2], path='/alice.mp4', size=1024 * 1024, mtime=timezone.now())
+        Video.objects.filter(id=alice[2].id).update(downloaded_path='/alice')
+
+        # 9 MB are left (the files of other users don't count), so only one 5 MB video fits
+        with mock.patch.object(download_queue, 'enqueue') as enqueue:
+            downloader_process_subscription(alice[0].subscription)
+            self.assertEqual(enqueue.call_count, 1)
+            downloader_process_subscription(alice[0].subscription)
+            self.assertEqual(enqueue.call_count, 1)
+
+            # Deleting files makes room
+            VideoFile.objects.filter(video=alice[2]).delete()
+            downloader_process_subscription(alice[0].subscription)
+            self.assertEqual(enqueue.call_count, 2)
+
+        # Hard links of the same file (e.g. a reused copy of a video) only count once
+        bob = self.videos['bob']
+        for video in bob[1:]:
+            VideoFile.objects.create(video=video, path=f'/{video.video_id}.mp4', size=1024 * 1024,
+                                     mtime=timezone.now(), inode='1:100')
+        self.assertEqual(VideoFile.get_user_downloaded_size(bob[0].subscription.user), 9 * 1024 * 1024)
+
+        # The synchronization doesn't wait for youtube-dl: videos of unknown size are enqueued (only a few per
+        # synchronization), and their download job asks for the size
+        bob_user = bob[0].subscription.user
+        bob_user.preferences['download_global_size_limit'] = 100
+        with override_settings(DOWNLOAD_SIZE_ESTIMATES_PER_SYNC=1), \
+                mock.patch.object(download_pool, 'estimate_size',
+                                  return_value={'size': 200 * 1024 * 1024, 'error': None}) as estimate_size, \
+                mock.patch.object(download_pool, 'download') as download, \
+                mock.patch.object(download_queue, 'enqueue') as enqueue:
+            downloader_process_subscription(bob[0].subscription)
+            self.assertEqual((estimate_size.call_count, enqueue.call_count), (0, 1))
+
+            # Too large; left for a later synchronization, which knows its size
+            video = enqueue.call_args[0][1]
+            scheduler.run_job(DownloadVideoJob, bob_user, [video])
+            video.refresh_from_db()
+            self.assertEqual(estimate_size.call_count, 1)
+            download.assert_not_called()
+            self.assertEqual(video.download_state, VIDEO_DOWNLOAD_STATE_NONE)
+            self.assertEqual(video.download_size_estimate, 200 * 1024 * 1024)
+
+            downloader_process_subscription(bob[0].subscription)
+            self.assertEqual((estimate_size.call_count, enqueue.call_count), (1, 1))
+
+    @override_settings(DOWNLOAD_PROGRESS_INTERVAL=60)
+    def test_download_progress(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        video = self.videos['alice'][0]
+        video.subscription.user.preferences['download_path'] = download_dir.name
+        video.claim_download_queued(first_attempt=True)
+
+        def download(url, params, logger, on_progress):
+            for downloaded in range(0, 1000, 100):
+                on_progress({'status': 'downloading', 'filename': 'video.mp4', 'downloaded_bytes': downloaded,
+                             'total_bytes': 1000, 'total_bytes_estimate': None, 'speed': 500, 'eta': 1,
+                             'elapsed': None})
+            on_progress({'status': 'finished', 'filename': 'video.mp4', 'downloaded_bytes': 1000,
+                         'total_bytes': 1000, 'total_bytes_estimate': None, 'speed': None, 'eta': None,
+                         'elapsed': 2.0})
+            on_progress({'status': 'finished', 'filename': 'audio.m4a', 'downloaded_bytes': 200, 'total_bytes': 200,
+                         'total_bytes_estimate': None, 'speed': None, 'eta': None, 'elapsed': 0.5})
+            return {'code': 0, 'error': None}
+
+        with mock.patch.object(download_pool, 'download', side_effect=download):
+            scheduler.run_job(DownloadVideoJob, video.subscription.user, [video])
+
+        # Progress is written at most once per interval
+        job = JobExecution.objects.get()
+        self.assertEqual(JobMessage.objects.filter(job=job, progress__isnull=False).count(), 1)
+        self.assertEqual(job.downloaded_bytes, 1200)
+        self.assertAlmostEqual(job.throughput, 480)
+        self.assertEqual(Video.objects.get(id=video.id).download_state, VIDEO_DOWNLOAD_STATE_DONE)
+
+    def test_reuse_downloaded_copy(self):
+        download_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(download_dir.cleanup)
+        alice, bob = self.videos['alice'][0], self.videos['bob'][0]
+        for video in (alice, bob):
+            video.subscription.user.preferences['download_path'] = os.path.join(download_dir.name,
+                                                                                 video.subscription.user.username)
+
+        # Alice already downloaded the video
+        alice.downloaded_path = os.path.join(download_dir.name, 'alice', 'S01E001 - Video')
+        alice.downloaded_format = bob.subscription.user.preferences['download_format']
+        alice.save()
+        os.makedirs(os.path.dirname(alice.downloaded_path))
+        for extension in ('.mp4', '.en.vtt'):
+            with open(alice.downloaded_path + extension, 'w') as f:
+                f.write('data')
+        alice.catalog_files()
+
+        bob.video_id = alice.video_id
+        bob.save()
+        bob.claim_download_queued(first_attempt=True)
+        with mock.patch.object(download_pool, 'download') as download:
+            scheduler.run_job(DownloadVideoJob, bob.subscription.user, [bob])
+        self.assertEqual(download.call_count, 0)
+
+        bob.refresh_from_db()
+        self.assertEqual(bob.download_state, VIDEO_DOWNLOAD_STATE_DONE)
+        bob_video, _ = bob.find_video()
+        self.assertTrue(bob_video.startswith(os.path.join(download_dir.name, 'bob')))
+        self.assertTrue(os.path.samefile(bob_video, alice.downloaded_path + '.mp4'))
+        self.assertEqual(bob.files.count(), 2)
+
+        # Shared files are only deleted with their last owner
+        alice_path = alice.downloaded_path
+        bob.files.update(path=alice_path + '.mp4')
+        scheduler.run_job(DeleteVideoJob, args=[alice])
+        self.assertTrue(os.path.exists(alice_path + '.mp4'))
+        self.assertFalse(os.path.exists(alice_path + '.en.vtt'))
+
+    def test_download_windows(self):
+        windows = parse_download_windows('23:00-06:00, 12:00-13:00')
+        self.assertTrue(in_download_window(windows, datetime.time(2, 0)))
+        self.assertTrue(in_download_window(windows, datetime.time(12, 30)))
+        self.assertFalse(in_download_window(windows, datetime.time(18, 0)))
+        self.assertTrue(in_download_window([], datetime.time(18, 0)))
+        with self.assertRaises(ValueError):
+            parse_download_windows('tomorrow')
+
+
+class LeaderElectionTests(TestCase):
+
+    def test_election_and_job_requests(self):
+        first, second = LeaderElection('first'), LeaderElection('second')
+        first.heartbeat()
+        second.heartbeat()
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+
+        # Jobs requested in the other processes are carried out by the leader
+        user = User.objects.create_user('test', password='test')
+        sub = Subscription.objects.create(name='Test channel', playlist_id='UU_test', description='',
+                                          channel_id='UC_test', channel_name='Test channel', thumbnail='', user=user)
+        with mock.patch.object(scheduler, 'add_job') as add_job:
+            with mock.patch('YtManagerApp.management.jobs.synchronize.leader_election', second):
+                SynchronizeJob.schedule_now_for_subscription(sub)
+            self.assertEqual(add_job.call_count, 0)
+            self.assertEqual(JobRequest.objects.count(), 1)
+
+            with mock.patch('YtManagerApp.management.jobs.synchronize.leader_election', first):
+                first.process_job_requests()
+            self.assertEqual(add_job.call_count, 1)
+            self.assertEqual(add_job.call_args[1]['args'], [sub])
+            self.assertEqual(JobRequest.objects.count(), 0)
+
+        # Another process takes over once the lease expires
+        second.heartbeat()
+        self.assertFalse(second.is_leader)
+        SchedulerLease.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        second.heartbeat()
+        first.heartbeat()
+        self.assertTrue(second.is_leader)
+        self.assertFalse(first.is_leader)
+
+    def test_demoted_leader_finishes_its_downloads(self):
+        first, second = LeaderElection('first'), LeaderElection('second')
+        first.heartbeat()
+        second.heartbeat()
+
+        user = User.objects.create_user('test', password='test')
+        sub = Subscription.objects.create(name='Test channel', playlist_id='UU_test', description='',
+                                          channel_id='UC_test', channel_name='Test channel', thumbnail='', user=user)
+        videos = {}
+        for name, state, owner in (('running', VIDEO_DOWNLOAD_STATE_RUNNING, 'first'),
+                                   ('abandoned', VIDEO_DOWNLOAD_STATE_RUNNING, 'exited'),
+                                   ('queued', VIDEO_DOWNLOAD_STATE_QUEUED, '')):
+            videos[name] = Video.objects.create(video_id=name, name=name, description='', watched=False, new=True,
+                                                uploader_name='', thumbnail='', publish_date=timezone.now(),
+                                                playlist_index=len(videos), subscription=sub, download_state=state,
+                                                download_owner=owner)
+
+        # Demotion doesn't wait for the running downloads
+        queue = DownloadQueue()
+        started, finish = threading.Event(), threading.Event()
+
+        def download(*args):
+            started.set()
+            finish.wait(5)
+
+        with mock.patch.object(scheduler, 'run_job', side_effect=download), \
+                mock.patch('YtManagerApp.management.download_queue.appconfig',
+                           mock.Mock(download_windows='', download_concurrency=1)):
+            queue.enqueue(DownloadVideoJob, videos['running'])
+            queue.start()
+            self.assertTrue(started.wait(5))
+            queue.stop()
+            self.assertEqual(len(queue.stats()['active']), 1)
+            finish.set()
+
+            # The new leader leaves alone the downloads still running in a live process
+            new_queue = DownloadQueue()
+            with mock.patch('YtManagerApp.management.download_queue.leader_election', second):
+                new_queue.start()
+            new_queue.stop()
+
+        states = dict(Video.objects.values_list('video_id', 'download_state'))
+        self.assertEqual(states, {'running': VIDEO_DOWNLOAD_STATE_RUNNING, 'abandoned': '', 'queued': ''})
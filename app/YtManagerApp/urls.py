@@ -26,7 +26,7 @@ from .views.index import index, ajax_get_tree, ajax_get_videos, CreateFolderModa
     CreateSubscriptionModal, UpdateSubscriptionModal, DeleteSubscriptionModal, ImportSubscriptionsModal
 from .views.notifications import ajax_get_running_jobs
 from .views.settings import SettingsView, AdminSettingsView
-from .views.video import VideoDetailView, video_detail_view
+from .views.video import VideoDetailView, video_detail_view, video_thumbnail_view
 
 urlpatterns = [
     # Authentication URLs
@@ -67,6 +67,7 @@ urlpatterns = [
     path('admin_settings/', AdminSettingsView.as_view(), name='admin_settings'),
     path('video/<int:pk>/', VideoDetailView.as_view(), name='video'),
     path('video-src/<int:pk>/', video_detail_view, name='video-src'),
+    path('thumb/<int:pk>/', video_thumbnail_view, name='video-thumbnail'),
 
     # First time setup
     path('first_time/step0_welcome', first_time.Step0WelcomeView.as_view(), name='first_time_0'),
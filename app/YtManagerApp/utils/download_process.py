@@ -0,0 +1,137 @@
+"""
+youtube-dl worker processes.
+
+youtube-dl spends a lot of time running Python code (page parsing, signature deciphering...) and its memory use grows
+over time, so it runs in separate processes, where it doesn't compete with the web server for the GIL. The workers
+report log and progress messages back through a queue, as (task_id, kind, payload) tuples, and return a result
+dictionary when the task is over. The last message of every task is MESSAGE_FINISHED, so the parent knows when it got
+all of them.
+
+This module doesn't depend on Django, so the worker processes can import it quickly.
+"""
+import logging
+import time
+from typing import Optional
+
+# Minimum interval between two progress messages of the same task, in seconds
+PROGRESS_INTERVAL = 1.0
+
+MESSAGE_LOG = 'log'
+MESSAGE_PROGRESS = 'progress'
+MESSAGE_FINISHED = 'finished'
+
+_messages = None
+
+
+def init_worker(messages):
+    """
+    Initializes a worker process.
+    :param messages: Queue where the log and progress messages are sent
+    """
+    global _messages
+    _messages = messages
+
+
+def _send(task_id: int, kind: str, payload):
+    if _messages is not None:
+        _messages.put((task_id, kind, payload))
+
+
+class _QueueLogger(object):
+    """
+    Logger given to youtube-dl, which sends the messages to the parent process.
+    """
+
+    def __init__(self, task_id: int):
+        self.task_id = task_id
+
+    def debug(self, msg):
+        _send(self.task_id, MESSAGE_LOG, (logging.DEBUG, msg))
+
+    def info(self, msg):
+        _send(self.task_id, MESSAGE_LOG, (logging.INFO, msg))
+
+    def warning(self, msg):
+        _send(self.task_id, MESSAGE_LOG, (logging.WARNING, msg))
+
+    def error(self, msg):
+        _send(self.task_id, MESSAGE_LOG, (logging.ERROR, msg))
+
+
+class _ProgressReporter(object):
+    """
+    youtube-dl progress hook, which sends the progress to the parent process (at most once every PROGRESS_INTERVAL,
+    except when a file is finished).
+    """
+
+    def __init__(self, task_id: int):
+        self.task_id = task_id
+        self.last_sent = 0.0
+
+    def __call__(self, status: dict):
+        now = time.monotonic()
+        if status.get('status') == 'downloading' and now - self.last_sent < PROGRESS_INTERVAL:
+            return
+        self.last_sent = now
+
+        _send(self.task_id, MESSAGE_PROGRESS, {
+            key: status.get(key)
+            for key in ('status', 'filename', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed',
+                        'eta', 'elapsed')
+        })
+
+
+def get_info_size(info: dict) -> Optional[int]:
+    """
+    Gets the size of a download from the information extracted by youtube-dl. When the video and audio are downloaded
+    separately and merged, the size is the sum of the two.
+    :return: Size in bytes, or None if unknown
+    """
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size is None:
+            return None
+        total += size
+    return int(total)
+
+
+def download(task_id: int, url: str, params: dict) -> dict:
+    """
+    Downloads a video. Runs in the worker processes.
+    :param task_id: Identifies the task in the messages sent to the parent
+    :param url: Video URL
+    :param params: youtube-dl parameters (except for the logger and the progress hooks)
+    :return: Dictionary containing the youtube-dl return code ('code') and an error message ('error'), if it failed
+    """
+    import youtube_dl
+
+    params = dict(params, logger=_QueueLogger(task_id), progress_hooks=[_ProgressReporter(task_id)])
+    try:
+        with youtube_dl.YoutubeDL(params) as yt:
+            code = yt.download([url])
+    except youtube_dl.utils.DownloadError as e:
+        return {'code': -1, 'error': str(e)}
+    finally:
+        _send(task_id, MESSAGE_FINISHED, None)
+
+    return {'code': code, 'error': f'youtube-dl finished with code {code}' if code != 0 else None}
+
+
+def estimate_size(task_id: int, url: str, params: dict) -> dict:
+    """
+    Asks youtube-dl how large the download of a video will be, without downloading it. Runs in the worker processes.
+    :return: Dictionary containing the size in bytes ('size', None if unknown) and an error message ('error')
+    """
+    import youtube_dl
+
+    params = dict(params, logger=_QueueLogger(task_id), skip_download=True)
+    try:
+        with youtube_dl.YoutubeDL(params) as yt:
+            info = yt.extract_info(url, download=False)
+    except youtube_dl.utils.DownloadError as e:
+        return {'size': None, 'error': str(e)}
+    finally:
+        _send(task_id, MESSAGE_FINISHED, None)
+
+    return {'size': get_info_size(info), 'error': None}
@@ -0,0 +1,444 @@
+"""
+A local stand-in for the YouTube Data API, serving synthetic channels and videos.
+
+It implements just enough of the API (the 'channels', 'playlists', 'playlistItems' and 'videos' endpoints, channel
+feeds and thumbnails) for the synchronization to run against it, without an API key or network access. It is used
+by the tests and by the 'benchmark_sync' management command.
+
+Usage:
+
+    data = FakeYoutubeData.generate(channels=10, videos_per_channel=200)
+    with FakeYoutubeServer(data, latency=0.05) as server:
+        with override_settings(YOUTUBE_API_ENDPOINT=server.api_endpoint, YOUTUBE_FEED_URL=server.feed_url):
+            ...
+"""
+import collections
+import datetime
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+
+import PIL.Image
+
+FEED_ENTRIES = 15
+DEFAULT_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 50
+
+
+class FakeVideo(object):
+    def __init__(self, video_id: str, channel: 'FakeChannel', title: str, published_at: datetime.datetime,
+                 views: int, likes: int, dislikes: int, duration: int):
+        self.id = video_id
+        self.channel = channel
+        self.title = title
+        self.published_at = published_at
+        self.views = views
+        self.likes = likes
+        self.dislikes = dislikes
+        self.duration = duration
+
+
+class FakeChannel(object):
+    def __init__(self, channel_id: str, title: str):
+        self.id = channel_id
+        self.title = title
+        self.uploads_playlist_id = 'UU' + channel_id[2:]
+        self.published_at = datetime.datetime(2010, 1, 1, tzinfo=datetime.timezone.utc)
+        # Newest first, like the 'Uploads' playlist
+        self.videos = []  # type: List[FakeVideo]
+
+
+class FakeYoutubeData(object):
+    """
+    Synthetic channels and videos served by FakeYoutubeServer. Video IDs and statistics are deterministic, given
+    the random seed.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.channels = collections.OrderedDict()  # type: Dict[str, FakeChannel]
+        self.videos = {}  # type: Dict[str, FakeVideo]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.__video_counter = 0
+
+    @staticmethod
+    def generate(channels: int = 10, videos_per_channel: Union[int, Tuple[int, int]] = 100, seed: int = 0,
+                 upload_interval: datetime.timedelta = datetime.timedelta(days=1),
+                 now: Optional[datetime.datetime] = None) -> 'FakeYoutubeData':
+        """
+        Generates a set of channels, each with its 'Uploads' playlist.
+        :param channels: Number of channels
+        :param videos_per_channel: Number of videos in each channel, or a (min, max) range
+        :param seed: Random seed
+        :param upload_interval: Average time between two uploads of a channel
+        :param now: Publish date of the newest videos (default: now)
+        :return: Generated data
+        """
+        data = FakeYoutubeData(seed)
+        for _ in range(channels):
+            channel = data.add_channel()
+            if isinstance(videos_per_channel, int):
+                count = videos_per_channel
+            else:
+                count = data.random.randint(*videos_per_channel)
+            data.add_videos(channel, count, upload_interval, now)
+
+        return data
+
+    def add_channel(self, title: Optional[str] = None) -> FakeChannel:
+        with self.lock:
+            index = len(self.channels)
+            channel = FakeChannel(f'UC{index:022d}', title or f'Channel {index}')
+            self.channels[channel.id] = channel
+            return channel
+
+    def add_videos(self, channel: FakeChannel, count: int,
+                   upload_interval: datetime.timedelta = datetime.timedelta(days=1),
+                   now: Optional[datetime.datetime] = None) -> List[FakeVideo]:
+        """
+        Uploads new videos to a channel. The newest video is published at 'now', the others at random intervals
+        before it, but always after the videos which are already in the channel (the intervals are shortened if
+        needed).
+        :raises ValueError: if 'now' is not after the newest video of the channel
+        """
+        if now is None:
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        with self.lock:
+            published_at = now
+            new_videos = []
+            for _ in range(count):
+                self.__video_counter += 1
+                views = int(self.random.paretovariate(1.2) * 100)
+                video = FakeVideo(f'fake{self.__video_counter:07d}', channel, f'Video {self.__video_counter}',
+                                  published_at, views, views // 20, views // 200, self.random.randint(30, 3600))
+                new_videos.append(video)
+                self.videos[video.id] = video
+                published_at -= upload_interval * self.random.uniform(0.5, 1.5)
+
+            if len(channel.videos) > 0 and len(new_videos) > 0:
+                newest = channel.videos[0].published_at
+                oldest = new_videos[-1].published_at
+                if now <= newest:
+                    raise ValueError(f"New videos of {channel.title} must be published after {newest}")
+                if oldest <= newest:
+                    # Squeeze the new videos between the newest video of the channel and 'now'
+                    scale = (now - newest) / ((now - oldest) + upload_interval)
+                    for video in new_videos:
+                        video.published_at = now - (now - video.published_at) * scale
+
+            channel.videos[0:0] = new_videos
+            return new_videos
+
+    def update_views(self, fraction: float = 1.0):
+        """
+        Increases the view count of a fraction of the videos.
+        """
+        with self.lock:
+            for video in self.videos.values():
+                if self.random.random() < fraction:
+                    video.views += self.random.randint(1, 1000)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    server: 'FakeYoutubeServer'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        routes = {
+            '/youtube/v3/channels': ('channels', self.get_channels),
+            '/youtube/v3/playlists': ('playlists', self.get_playlists),
+            '/youtube/v3/playlistItems': ('playlistItems', self.get_playlist_items),
+            '/youtube/v3/videos': ('videos', self.get_videos),
+            '/feeds/videos.xml': ('feeds', self.get_feed),
+        }
+
+        if url.path.startswith('/thumbnails/'):
+            self.server.record_call('thumbnails')
+            self.send_body(self.server.thumbnail(), 'image/jpeg')
+            return
+
+        if url.path not in routes:
+            self.send_error_response(404, 'notFound', f'Unknown path {url.path}')
+            return
+
+        name, handler = routes[url.path]
+        self.server.record_call(name)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        with self.server.data.lock:
+            handler(query)
+
+    def log_message(self, format, *args):
+        pass
+
+    # Responses
+    def send_body(self, body: bytes, content_type: str, etag: Optional[str] = None):
+        if etag is not None and self.headers.get('If-None-Match', '').strip('"') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, response: dict):
+        etag = hashlib.sha1(json.dumps(response, sort_keys=True).encode()).hexdigest()
+        response['etag'] = etag
+        self.send_body(json.dumps(response).encode(), 'application/json; charset=UTF-8', etag)
+
+    def send_error_response(self, status: int, reason: str, message: str):
+        body = json.dumps({'error': {'code': status, 'message': message,
+                                     'errors': [{'reason': reason, 'message': message}]}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_list(self, kind: str, items: list, query: dict):
+        page_size = min(int(query.get('maxResults', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        start = int(query.get('pageToken', 0))
+        response = {
+            'kind': f'youtube#{kind}ListResponse',
+            'pageInfo': {'totalResults': len(items), 'resultsPerPage': page_size},
+            'items': items[start:start + page_size],
+        }
+        if start + page_size < len(items):
+            response['nextPageToken'] = str(start + page_size)
+
+        self.send_json(response)
+
+    # Resources
+    def thumbnails(self, resource_id: str) -> dict:
+        return {
+            'default': {'url': f'{self.server.base_url}/thumbnails/{resource_id}.jpg', 'width': 120, 'height': 90},
+            'high': {'url': f'{self.server.base_url}/thumbnails/{resource_id}.jpg', 'width': 480, 'height': 360},
+        }
+
+    def channel_resource(self, channel: FakeChannel, parts: List[str]) -> dict:
+        resource = {'kind': 'youtube#channel', 'id': channel.id}
+        if 'snippet' in parts:
+            resource['snippet'] = {
+                'title': channel.title,
+                'description': f'Description of {channel.title}',
+                'publishedAt': channel.published_at.isoformat(),
+                'thumbnails': self.thumbnails(channel.id),
+            }
+        if 'contentDetails' in parts:
+            resource['contentDetails'] = {'relatedPlaylists': {'uploads': channel.uploads_playlist_id}}
+        if 'statistics' in parts:
+            resource['statistics'] = {
+                'videoCount': str(len(channel.videos)),
+                'viewCount': str(sum(video.views for video in channel.videos)),
+            }
+        return resource
+
+    def playlist_resource(self, channel: FakeChannel, parts: List[str]) -> dict:
+        resource = {'kind': 'youtube#playlist', 'id': channel.uploads_playlist_id}
+        if 'snippet' in parts:
+            resource['snippet'] = {
+                'title': f'Uploads from {channel.title}',
+                'description': '',
+                'publishedAt': channel.published_at.isoformat(),
+                'channelId': channel.id,
+                'channelTitle': channel.title,
+                'thumbnails': self.thumbnails(channel.id),
+            }
+        return resource
+
+    def playlist_item_resource(self, video: FakeVideo, position: int, parts: List[str]) -> dict:
+        resource = {'kind': 'youtube#playlistItem', 'id': f'PI{video.id}'}
+        if 'snippet' in parts:
+            resource['snippet'] = {
+                'title': video.title,
+                'description': f'Description of {video.title}',
+                'publishedAt': video.published_at.isoformat(),
+                'channelId': video.channel.id,
+                'channelTitle': video.channel.title,
+                'playlistId': video.channel.uploads_playlist_id,
+                'position': position,
+                'thumbnails': self.thumbnails(video.id),
+                'resourceId': {'kind': 'youtube#video', 'videoId': video.id},
+            }
+        return resource
+
+    def video_resource(self, video: FakeVideo, parts: List[str]) -> dict:
+        resource = {'kind': 'youtube#video', 'id': video.id}
+        if 'snippet' in parts:
+            resource['snippet'] = {
+                'title': video.title,
+                'description': f'Description of {video.title}',
+                'publishedAt': video.published_at.isoformat(),
+                'channelId': video.channel.id,
+                'channelTitle': video.channel.title,
+                'thumbnails': self.thumbnails(video.id),
+            }
+        if 'contentDetails' in parts:
+            resource['contentDetails'] = {'duration': f'PT{video.duration // 60}M{video.duration % 60}S'}
+        if 'statistics' in parts:
+            resource['statistics'] = {
+                'viewCount': str(video.views),
+                'likeCount': str(video.likes),
+                'dislikeCount': str(video.dislikes),
+                'favoriteCount': '0',
+                'commentCount': '0',
+            }
+        return resource
+
+    # Endpoints
+    def get_channels(self, query: dict):
+        parts = query.get('part', 'id').split(',')
+        if 'id' in query:
+            channels = [self.server.data.channels[channel_id] for channel_id in query['id'].split(',')
+                        if channel_id in self.server.data.channels]
+        else:
+            username = query.get('forUsername')
+            channels = [channel for channel in self.server.data.channels.values() if channel.title == username]
+
+        self.send_list('channel', [self.channel_resource(channel, parts) for channel in channels], query)
+
+    def get_playlists(self, query: dict):
+        parts = query.get('part', 'id').split(',')
+        playlist_ids = set(query.get('id', '').split(','))
+        channels = [channel for channel in self.server.data.channels.values()
+                    if channel.uploads_playlist_id in playlist_ids]
+
+        self.send_list('playlist', [self.playlist_resource(channel, parts) for channel in channels], query)
+
+    def get_playlist_items(self, query: dict):
+        parts = query.get('part', 'id').split(',')
+        channel = self.server.find_channel(playlist_id=query.get('playlistId'))
+        if channel is None:
+            self.send_error_response(404, 'playlistNotFound', 'The playlist cannot be found.')
+            return
+
+        items = [self.playlist_item_resource(video, position, parts) for position, video in enumerate(channel.videos)]
+        self.send_list('playlistItem', items, query)
+
+    def get_videos(self, query: dict):
+        parts = query.get('part', 'id').split(',')
+        videos = [self.server.data.videos[video_id] for video_id in query.get('id', '').split(',')
+                  if video_id in self.server.data.videos]
+
+        # All the requested videos are returned in a single page
+        query = dict(query, maxResults=MAX_PAGE_SIZE)
+        self.send_list('video', [self.video_resource(video, parts) for video in videos], query)
+
+    def get_feed(self, query: dict):
+        channel = self.server.find_channel(channel_id=query.get('channel_id'), playlist_id=query.get('playlist_id'))
+        if channel is None:
+            self.send_error(404)
+            return
+
+        entries = ''.join(
+            f'<entry><id>yt:video:{video.id}</id><yt:videoId>{video.id}</yt:videoId>'
+            f'<yt:channelId>{channel.id}</yt:channelId><title>{escape(video.title)}</title>'
+            f'<published>{video.published_at.isoformat()}</published></entry>'
+            for video in channel.videos[:FEED_ENTRIES])
+
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">'
+                f'<title>{escape(channel.title)}</title>{entries}</feed>').encode()
+
+        self.send_body(body, 'text/xml; charset=UTF-8', hashlib.sha1(body).hexdigest())
+
+
+class FakeYoutubeServer(ThreadingHTTPServer):
+    """
+    HTTP server emulating the YouTube Data API, channel feeds and thumbnails, on a local port.
+    Keeps count of the requests made to each endpoint.
+    """
+    daemon_threads = True
+
+    def __init__(self, data: FakeYoutubeData, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        """
+        :param data: Channels and videos to serve
+        :param latency: Delay added to every API and feed request, in seconds
+        :param host: Address to listen on
+        :param port: Port to listen on (default: any free port)
+        """
+        super().__init__((host, port), _RequestHandler)
+        self.data = data
+        self.latency = latency
+        self.call_counts = collections.Counter()
+        self.__counts_lock = threading.Lock()
+        self.__thumbnail = None
+        self.__thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_endpoint(self) -> str:
+        """ Value for the YOUTUBE_API_ENDPOINT setting """
+        return self.base_url + '/'
+
+    @property
+    def feed_url(self) -> str:
+        """ Value for the YOUTUBE_FEED_URL setting """
+        return self.base_url + '/feeds/videos.xml'
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever, name='FakeYoutubeServer', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def record_call(self, endpoint: str):
+        with self.__counts_lock:
+            self.call_counts[endpoint] += 1
+
+    def reset_counts(self) -> collections.Counter:
+        """
+        Resets the request counters.
+        :return: The counts before the reset
+        """
+        with self.__counts_lock:
+            counts = self.call_counts
+            self.call_counts = collections.Counter()
+            return counts
+
+    def find_channel(self, channel_id: Optional[str] = None, playlist_id: Optional[str] = None) \
+            -> Optional[FakeChannel]:
+        if channel_id is not None:
+            return self.data.channels.get(channel_id)
+        if playlist_id is not None and playlist_id.startswith('UU'):
+            return self.data.channels.get('UC' + playlist_id[2:])
+        return None
+
+    def thumbnail(self) -> bytes:
+        if self.__thumbnail is None:
+            with io.BytesIO() as buffer:
+                PIL.Image.new('RGB', (480, 360), (128, 128, 128)).save(buffer, 'JPEG')
+                self.__thumbnail = buffer.getvalue()
+        return self.__thumbnail
@@ -0,0 +1,87 @@
+import logging
+import xml.etree.ElementTree as ElementTree
+from typing import Optional, List
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+
+log = logging.getLogger('feeds')
+
+FEED_TIMEOUT = 10
+
+_NAMESPACES = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'yt': 'http://www.youtube.com/xml/schemas/2015',
+}
+
+# Sessions keep connections alive between requests; they can be shared between threads for simple GET requests.
+_session = requests.Session()
+
+
+class FeedResult(object):
+    """
+    Result of fetching a channel or playlist feed.
+    """
+    def __init__(self, not_modified: bool, video_ids: List[str], etag: Optional[str], last_modified: Optional[str]):
+        self.not_modified = not_modified
+        self.video_ids = video_ids
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __repr__(self):
+        return f'<FeedResult not_modified={self.not_modified} videos={len(self.video_ids)}>'
+
+
+def build_feed_url(channel_id: Optional[str] = None, playlist_id: Optional[str] = None) -> str:
+    """
+    Builds the URL of the Atom feed of a channel or playlist.
+    :param channel_id: Channel ID
+    :param playlist_id: Playlist ID, used if the channel ID is not given
+    :return: Feed URL
+    """
+    if channel_id is not None:
+        query = {'channel_id': channel_id}
+    elif playlist_id is not None:
+        query = {'playlist_id': playlist_id}
+    else:
+        raise ValueError('Please specify one of: channel_id, playlist_id')
+
+    return settings.YOUTUBE_FEED_URL + '?' + urlencode(query)
+
+
+def parse_feed_video_ids(content: bytes) -> List[str]:
+    """
+    Extracts the video IDs from an Atom feed, in the order in which they appear (newest first).
+    """
+    root = ElementTree.fromstring(content)
+    return [entry.findtext('yt:videoId', namespaces=_NAMESPACES)
+            for entry in root.iterfind('atom:entry', _NAMESPACES)]
+
+
+def fetch_feed(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FeedResult:
+    """
+    Fetches a feed using a conditional GET request. Fetching feeds doesn't use any YouTube API quota.
+    :param url: Feed URL
+    :param etag: ETag received the last time the feed was fetched
+    :param last_modified: Last-Modified header received the last time the feed was fetched
+    :return: Feed result. If the feed was not modified since the last fetch, the list of videos is empty.
+    :raises requests.exceptions.RequestException: if the request fails
+    :raises xml.etree.ElementTree.ParseError: if the feed is not valid
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    response = _session.get(url, headers=headers, timeout=FEED_TIMEOUT)
+    if response.status_code == 304:
+        log.debug('Feed %s not modified.', url)
+        return FeedResult(True, [], etag, last_modified)
+
+    response.raise_for_status()
+    return FeedResult(False,
+                      parse_feed_video_ids(response.content),
+                      response.headers.get('ETag'),
+                      response.headers.get('Last-Modified'))
@@ -0,0 +1,82 @@
+import errno
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Union
+
+from YtManagerApp.utils.algorithms import bisect_left
+
+
+class DirectorySnapshot(object):
+    """
+    Caches directory listings, so that each directory is listed only once (with a single os.scandir call),
+    no matter how many files are looked up in it.
+
+    A snapshot is meant to live for the duration of a single operation (e.g. a synchronization); changes made to the
+    file system afterwards are not seen, unless the directory is invalidated.
+    """
+
+    def __init__(self):
+        # directory -> sorted list of file names, or the error raised when listing the directory
+        self.__listings = {}  # type: Dict[str, Union[List[str], OSError]]
+        self.listing_count = 0
+
+    def list(self, directory: str) -> List[str]:
+        """
+        Lists the names of the files in a directory, sorted.
+        :raises OSError: if the directory can't be listed
+        """
+        listing = self.__listings.get(directory)
+        if listing is None:
+            self.listing_count += 1
+            try:
+                with os.scandir(directory) as it:
+                    listing = sorted(entry.name for entry in it)
+            except OSError as e:
+                listing = e
+            self.__listings[directory] = listing
+
+        if isinstance(listing, OSError):
+            raise listing
+        return listing
+
+    def find_prefixed(self, directory: str, prefix: str) -> Iterator[str]:
+        """
+        Finds the files in a directory whose names start with the given prefix.
+        :return: Full paths of the matching files
+        :raises OSError: if the directory can't be listed
+        """
+        listing = self.list(directory)
+        index = bisect_left(listing, prefix)
+        while index < len(listing) and listing[index].startswith(prefix):
+            yield os.path.join(directory, listing[index])
+            index += 1
+
+    def invalidate(self, directory: Optional[str] = None):
+        """
+        Forgets the listing of a directory (or of all directories), so it will be listed again when needed.
+        """
+        if directory is None:
+            self.__listings.clear()
+        else:
+            self.__listings.pop(directory, None)
+
+
+def link_or_copy(source: str, destination: str) -> bool:
+    """
+    Makes a file available at another path: as a hard link if possible, otherwise (e.g. different file systems, or a
+    file system without hard links) as a copy. An existing file at the destination is replaced.
+    :return: True if the file was linked, False if it was copied
+    :raises OSError: if the source can't be read, or the destination can't be written
+    """
+    destination_tmp = destination + '.tmp'
+    try:
+        os.link(source, destination_tmp)
+        linked = True
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.EEXIST):
+            raise
+        shutil.copy2(source, destination_tmp)
+        linked = False
+
+    os.replace(destination_tmp, destination)
+    return linked
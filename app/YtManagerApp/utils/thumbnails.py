@@ -0,0 +1,104 @@
+"""
+Thumbnail rendering.
+
+Thumbnails are stored content-addressed: the file name is the hash of the original image, followed by the size, so
+an image shared by several videos or subscriptions is stored (and rendered) only once. Every thumbnail is rendered in
+several sizes, so browsers can pick the one they need (srcset).
+
+This module doesn't depend on Django, so the worker processes which render the thumbnails can import it quickly.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import PIL.Image
+import PIL.ImageOps
+import PIL.features
+
+Size = Tuple[int, int]
+
+_THUMBNAIL_NAME = re.compile(r'(?P<digest>[0-9a-f]{64})-(?P<width>\d+)x(?P<height>\d+)(?P<ext>\.webp|\.jpg)$')
+
+
+def thumbnail_format() -> Tuple[str, str]:
+    """
+    Gets the format in which thumbnails are stored: WebP if Pillow supports it, JPEG otherwise.
+    :return: Tuple containing the PIL format name and the file extension
+    """
+    if PIL.features.check('webp'):
+        return 'WEBP', '.webp'
+    return 'JPEG', '.jpg'
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def scaled_sizes(size: Size, scales: Iterable[float]) -> List[Size]:
+    """
+    Computes the sizes in which a thumbnail is rendered, from the smallest to the largest.
+    """
+    width, height = size
+    return sorted({(round(width * scale), round(height * scale)) for scale in scales})
+
+
+def thumbnail_path(digest: str, size: Size, ext: str) -> str:
+    """
+    Gets the path of a thumbnail, relative to the thumbnail folder.
+    """
+    return f'{digest[:2]}/{digest}-{size[0]}x{size[1]}{ext}'
+
+
+def render_thumbnails(data: bytes, sizes: Sequence[Size], directory: str, digest: str, quality: int) -> List[str]:
+    """
+    Decodes an image, then resizes and crops it to each of the given sizes. Runs in the worker processes.
+    :param data: Original image
+    :param sizes: Sizes to render
+    :param directory: Thumbnail folder
+    :param digest: Digest of the original image
+    :param quality: Encoder quality (0-100)
+    :return: Paths of the written files
+    :raises OSError: if the image can't be decoded, or the files can't be written
+    """
+    fmt, ext = thumbnail_format()
+    paths = []
+
+    with PIL.Image.open(io.BytesIO(data)) as image:
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha and fmt == 'WEBP' else 'RGB')
+
+        for size in sizes:
+            path = os.path.join(directory, thumbnail_path(digest, size, ext))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Other processes may be rendering the same image; the last one to finish wins, it is the same file
+            path_tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            thumbnail = PIL.ImageOps.fit(image, size, PIL.Image.LANCZOS)
+            thumbnail.save(path_tmp, format=fmt, quality=quality)
+            os.replace(path_tmp, path)
+            paths.append(path)
+
+    return paths
+
+
+def thumbnail_srcset(url: str, scales: Iterable[float]) -> Optional[str]:
+    """
+    Builds the srcset attribute for a thumbnail URL.
+    :param url: URL of the largest size of the thumbnail
+    :param scales: Scales in which the thumbnail was rendered (see scaled_sizes)
+    :return: srcset attribute, or None if the thumbnail doesn't come in several sizes (e.g. remote URLs, or
+    thumbnails stored by older versions)
+    """
+    match = _THUMBNAIL_NAME.search(url)
+    if match is None:
+        return None
+
+    base_url = url[:match.start()]
+    digest, ext = match.group('digest'), match.group('ext')
+    full_size = int(match.group('width')), int(match.group('height'))
+
+    return ', '.join(f"{base_url}{digest}-{width}x{height}{ext} {width}w"
+                     for width, height in scaled_sizes(full_size, scales))
@@ -1,14 +1,37 @@
+import os
+import threading
+
 from django.conf import settings
+from external.pytaw.pytaw.cache import ResponseCache
 from external.pytaw.pytaw.youtube import YouTube, Channel, Playlist, PlaylistItem, Thumbnail, InvalidURL, Resource, Video
 from typing import Optional
 
+__response_cache = None
+__response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Gets the API response cache shared by all the API instances. The cache is stored in DATA_DIR; if the setting
+    changes (e.g. tests overriding it), a new cache is opened there.
+    :return:
+    """
+    global __response_cache
+    directory = os.path.join(settings.DATA_DIR, 'cache', 'youtube_api')
+    with __response_cache_lock:
+        if __response_cache is None or __response_cache.directory != directory:
+            __response_cache = ResponseCache(directory, settings.YOUTUBE_API_CACHE_SIZE)
+        return __response_cache
+
 
 class YoutubeAPI(YouTube):
 
     @staticmethod
     def build_public() -> 'YoutubeAPI':
         from YtManagerApp.management.appconfig import appconfig
-        return YoutubeAPI(key=appconfig.youtube_api_key)
+        from YtManagerApp.management.quota import quota_ledger
+        return YoutubeAPI(key=appconfig.youtube_api_key, cache=get_response_cache(),
+                          quota_callback=quota_ledger.record, api_endpoint=settings.YOUTUBE_API_ENDPOINT)
 
     # @staticmethod
     # def build_oauth() -> 'YoutubeAPI':
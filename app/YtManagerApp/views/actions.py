@@ -48,7 +48,6 @@ class MarkVideoUnwatchedView(LoginRequiredMixin, View):
     def post(self, *args, **kwargs):
         video = Video.objects.get(id=kwargs['pk'])
         video.mark_unwatched()
-        video.save()
         return JsonResponse({
             'success': True
         })
@@ -8,9 +8,8 @@ from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.views.generic import FormView
 
+from YtManagerApp.appmain import start_scheduler
 from YtManagerApp.management.appconfig import appconfig
-from YtManagerApp.management.jobs.synchronize import SynchronizeJob
-from YtManagerApp.scheduler import scheduler
 from YtManagerApp.views.forms.first_time import WelcomeForm, ApiKeyForm, PickAdminUserForm, ServerConfigForm, DoneForm, \
     UserCreationForm, LoginForm
 
@@ -177,8 +176,7 @@ class Step3ConfigureView(WizardStepMixin, FormView):
         appconfig.initialized = True
 
         # Start scheduler if not started
-        scheduler.initialize()
-        SynchronizeJob.schedule_global_job()
+        start_scheduler()
 
         return super().form_valid(form)
 
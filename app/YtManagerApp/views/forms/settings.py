@@ -1,12 +1,14 @@
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, HTML, Submit
 from django import forms
+from django.conf import settings as dj_settings
 
 from YtManagerApp.dynamic_preferences_registry import MarkDeletedAsWatched, AutoDeleteWatched, AutoDownloadEnabled, \
     DownloadGlobalLimit, DownloadGlobalSizeLimit, DownloadSubscriptionLimit, DownloadMaxAttempts, DownloadOrder, \
     DownloadPath, DownloadFilePattern, DownloadFormat, DownloadSubtitles, DownloadAutogeneratedSubtitles, \
     DownloadAllSubtitles, DownloadSubtitlesLangs, DownloadSubtitlesFormat
 from YtManagerApp.management.appconfig import appconfig
+from YtManagerApp.management.download_queue import parse_download_windows
 from YtManagerApp.models import VIDEO_ORDER_CHOICES
 
 
@@ -193,6 +195,15 @@ class AdminSettingsForm(forms.Form):
 
     api_key = forms.CharField(label="YouTube API key")
 
+    api_daily_quota = forms.IntegerField(
+        label="YouTube API daily quota",
+        help_text="How many YouTube API quota units can be used each day (0 = unlimited). When the remaining quota "
+                  "is not enough, synchronizations look for new videos first, and postpone the statistics updates.",
+        initial=10000,
+        min_value=0,
+        required=True
+    )
+
     allow_registrations = forms.BooleanField(
         label="Allow user registrations",
         help_text="Disabling this option will prevent anyone from registering to the site.",
@@ -207,6 +218,48 @@ class AdminSettingsForm(forms.Form):
         required=True
     )
 
+    deep_sync_schedule = forms.CharField(
+        label="Deep synchronization schedule",
+        help_text="How often should the application rescan entire playlists. Regular synchronizations only look at "
+                  "the newest videos of a channel, and stop as soon as they reach videos which are already known.",
+        initial="35 3 * * 0",
+        required=True
+    )
+
+    incremental_sync_stop_count = forms.IntegerField(
+        label="Incremental synchronization stop count",
+        help_text="How many already known videos in a row a regular synchronization should see before it stops "
+                  "looking for new videos (0 = always scan entire playlists).",
+        initial=10,
+        min_value=0,
+        required=True
+    )
+
+    sync_feed_precheck = forms.BooleanField(
+        label="Check feeds before synchronizing",
+        help_text="Before asking the YouTube API for the newest videos of a channel, check the channel's feed. If "
+                  "there is nothing new in the feed, the channel is skipped, which saves API quota.",
+        initial=True,
+        required=False
+    )
+
+    sync_adaptive = forms.BooleanField(
+        label="Adaptive synchronization",
+        help_text="Synchronize each subscription based on how often it gets new videos, instead of every time. "
+                  "Channels which rarely upload are checked less often. Deep synchronizations still check everything.",
+        initial=True,
+        required=False
+    )
+
+    watch_downloads = forms.BooleanField(
+        label="Watch download folders",
+        help_text="Watch the download folders for deleted files, so deleted videos are noticed immediately. When "
+                  "enabled, regular synchronizations no longer check the downloaded files, only deep "
+                  "synchronizations do.",
+        initial=False,
+        required=False
+    )
+
     scheduler_concurrency = forms.IntegerField(
         label="Synchronization concurrency",
         help_text="How many jobs are executed executed in parallel. Since most jobs are I/O bound (mostly use the hard "
@@ -215,6 +268,41 @@ class AdminSettingsForm(forms.Form):
         required=True
     )
 
+    sync_concurrency = forms.IntegerField(
+        label="Subscription synchronization concurrency",
+        help_text="How many subscriptions are fetched from YouTube in parallel during a synchronization.",
+        initial=4,
+        min_value=1,
+        required=True
+    )
+
+    download_concurrency = forms.IntegerField(
+        label="Download concurrency",
+        help_text="How many videos are downloaded in parallel. Downloads don't count towards the synchronization "
+                  "concurrency. Changes take effect after the server is restarted.",
+        initial=2,
+        min_value=1,
+        required=True
+    )
+
+    download_rate_limit = forms.IntegerField(
+        label="Download rate limit (KiB/s)",
+        help_text="Maximum total download speed (0 = unlimited). Each download gets an equal share of the limit, "
+                  "based on the number of downloads running when it starts.",
+        initial=0,
+        min_value=0,
+        required=True
+    )
+
+    download_windows = forms.CharField(
+        label="Download windows",
+        help_text="Times of day when automatic downloads may start, e.g. '01:00-07:00, 13:00-14:00' (empty = any "
+                  f"time), in the server time zone ({dj_settings.TIME_ZONE}). Downloads requested by users start "
+                  "right away.",
+        initial='',
+        required=False
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.helper = FormHelper()
@@ -224,20 +312,48 @@ class AdminSettingsForm(forms.Form):
         self.helper.layout = Layout(
             HTML('<h2>General settings</h2>'),
             'api_key',
+            'api_daily_quota',
             'allow_registrations',
             HTML('<h2>Scheduler settings</h2>'),
             'sync_schedule',
+            'deep_sync_schedule',
+            'incremental_sync_stop_count',
+            'sync_feed_precheck',
+            'sync_adaptive',
+            'watch_downloads',
             'scheduler_concurrency',
+            'sync_concurrency',
+            'download_concurrency',
+            'download_rate_limit',
+            'download_windows',
             Submit('submit', value='Save')
         )
 
+    def clean_download_windows(self):
+        download_windows = self.cleaned_data['download_windows']
+        try:
+            parse_download_windows(download_windows)
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
+        return download_windows
+
     @staticmethod
     def get_initials():
         return {
             'api_key': appconfig.youtube_api_key,
+            'api_daily_quota': appconfig.youtube_api_daily_quota,
             'allow_registrations': appconfig.allow_registrations,
             'sync_schedule': appconfig.sync_schedule,
+            'deep_sync_schedule': appconfig.deep_sync_schedule,
+            'incremental_sync_stop_count': appconfig.incremental_sync_stop_count,
+            'sync_feed_precheck': appconfig.sync_feed_precheck,
+            'sync_adaptive': appconfig.sync_adaptive,
+            'watch_downloads': appconfig.watch_downloads,
             'scheduler_concurrency': appconfig.concurrency,
+            'sync_concurrency': appconfig.sync_concurrency,
+            'download_concurrency': appconfig.download_concurrency,
+            'download_rate_limit': appconfig.download_rate_limit,
+            'download_windows': appconfig.download_windows,
         }
 
     def save(self):
@@ -245,6 +361,10 @@ class AdminSettingsForm(forms.Form):
         if api_key is not None and len(api_key) > 0:
             appconfig.youtube_api_key = api_key
 
+        api_daily_quota = self.cleaned_data['api_daily_quota']
+        if api_daily_quota is not None:
+            appconfig.youtube_api_daily_quota = api_daily_quota
+
         allow_registrations = self.cleaned_data['allow_registrations']
         if allow_registrations is not None:
             appconfig.allow_registrations = allow_registrations
@@ -253,6 +373,42 @@ class AdminSettingsForm(forms.Form):
         if sync_schedule is not None and len(sync_schedule) > 0:
             appconfig.sync_schedule = sync_schedule
 
+        deep_sync_schedule = self.cleaned_data['deep_sync_schedule']
+        if deep_sync_schedule is not None and len(deep_sync_schedule) > 0:
+            appconfig.deep_sync_schedule = deep_sync_schedule
+
+        incremental_sync_stop_count = self.cleaned_data['incremental_sync_stop_count']
+        if incremental_sync_stop_count is not None:
+            appconfig.incremental_sync_stop_count = incremental_sync_stop_count
+
+        sync_feed_precheck = self.cleaned_data['sync_feed_precheck']
+        if sync_feed_precheck is not None:
+            appconfig.sync_feed_precheck = sync_feed_precheck
+
+        sync_adaptive = self.cleaned_data['sync_adaptive']
+        if sync_adaptive is not None:
+            appconfig.sync_adaptive = sync_adaptive
+
+        watch_downloads = self.cleaned_data['watch_downloads']
+        if watch_downloads is not None:
+            appconfig.watch_downloads = watch_downloads
+
         concurrency = self.cleaned_data['scheduler_concurrency']
         if concurrency is not None:
             appconfig.concurrency = concurrency
+
+        sync_concurrency = self.cleaned_data['sync_concurrency']
+        if sync_concurrency is not None:
+            appconfig.sync_concurrency = sync_concurrency
+
+        download_concurrency = self.cleaned_data['download_concurrency']
+        if download_concurrency is not None:
+            appconfig.download_concurrency = download_concurrency
+
+        download_rate_limit = self.cleaned_data['download_rate_limit']
+        if download_rate_limit is not None:
+            appconfig.download_rate_limit = download_rate_limit
+
+        download_windows = self.cleaned_data['download_windows']
+        if download_windows is not None:
+            appconfig.download_windows = download_windows
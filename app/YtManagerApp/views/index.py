@@ -3,16 +3,17 @@ from crispy_forms.layout import Layout, Field, HTML
 from django import forms
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.http import HttpRequest, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, redirect
 from django.views.generic import CreateView, UpdateView, DeleteView, FormView
 from django.views.generic.edit import FormMixin
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.template.defaultfilters import filesizeformat
 from YtManagerApp.management.videos import get_videos
 from YtManagerApp.management.appconfig import appconfig
-from YtManagerApp.models import Subscription, SubscriptionFolder, VIDEO_ORDER_CHOICES, VIDEO_ORDER_MAPPING
+from YtManagerApp.models import Subscription, SubscriptionFolder, VideoFile, VIDEO_ORDER_CHOICES, VIDEO_ORDER_MAPPING
 from YtManagerApp.utils import youtube, subscription_file_parser
 from YtManagerApp.views.controls.modal import ModalMixin
 
@@ -130,6 +131,12 @@ def index(request: HttpRequest):
 @login_required
 def ajax_get_tree(request: HttpRequest):
 
+    # Downloaded size of each subscription, from the file catalog
+    downloaded_sizes = dict(VideoFile.objects.filter(video__subscription__user=request.user)
+                            .order_by()
+                            .values_list('video__subscription_id')
+                            .annotate(Sum('size')))
+
     def visit(node):
         if isinstance(node, SubscriptionFolder):
             return {
@@ -145,6 +152,7 @@ def ajax_get_tree(request: HttpRequest):
                 "type": "sub",
                 "text": node.name,
                 "icon": node.thumbnail,
+                "a_attr": {"title": "Downloaded: " + filesizeformat(downloaded_sizes.get(node.id, 0))},
                 "parent": __tree_folder_id(node.parent_folder_id)
             }
 
@@ -3,7 +3,13 @@ from django.http import HttpResponseForbidden
 from django.urls import reverse_lazy
 from django.views.generic import FormView
 
+from YtManagerApp.management.appconfig import appconfig
 from YtManagerApp.management.jobs.synchronize import SynchronizeJob
+from YtManagerApp.management.download_queue import download_queue
+from YtManagerApp.management.leader import leader_election
+from YtManagerApp.management.quota import quota_ledger
+from YtManagerApp.management.watcher import update_download_watcher
+from YtManagerApp.utils import youtube
 from YtManagerApp.views.forms.settings import SettingsForm, AdminSettingsForm
 
 
@@ -18,7 +24,10 @@ class SettingsView(LoginRequiredMixin, FormView):
         return initial
 
     def form_valid(self, form):
+        old_download_path = self.request.user.preferences['download_path']
         form.save(self.request.user)
+        if self.request.user.preferences['download_path'] != old_download_path:
+            update_download_watcher(only_if_running=True)
         return super().form_valid(form)
 
 
@@ -35,7 +44,12 @@ class AdminSettingsView(LoginRequiredMixin, FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # TODO: present stats
+        context['api_cache_stats'] = youtube.get_response_cache().stats()
+        context['api_daily_quota'] = appconfig.youtube_api_daily_quota
+        context['quota_daily_totals'] = quota_ledger.daily_totals()
+        context['quota_endpoint_totals'] = quota_ledger.endpoint_totals()
+        context['download_queue'] = download_queue.stats()
+        context['download_queue_elsewhere'] = not leader_election.is_leader and leader_election.participating
         return context
 
     def get_initial(self):
@@ -46,4 +60,5 @@ class AdminSettingsView(LoginRequiredMixin, FormView):
     def form_valid(self, form):
         form.save()
         SynchronizeJob.schedule_global_job()
+        update_download_watcher()
         return super().form_valid(form)
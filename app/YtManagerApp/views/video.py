@@ -1,11 +1,14 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpRequest, StreamingHttpResponse, FileResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import patch_cache_control
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import DetailView
 from django.db.models import Sum
 
+from YtManagerApp.management.downloader import fetch_video_thumbnail
 from YtManagerApp.models import Video
 
 import datetime
@@ -35,3 +38,18 @@ def video_detail_view(request: HttpRequest, pk):
 
     f = open(video_file, 'rb')
     return FileResponse(f)
+
+
+@login_required
+def video_thumbnail_view(request: HttpRequest, pk):
+    """
+    Redirects to the thumbnail of a video. Thumbnails are fetched and stored the first time they are requested.
+    """
+    video = get_object_or_404(Video, id=pk, subscription__user=request.user)
+    thumbnail = fetch_video_thumbnail(video)
+
+    response = redirect(thumbnail)
+    if not thumbnail.startswith("http"):
+        # The stored thumbnail doesn't change any more
+        patch_cache_control(response, private=True, max_age=7 * 24 * 3600)
+    return response
@@ -0,0 +1,178 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class CacheEntry(object):
+    """A cached API response, together with the ETag youtube returned for it."""
+
+    def __init__(self, etag, body):
+        self.etag = etag
+        self.body = body
+
+    def __repr__(self):
+        return f"<CacheEntry etag={self.etag}>"
+
+
+class ResponseCache(object):
+    """A size bounded, on-disk cache of API responses.
+
+    Responses are stored together with their ETag, keyed by the api endpoint and the query parameters. The cached
+    ETag can then be sent in an 'If-None-Match' header; if youtube answers with '304 Not Modified', the cached body
+    is used instead of downloading and parsing the whole response again.
+
+    When the total size of the cache grows over max_size bytes, the least recently used entries are evicted.
+
+    The cache is thread safe, and keeps count of hits (responses served from the cache) and misses (responses that
+    had to be downloaded).
+
+    """
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        """Initialise the cache.
+
+        :param directory: directory where cached responses are stored
+        :param max_size: maximum total size of the cached responses, in bytes
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._sizes = collections.OrderedDict()  # key -> file size, least recently used first
+        self._total_size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def __repr__(self):
+        return f"<ResponseCache '{self.directory}' entries={len(self._sizes)} size={self._total_size}>"
+
+    def _load_index(self):
+        """Build the in-memory index from the files already on disk, ordered by last access time."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total_size += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    @staticmethod
+    def make_key(endpoint, api_params):
+        """Build a cache key from an endpoint and a dictionary of query parameters."""
+        raw = json.dumps([endpoint, api_params], sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Get a cached entry, or None if the key is not cached."""
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+
+        try:
+            path = self._path(key)
+            with open(path, 'r') as f:
+                data = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            log.warning(f"failed to read cache entry {key}: {e}")
+            self._remove(key)
+            return None
+
+        return CacheEntry(data['etag'], data['body'])
+
+    def hit(self, entry):
+        """Record that a cached entry was used, and return its body."""
+        with self._lock:
+            self.hits += 1
+        return entry.body
+
+    def put(self, key, body):
+        """Store a response body. Responses without an ETag can't be validated, so they are not stored."""
+        with self._lock:
+            self.misses += 1
+
+        etag = body.get('etag')
+        if etag is None:
+            return
+
+        data = json.dumps({'etag': etag, 'body': body}).encode('utf-8')
+        if len(data) > self.max_size:
+            return
+
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning(f"failed to write cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._total_size += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            evicted = self._evict()
+
+        for evicted_key in evicted:
+            self._unlink(evicted_key)
+
+    def _evict(self):
+        """Drop least recently used entries from the index until the size limit is respected.
+
+        Must be called with the lock held; returns the evicted keys, whose files should be deleted.
+
+        """
+        evicted = []
+        while self._total_size > self.max_size and len(self._sizes) > 0:
+            key, size = self._sizes.popitem(last=False)
+            self._total_size -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove(self, key):
+        with self._lock:
+            self._total_size -= self._sizes.pop(key, 0)
+        self._unlink(key)
+
+    def _unlink(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove all the cached entries."""
+        with self._lock:
+            keys = list(self._sizes.keys())
+            self._sizes.clear()
+            self._total_size = 0
+
+        for key in keys:
+            self._unlink(key)
+
+    def stats(self):
+        """Get a dictionary with the cache counters."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._sizes),
+                'size': self._total_size,
+            }
@@ -9,6 +9,7 @@ from abc import ABC, abstractmethod
 from datetime import timedelta
 
 import googleapiclient.discovery
+from googleapiclient.errors import HttpError
 from oauth2client.client import AccessTokenCredentials
 
 from .utils import (
@@ -21,6 +22,21 @@ from .utils import (
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+#: quota units charged by youtube for a single call to each endpoint, see
+#:  https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'search': 100,
+    'videos': 1,
+    'channels': 1,
+    'subscriptions': 1,
+    'playlists': 1,
+    'playlist_items': 1,
+}
+
+#: endpoints whose responses are cached by default. the other ones (e.g. the video statistics) change on almost every
+#:  call, so their etags hardly ever match and caching them would only write to the disk
+CACHED_ENDPOINTS = frozenset(['channels', 'playlists', 'playlist_items'])
+
 
 class DataMissing(Exception):
     """Exception raised if data is not found in a Resource data store."""
@@ -40,13 +56,25 @@ class YouTube(object):
 
     """
 
-    def __init__(self, key=None, access_token=None):
+    def __init__(self, key=None, access_token=None, cache=None, quota_callback=None, api_endpoint=None,
+                 cached_endpoints=CACHED_ENDPOINTS):
         """Initialise the YouTube class.
 
         :param key: developer api key (you need to get this from google)
         :param access_token: access token from some other oauth2 authentication flow
+        :param cache: optional ResponseCache instance; if given, queries are made conditionally using the ETags of
+            the cached responses
+        :param cached_endpoints: endpoints whose responses are stored in the cache (default: CACHED_ENDPOINTS)
+        :param quota_callback: optional function called as quota_callback(endpoint, units) before every request
+            sent to the api, with the quota cost of the request
+        :param api_endpoint: optional base url of the api (e.g. 'http://localhost:8080/'), to use
+            something other than youtube's servers
 
         """
+        self.cache = cache
+        self.cached_endpoints = frozenset(cached_endpoints)
+        self.quota_callback = quota_callback
+
         if key is not None and access_token is not None:
             raise ValueError("you should provide a developer key or an access token, but not both")
 
@@ -56,6 +84,9 @@ class YouTube(object):
             'cache_discovery': False,  # suppress an annoying warning
         }
 
+        if api_endpoint is not None:
+            build_kwargs['client_options'] = {'api_endpoint': api_endpoint}
+
         if access_token is not None:
             # build credentials using given access token
             credentials = AccessTokenCredentials(access_token=access_token, user_agent='pytaw')
@@ -368,18 +399,24 @@ class YouTube(object):
 class Query(object):
     """Everything we need to execute a query and retrieve the raw response dictionary."""
 
-    def __init__(self, youtube, endpoint, api_params=None):
+    def __init__(self, youtube, endpoint, api_params=None, use_cache=None):
         """Initialise the query.
 
         :param youtube: YouTube instance
         :param endpoint: string giving the api endpoint to query, e.g. 'videos', 'search'...
         :param api_params: dict of keyword parameters to send (directly) to the api
+        :param use_cache: whether to use the response cache of the YouTube instance; by default, only the
+            responses of youtube.cached_endpoints are cached
 
         """
         self.youtube = youtube
         self.endpoint = endpoint
         self.api_params = api_params or dict()
 
+        if use_cache is None:
+            use_cache = endpoint in youtube.cached_endpoints
+        self.use_cache = use_cache
+
         if 'part' not in api_params:
             api_params['part'] = 'id'
 
@@ -415,7 +452,33 @@ class Query(object):
             query_params = self.api_params
 
         log.debug(f"executing query with {str(query_params)}")
-        return self.query_func(**query_params).execute()
+        request = self.query_func(**query_params)
+
+        # youtube charges for every request, including the ones answered with '304 Not Modified' and the failed ones
+        if self.youtube.quota_callback is not None:
+            self.youtube.quota_callback(self.endpoint, QUOTA_COSTS.get(self.endpoint, 1))
+
+        cache = self.youtube.cache
+        if cache is None or not self.use_cache:
+            return request.execute()
+
+        # if we have a cached response, only ask for the body if it has changed since then
+        key = cache.make_key(self.endpoint, query_params)
+        cached = cache.get(key)
+        if cached is not None:
+            etag = cached.etag if cached.etag.startswith('"') else f'"{cached.etag}"'
+            request.headers['If-None-Match'] = etag
+
+        try:
+            response = request.execute()
+        except HttpError as e:
+            if cached is not None and e.resp.status == 304:
+                log.debug(f"response not modified, using cached response (etag {cached.etag})")
+                return cache.hit(cached)
+            raise
+
+        cache.put(key, response)
+        return response
 
 
 class ListResponse(collections.Iterator):
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from googleapiclient.errors import HttpError
 
 from pytaw import YouTube
+from pytaw.cache import ResponseCache
 from pytaw.youtube import Resource, Video, AttributeDef
 
 
@@ -162,4 +163,40 @@ class TestListResponse:
             for _ in search:
                 c += 1
 
-            log.debug(f"checked first {c} results (search #{i})")
\ No newline at end of file
+            log.debug(f"checked first {c} results (search #{i})")
+
+
+class TestResponseCache:
+
+    def test_put_and_get(self, tmpdir):
+        cache = ResponseCache(str(tmpdir))
+        key = cache.make_key('videos', {'id': 'jNQXAC9IVRw', 'part': 'id'})
+        assert cache.get(key) is None
+
+        cache.put(key, {'etag': 'abc', 'items': []})
+        entry = cache.get(key)
+        assert entry.etag == 'abc'
+        assert cache.hit(entry) == {'etag': 'abc', 'items': []}
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_key_ignores_parameter_order(self):
+        assert ResponseCache.make_key('videos', {'a': 1, 'b': 2}) == ResponseCache.make_key('videos', {'b': 2, 'a': 1})
+
+    def test_responses_without_etag_are_not_stored(self, tmpdir):
+        cache = ResponseCache(str(tmpdir))
+        cache.put('key', {'items': []})
+        assert cache.get('key') is None
+
+    def test_size_bounded_eviction(self, tmpdir):
+        cache = ResponseCache(str(tmpdir), max_size=1000)
+        for i in range(20):
+            cache.put(f'key{i}', {'etag': str(i), 'items': ['x' * 100]})
+
+        assert cache.stats()['size'] <= 1000
+        assert cache.get('key0') is None
+        assert cache.get('key19') is not None
+
+    def test_index_survives_restart(self, tmpdir):
+        ResponseCache(str(tmpdir)).put('key', {'etag': 'abc'})
+        assert ResponseCache(str(tmpdir)).get('key').etag == 'abc'